@@ -0,0 +1,136 @@
+import logging
+from datetime import datetime, timezone
+
+from pymongo import ReplaceOne
+
+from leases import Lease
+
+logger = logging.getLogger(__name__)
+
+def archive_name(collection):
+    return f"{collection}_archive"
+
+
+async def ensure_archive_indexes(db):
+    await db.students.create_index("year_of_passing")
+    await db.students_archive.create_index("id", unique=True)
+    await db.students_archive.create_index("year_of_passing")
+    for collection in ("applications", "offer_letters"):
+        await db[archive_name(collection)].create_index("id", unique=True)
+        await db[archive_name(collection)].create_index("student_id")
+        await db[archive_name(collection)].create_index("year_of_passing")
+
+
+async def _move(db, collection, docs, year_of_passing):
+    """Copy to the archive, then delete from the hot collection.
+
+    The copy is an idempotent upsert, so a run interrupted between the two
+    steps simply copies the same documents again when resumed.
+    """
+    if not docs:
+        return
+    for doc in docs:
+        # Children are stamped with the batch so rollups need no join
+        doc["year_of_passing"] = year_of_passing
+    await db[archive_name(collection)].bulk_write(
+        [ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in docs], ordered=False
+    )
+    await db[collection].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+
+
+async def rebuild_rollup(db, year_of_passing):
+    """Recompute a batch's totals in archive_rollups from its archived documents"""
+    students = db.students_archive
+    query = {"year_of_passing": year_of_passing}
+    rollup = {
+        "students": await students.count_documents(query),
+        "crt_fee_paid": await students.count_documents({**query, "crt_fee_status": "paid"}),
+        "crt_fee_pending": await students.count_documents({**query, "crt_fee_status": "pending"}),
+        "students_with_backlogs": await students.count_documents({**query, "backlogs_count": {"$gt": 0}}),
+        "applications": await db.applications_archive.count_documents(query),
+        "selected": await db.applications_archive.count_documents({**query, "application_status": "selected"}),
+        "offers": await db.offer_letters_archive.count_documents(query),
+    }
+    by_branch = await students.aggregate([
+        {"$match": query},
+        {"$group": {"_id": "$branch", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    rollup["by_branch"] = {group["_id"]: group["count"] for group in by_branch}
+    await db.archive_rollups.replace_one({"_id": year_of_passing}, rollup, upsert=True)
+    return rollup
+
+
+async def archive_batch(db, year_of_passing, chunk_size=500, on_archived=None):
+    """Move one graduated batch and its applications and offers to *_archive.
+
+    Works in chunks of students, so it can be stopped at any point and rerun:
+    whatever is still in the hot collections is simply picked up again.
+    """
+    lease = Lease(db.leases, f"archive:{year_of_passing}", ttl=300)
+    if not await lease.acquire():
+        raise RuntimeError(f"Batch {year_of_passing} is already being archived")
+
+    runs = db.archive_runs
+    await runs.update_one(
+        {"_id": year_of_passing},
+        {"$set": {"status": "running", "started_at": datetime.now(timezone.utc)},
+         "$setOnInsert": {"archived_students": 0}},
+        upsert=True,
+    )
+    try:
+        while True:
+            students = await db.students.find({"year_of_passing": year_of_passing}).sort("_id", 1).to_list(chunk_size)
+            if not students:
+                break
+            student_ids = [s["id"] for s in students]
+            applications = await db.applications.find({"student_id": {"$in": student_ids}}).to_list(None)
+            offers = await db.offer_letters.find({"student_id": {"$in": student_ids}}).to_list(None)
+
+            # Children first, so an interrupted chunk still finds its students hot
+            await _move(db, "applications", applications, year_of_passing)
+            await _move(db, "offer_letters", offers, year_of_passing)
+            await _move(db, "students", students, year_of_passing)
+
+            await runs.update_one(
+                {"_id": year_of_passing},
+                {"$inc": {"archived_students": len(students)},
+                 "$set": {"last_student_id": student_ids[-1], "updated_at": datetime.now(timezone.utc)}},
+            )
+            if on_archived:
+                await on_archived("applications", [a["id"] for a in applications])
+                await on_archived("offer_letters", [o["id"] for o in offers])
+                await on_archived("students", student_ids)
+            if not await lease.acquire():
+                raise RuntimeError(f"Lost the archive lease for batch {year_of_passing}")
+            logger.info(f"Archived {len(students)} students of batch {year_of_passing}")
+
+        await rebuild_rollup(db, year_of_passing)
+        await runs.update_one(
+            {"_id": year_of_passing},
+            {"$set": {"status": "completed", "finished_at": datetime.now(timezone.utc)}},
+        )
+    except Exception as e:
+        await runs.update_one({"_id": year_of_passing}, {"$set": {"status": "failed", "error": str(e)}})
+        raise
+    finally:
+        await lease.release()
+
+
+def union_pipeline(collection, query, include_archived, sort=None, limit=1000):
+    """Aggregation reading the hot collection, plus its archive on request"""
+    pipeline = [{"$match": query}]
+    if include_archived:
+        pipeline.append({"$unionWith": {"coll": archive_name(collection), "pipeline": [{"$match": query}]}})
+    if sort:
+        pipeline.append({"$sort": {sort[0]: sort[1]}})
+    pipeline.append({"$limit": limit})
+    return pipeline
+
+
+async def archived_totals(db):
+    """Sum of archive_rollups across batches"""
+    totals = {}
+    async for rollup in db.archive_rollups.find({}, {"_id": 0, "by_branch": 0}):
+        for key, value in rollup.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
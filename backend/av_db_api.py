@@ -1,58 +1,461 @@
-from flask import Flask, request, jsonify, Response
-import io
-
-app = Flask(__name__)
-
-# In-memory AV database (audio/video entries)
-av_db = [
-    {"id": 1, "name": "Sample Audio", "type": "audio", "path": "/media/audio1.mp3", "category": "music"},
-    {"id": 2, "name": "Sample Video", "type": "video", "path": "/media/video1.mp4", "category": "movie"}
-]
-
-@app.route('/api/avdb', methods=['GET'])
-def get_av_db():
-    filter_text = request.args.get('filter', '').lower()
-    result = [entry for entry in av_db if filter_text in entry['name'].lower()] if filter_text else av_db
-    return jsonify(result)
-
-@app.route('/api/avdb', methods=['POST'])
-def add_av_entry():
-    data = request.json
-    new_id = max((entry['id'] for entry in av_db), default=0) + 1
-    av_db.append({"id": new_id, **data})
-    return jsonify({"message": "Added", "id": new_id})
-
-@app.route('/api/avdb/<int:id>', methods=['PUT'])
-def edit_av_entry(id):
-    data = request.json
-    for entry in av_db:
-        if entry['id'] == id:
-            entry.update(data)
-            return jsonify({"message": "Edited"})
-    return jsonify({"error": "Not found"}), 404
-
-@app.route('/api/avdb/<int:id>', methods=['DELETE'])
-def delete_av_entry(id):
-    global av_db
-    av_db = [entry for entry in av_db if entry['id'] != id]
-    return jsonify({"message": "Deleted"})
-
-@app.route('/api/avdb/import', methods=['POST'])
-def import_av_db():
-    file = request.files['file']
-    content = file.read().decode()
-    for line in content.strip().split('\n')[1:]:
-        id_str, name, type_, path, category = line.split(',', 4)
-        av_db.append({"id": int(id_str), "name": name, "type": type_, "path": path, "category": category})
-    return jsonify({"message": "Imported"})
-
-@app.route('/api/avdb/export', methods=['GET'])
-def export_av_db():
-    output = io.StringIO()
-    output.write("id,name,type,path,category\n")
-    for entry in av_db:
-        output.write(f"{entry['id']},{entry['name']},{entry['type']},{entry['path']},{entry['category']}\n")
-    return Response(output.getvalue(), mimetype='text/csv')
-
-if __name__ == "__main__":
-    app.run(port=5000, debug=True)
\ No newline at end of file
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from typing import List, Optional
+import asyncio
+import csv
+import logging
+import mimetypes
+import os
+import threading
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from category_api import categories, category_tree
+from csv_io import AV_SCHEMA, SKIP, import_csv, iter_csv
+from dedup import find_duplicates, merge_fields
+from media_probe import ProbeCache, probe_cached, scan
+from persistence import StoreLocked, StorePersistence
+from resumes import parse_range
+from stores import IndexedStore
+
+logger = logging.getLogger(__name__)
+
+# In-memory AV database (audio/video entries), persisted as snapshot + write-ahead log
+# and opened by the app's startup hook, after the category store it joins to
+AV_DATA_DIR = Path(os.environ.get('AV_DATA_DIR', Path(__file__).parent / 'data' / 'avdb'))
+av_db = IndexedStore(indexed=("type", "category_id"))
+av_db_persistence = StorePersistence(av_db, AV_DATA_DIR)
+
+def open_av_db():
+    if categories.journal is None:
+        logger.warning("AV service disabled in this process: the category store is not open")
+        return False
+    try:
+        av_db_persistence.open(seed=[
+            {"id": 1, "name": "Sample Audio", "type": "audio", "path": "/media/audio1.mp3", "category": "music"},
+            {"id": 2, "name": "Sample Video", "type": "video", "path": "/media/video1.mp4", "category": "movie"}
+        ])
+    except StoreLocked as e:
+        logger.warning(f"AV service disabled in this process: {e}")
+        return False
+    link_categories()
+    av_db_persistence.start()
+    return True
+
+def close_av_db():
+    av_db_persistence.close()
+
+def require_av_db():
+    if av_db.journal is None:
+        raise HTTPException(status_code=503, detail="The AV catalog is served by another process")
+
+router = APIRouter(prefix="/api/avdb", dependencies=[Depends(require_av_db)])
+
+class AVEntryCreate(BaseModel):
+    name: str
+    type: str
+    path: str
+    category_id: Optional[int] = None
+    # A category name or label path ("Media / Music"), resolved to its id
+    category: Optional[str] = None
+
+class AVEntryUpdate(BaseModel):
+    name: Optional[str] = None
+    type: Optional[str] = None
+    path: Optional[str] = None
+    category_id: Optional[int] = None
+    category: Optional[str] = None
+
+class DuplicateMerge(BaseModel):
+    groups: Optional[List[List[int]]] = None
+
+# Entries reference categories by id; a category filter covers its whole subtree
+def with_category_id(data, create=True):
+    """Replace a category name or label path with the category's id, creating what does not exist.
+
+    With create=False an unknown name stays in 'category' instead, for
+    CsvImportTarget to create once the row is known to be written.
+    """
+    data = dict(data)
+    name = data.pop('category', None)
+    if data.get('category_id') is None and name:
+        data['category_id'] = category_tree.resolve(name, create=create)
+        if data['category_id'] is None:
+            data['category'] = name
+    if data.get('category_id') is not None and category_tree.get(data['category_id']) is None:
+        raise ValueError(f"category_id {data['category_id']} does not exist")
+    return data
+
+class CsvImportTarget:
+    """The store import_csv writes AV rows to: categories named by a chunk's
+    rows are created under the store lock, and only for rows put_many will
+    write, so rows skipped as conflicts or rejected as invalid leave none behind"""
+
+    def put_many(self, entries, replace=True):
+        with av_db.lock:
+            written = set()
+            for entry in entries:
+                name = entry.pop('category', None)
+                entry_id = entry.get('id')
+                if entry_id is not None and not replace:
+                    if entry_id in av_db or entry_id in written:
+                        continue
+                    written.add(entry_id)
+                if name:
+                    entry['category_id'] = category_tree.resolve(name, create=True)
+            return av_db.put_many(entries, replace)
+
+def link_categories():
+    """Point entries written before the category tree, which name their category, at its id"""
+    with av_db.lock:
+        legacy = [with_category_id(entry) for entry in av_db if 'category' in entry]
+        if legacy:
+            av_db.put_many(legacy)
+
+def repoint_entries(category_id, parent_id):
+    """Entries of a deleted category move up to its parent, like its child categories"""
+    if av_db.journal is None:
+        return
+    with av_db.lock:
+        moved = [{**entry, 'category_id': parent_id} for entry in av_db.filter(category_id=[category_id])]
+        if moved:
+            av_db.put_many(moved)
+
+category_tree.on_delete(repoint_entries)
+
+def category_ids(category_id, category, subtree):
+    if category_id is None and category:
+        category_id = category_tree.resolve(category)
+        if category_id is None:
+            return []
+    if category_id is None:
+        return None
+    if not subtree:
+        return [category_id]
+    # One range of the category path index, then one index lookup per category
+    return category_tree.subtree_ids(category_id)
+
+def filtered_entries(
+    filter: Optional[str] = None,
+    type: Optional[str] = None,
+    category_id: Optional[int] = None,
+    category: Optional[str] = None,
+    subtree: bool = True,
+):
+    return av_db.filter(filter, type=type, category_id=category_ids(category_id, category, subtree))
+
+# Handlers that touch the store are plain functions: FastAPI runs them in its
+# threadpool, where the store's reader/writer lock and journal fsyncs do not
+# block the event loop
+@router.get("")
+def get_av_db(entries: list = Depends(filtered_entries)):
+    return entries
+
+@router.get("/suggest")
+def suggest_av_entries(q: str = "", limit: int = Query(10, ge=1, le=50)):
+    """Search-box suggestions for ?q: name completions first, then typo-tolerant matches"""
+    return [
+        {"id": entry["id"], "name": entry["name"], "type": entry.get("type"), "match": match, "score": score}
+        for entry, match, score in av_db.suggest(q, limit)
+    ]
+
+@router.post("")
+def add_av_entry(entry: AVEntryCreate):
+    try:
+        data = with_category_id(entry.dict(exclude_none=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    new_id = av_db.add(data)
+    return {"message": "Added", "id": new_id}
+
+@router.put("/{entry_id}")
+def edit_av_entry(entry_id: int, update: AVEntryUpdate):
+    try:
+        data = with_category_id(update.dict(exclude_unset=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if av_db.update(entry_id, data) is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return {"message": "Edited"}
+
+@router.delete("/{entry_id}")
+def delete_av_entry(entry_id: int):
+    av_db.delete(entry_id)
+    return {"message": "Deleted"}
+
+# Media streaming; only files under AV_MEDIA_ROOTS (colon separated) are served
+MEDIA_ROOTS = [os.path.realpath(root) for root in os.environ.get('AV_MEDIA_ROOTS', '/media').split(':') if root]
+MEDIA_CHUNK = 256 * 1024
+stream_slots = threading.BoundedSemaphore(int(os.environ.get('AV_MAX_STREAMS', '32')))
+
+def media_file(entry):
+    path = os.path.realpath(entry.get('path') or '')
+    if not any(os.path.commonpath([root, path]) == root for root in MEDIA_ROOTS):
+        return None
+    return path if os.path.isfile(path) else None
+
+def release_once(release):
+    released = []
+
+    def run():
+        if not released:
+            released.append(True)
+            release()
+    return run
+
+async def iter_file(path, start, end, release):
+    """Yield bytes [start, end] of a file, read in a worker thread"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(MEDIA_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    finally:
+        release()
+
+class MediaResponse(StreamingResponse):
+    """Bytes [start, end] of a file, handed to the server with the ASGI
+    zero-copy send extension when it offers one, read through iter_file otherwise"""
+
+    def __init__(self, path, start, end, release, **kwargs):
+        super().__init__(iter_file(path, start, end, release), **kwargs)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        if "http.response.zerocopysend" not in scope.get("extensions", {}):
+            await super().__call__(scope, receive, send)
+            return
+        try:
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": self.start,
+                            "count": self.end - self.start + 1})
+        finally:
+            self.release()
+            if self.background is not None:
+                await self.background()
+
+def not_modified(etag, mtime, if_none_match, if_modified_since):
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@router.api_route("/{entry_id}/stream", methods=["GET", "HEAD"])
+async def stream_av_entry(
+    entry_id: int,
+    request: Request,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    if_modified_since: Optional[str] = Header(None, alias="If-Modified-Since"),
+):
+    """Serve the entry's file with Range, ETag and Last-Modified support"""
+    entry = av_db.get(entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    path = media_file(entry)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Media file not found")
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=3600",
+    }
+    if not_modified(etag, stat.st_mtime, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+
+    # A Range is only honoured if the client's copy (If-Range) is still current
+    if if_range and if_range.strip() not in (etag, last_modified):
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{stat.st_size}"})
+    status_code = 200
+    start, end = 0, stat.st_size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+
+    if not stream_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Too many concurrent streams", headers={"Retry-After": "5"})
+    # The slot is freed when the body is exhausted or abandoned, or by the
+    # background task if the client disconnects before the body starts
+    release = release_once(stream_slots.release)
+    return MediaResponse(path, start, end, release, status_code=status_code,
+                         media_type=media_type, headers=headers, background=BackgroundTask(release))
+
+# Media metadata (duration, bitrate, codec, resolution, size) stored on each entry as "media"
+probe_cache = ProbeCache(AV_DATA_DIR / 'probe-cache.json')
+scan_status = {"running": False}
+scan_lock = threading.Lock()
+
+def run_scan():
+    files = {}
+    for entry in av_db.filter():
+        path = media_file(entry)
+        if path:
+            files[entry['id']] = path
+
+    def progress(done, total):
+        scan_status.update(done=done, total=total)
+
+    try:
+        results = scan(files, probe_cache, on_progress=progress)
+        updated = 0
+        for entry_id, info in results.items():
+            entry = av_db.get(entry_id)
+            if entry is not None and entry.get('media') != info:
+                av_db.update(entry_id, {"media": info})
+                updated += 1
+        scan_status.update(updated=updated, done=len(files), total=len(files))
+    except Exception as e:
+        logger.exception("Media scan failed")
+        scan_status["error"] = str(e)
+    finally:
+        scan_status.update(running=False, finished_at=datetime.now(timezone.utc).isoformat())
+
+@router.post("/scan")
+def start_media_scan():
+    """Probe every entry's file in a process pool; unchanged files come from the cache"""
+    with scan_lock:
+        if scan_status.get("running"):
+            return JSONResponse(dict(scan_status), status_code=409)
+        scan_status.clear()
+        scan_status.update(running=True, done=0, total=None, started_at=datetime.now(timezone.utc).isoformat())
+        threading.Thread(target=run_scan, name="media-scan", daemon=True).start()
+        return JSONResponse(dict(scan_status), status_code=202)
+
+@router.get("/scan")
+def get_media_scan():
+    return dict(scan_status)
+
+@router.get("/{entry_id}/metadata")
+def get_av_metadata(entry_id: int):
+    entry = av_db.get(entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    path = media_file(entry)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Media file not found")
+    return probe_cached(path, probe_cache)
+
+# Duplicate detection by content: size, then first/last chunk hash, then full hash
+hash_cache = ProbeCache(AV_DATA_DIR / 'hash-cache.json')
+dedup_status = {"running": False, "groups": []}
+dedup_lock = threading.Lock()
+
+def run_dedup():
+    files = {}
+    for entry in av_db.filter():
+        path = media_file(entry)
+        if path:
+            files[entry['id']] = path
+
+    def progress(stage, done, total):
+        dedup_status.update(stage=stage, done=done, total=total)
+
+    try:
+        groups, stats = find_duplicates(files, hash_cache, on_progress=progress)
+        dedup_status.update(groups=groups, stats=stats)
+    except Exception as e:
+        logger.exception("Duplicate scan failed")
+        dedup_status["error"] = str(e)
+    finally:
+        dedup_status.update(running=False, finished_at=datetime.now(timezone.utc).isoformat())
+
+@router.post("/duplicates/scan")
+def start_duplicate_scan():
+    """Find entries whose files have identical content; unchanged files reuse cached hashes"""
+    with dedup_lock:
+        if dedup_status.get("running"):
+            return JSONResponse(dict(dedup_status), status_code=409)
+        dedup_status.clear()
+        dedup_status.update(running=True, groups=[], started_at=datetime.now(timezone.utc).isoformat())
+        threading.Thread(target=run_dedup, name="duplicate-scan", daemon=True).start()
+        return JSONResponse(dict(dedup_status), status_code=202)
+
+@router.get("/duplicates")
+def get_duplicates():
+    return dict(dedup_status)
+
+@router.post("/duplicates/merge")
+def merge_duplicates(merge: Optional[DuplicateMerge] = None):
+    """Merge duplicate groups from the last scan into their lowest-id entry.
+
+    The body may list groups as {"groups": [[id, ...], ...]}, each within
+    one reported group; by default every reported group is merged. Names
+    and paths of removed entries are kept on the survivor as aliases.
+    Files on disk are not touched.
+    """
+    with dedup_lock:
+        if dedup_status.get("running"):
+            raise HTTPException(status_code=409, detail="A duplicate scan is running")
+        reported = [set(group["entries"]) for group in dedup_status.get("groups", [])]
+        requested = merge.groups if merge and merge.groups is not None else [sorted(group) for group in reported]
+        for group in requested:
+            if not any(set(group) <= entries for entries in reported):
+                raise HTTPException(status_code=400, detail=f"{group} is not a reported duplicate group")
+
+        merged, removed = [], 0
+        with av_db.lock:
+            for group in requested:
+                entries = [av_db.get(entry_id) for entry_id in sorted(set(group))]
+                entries = [entry for entry in entries if entry is not None]
+                if len(entries) < 2:
+                    continue
+                keep, duplicates = entries[0], entries[1:]
+                av_db.merge(keep['id'], merge_fields(keep, duplicates), [entry['id'] for entry in duplicates])
+                merged.append({"kept": keep['id'], "removed": [entry['id'] for entry in duplicates]})
+                removed += len(duplicates)
+        merged_ids = {entry_id for group in merged for entry_id in group["removed"]}
+        remaining = []
+        for group in dedup_status.get("groups", []):
+            entry_ids = [entry_id for entry_id in group["entries"] if entry_id not in merged_ids]
+            if len(entry_ids) > 1:
+                remaining.append({**group, "entries": entry_ids})
+        dedup_status["groups"] = remaining
+    return {"message": "Merged", "merged": merged, "removed": removed}
+
+@router.post("/import")
+def import_av_db(file: UploadFile = File(...), on_conflict: str = SKIP):
+    try:
+        summary = import_csv(CsvImportTarget(), file.file, AV_SCHEMA, on_conflict,
+                             prepare=lambda entry: with_category_id(entry, create=False))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Import stopped: {e}")
+    return {"message": "Imported", **summary}
+
+@router.get("/export")
+def export_av_db(entries: list = Depends(filtered_entries)):
+    # filtered_entries holds references, not copies, and edits replace entries
+    # rather than change them, so the export streams a consistent view without
+    # duplicating the catalog; the category column is its path of names
+    rows = ({**entry, "category": category_tree.label(entry.get('category_id'))} for entry in entries)
+    return StreamingResponse(iter_csv(rows, AV_SCHEMA.columns), media_type='text/csv',
+                             headers={"Content-Disposition": "attachment; filename=av_db.csv"})
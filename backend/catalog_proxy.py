@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connection-level headers are not forwarded; httpx sets Host for the socket
+HOP_BY_HOP = {
+    b"connection", b"keep-alive", b"proxy-connection", b"te", b"trailer",
+    b"transfer-encoding", b"upgrade", b"host",
+}
+
+
+class CatalogOwner:
+    """Takes the catalog store locks once they are free and serves the catalogs on a unix socket.
+
+    `open_stores` is retried every `retry_interval` seconds, so when the
+    owning worker exits another one loads the stores and takes over the
+    socket. Until then, `client()` reaches whichever worker owns them.
+    """
+
+    def __init__(self, app, socket_path, open_stores, retry_interval=5.0, timeout=300.0, transport=None):
+        self.app = app
+        self.socket_path = Path(socket_path)
+        self.open_stores = open_stores
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.transport = transport
+        self.owned = False
+        self.server = None
+        self.task = None
+        self._client = None
+
+    async def run(self):
+        while not await asyncio.to_thread(self.open_stores):
+            await asyncio.sleep(self.retry_interval)
+        self.owned = True
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        # Only the lock holder gets here, so a socket left behind is stale
+        self.socket_path.unlink(missing_ok=True)
+        # Imported here: only the owning worker runs a second server
+        import uvicorn
+
+        class SocketServer(uvicorn.Server):
+            # The worker's own server already handles SIGINT/SIGTERM
+            def install_signal_handlers(self):
+                pass
+
+        self.server = SocketServer(uvicorn.Config(
+            self.app, uds=str(self.socket_path), lifespan="off", log_config=None, access_log=False,
+        ))
+        logger.info(f"Serving the catalogs for other workers on {self.socket_path}")
+        await self.server.serve()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=self.transport or httpx.AsyncHTTPTransport(uds=str(self.socket_path)),
+                base_url="http://catalog",
+                timeout=httpx.Timeout(self.timeout, connect=2.0),
+            )
+        return self._client
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.server is not None and self.server.started:
+            self.server.should_exit = True
+            await self.task
+            self.socket_path.unlink(missing_ok=True)
+        elif self.task is not None:
+            self.task.cancel()
+
+
+class CatalogProxyMiddleware:
+    """Forwards catalog requests to the owning worker when this one does not hold the stores.
+
+    Request and response bodies are streamed, so uploads, exports and ranged
+    media downloads behave as if served locally.
+    """
+
+    def __init__(self, app, owner: CatalogOwner, prefixes):
+        self.app = app
+        self.owner = owner
+        self.prefixes = tuple(prefixes)
+
+    async def _reject(self, send, status, detail):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", b"1")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes) or self.owner.owned:
+            await self.app(scope, receive, send)
+            return
+
+        headers = [(k, v) for k, v in scope["headers"] if k.lower() not in HOP_BY_HOP]
+        has_body = any(k.lower() in (b"content-length", b"transfer-encoding") for k, _ in scope["headers"])
+
+        async def body():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                yield message.get("body", b"")
+                if not message.get("more_body"):
+                    return
+
+        url = (scope.get("raw_path") or scope["path"].encode()).decode("latin-1")
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode("latin-1")
+        client = self.owner.client()
+        request = client.build_request(scope["method"], url, headers=headers, content=body() if has_body else None)
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TransportError as e:
+            # Between owners: the previous one exited and the next has not opened the stores yet
+            logger.warning(f"Catalog request {scope['method']} {scope['path']} could not be forwarded: {e}")
+            await self._reject(send, 503, "The catalogs are not available yet, retry shortly")
+            return
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(k, v) for k, v in response.headers.raw if k.lower() not in HOP_BY_HOP],
+            })
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await response.aclose()
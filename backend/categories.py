@@ -0,0 +1,258 @@
+import bisect
+
+
+class CategoryError(ValueError):
+    pass
+
+
+# Separates ancestor names in labels, "Media / Music / Jazz"
+PATH_SEPARATOR = " / "
+
+
+class CategoryTree:
+    """Category hierarchy kept in an IndexedStore as materialized paths.
+
+    Every category stores its parent_id and its path, the ids from the root
+    down as "/1/4/9/". The paths are also held in a sorted list, so a whole
+    subtree is one bisect range instead of a walk over children. Moving a
+    category rewrites its own and its descendants' paths in one journaled
+    batch.
+    """
+
+    # Paths contain only digits and "/", which all sort before this
+    _PATH_END = "\x7f"
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = store.lock
+        self._delete_callbacks = []
+        self.reload()
+
+    def reload(self):
+        """Rebuild the path index, e.g. after the store was loaded from disk"""
+        with self.lock:
+            # Categories from before the hierarchy existed become roots
+            flat = [{**entry, "parent_id": None, "path": f"/{entry['id']}/"}
+                    for entry in self.store if not entry.get("path")]
+            if flat:
+                self.store.put_many(flat)
+            pairs = sorted((entry["path"], entry["id"]) for entry in self.store)
+            self._paths = [path for path, _ in pairs]
+            self._ids = [category_id for _, category_id in pairs]
+
+    def __len__(self):
+        return len(self.store)
+
+    def get(self, category_id):
+        return self.store.get(category_id)
+
+    def _insert(self, path, category_id):
+        position = bisect.bisect_left(self._paths, path)
+        self._paths.insert(position, path)
+        self._ids.insert(position, category_id)
+
+    def _range(self, path):
+        return (bisect.bisect_left(self._paths, path),
+                bisect.bisect_left(self._paths, path + self._PATH_END))
+
+    def _require(self, category_id, pending=None):
+        category = pending.get(category_id) if pending else None
+        if category is None:
+            category = self.store.get(category_id)
+        if category is None:
+            raise CategoryError(f"Category {category_id} does not exist")
+        return category
+
+    def subtree_ids(self, category_id):
+        """Ids of the category and all its descendants, or an empty list if it does not exist"""
+        with self.lock.read():
+            category = self.store.get(category_id)
+            if category is None:
+                return []
+            start, end = self._range(category["path"])
+            return self._ids[start:end]
+
+    def subtree(self, category_id):
+        return [self.store.get(category_id) for category_id in self.subtree_ids(category_id)]
+
+    def entries(self):
+        """All categories in path order, so parents precede their children"""
+        with self.lock.read():
+            ids = list(self._ids)
+        return [self.store.get(category_id) for category_id in ids]
+
+    def children(self, category_id):
+        return [category for category in self.subtree(category_id)[1:] if category["parent_id"] == category_id]
+
+    def ancestors(self, category_id):
+        """Categories from the root down to the given one"""
+        category = self._require(category_id)
+        return [self.store.get(int(part)) for part in category["path"].strip("/").split("/")]
+
+    def label(self, category_id):
+        category = self.store.get(category_id)
+        if category is None:
+            return None
+        return PATH_SEPARATOR.join(ancestor["name"] for ancestor in self.ancestors(category_id))
+
+    def find(self, name, parent_id=None, anywhere=True):
+        """Lowest-id category with exactly this name (case-insensitive).
+
+        With anywhere=False only children of parent_id (roots for None) match.
+        """
+        name = name.strip().lower()
+        for category in self.store.filter(name):
+            if category["name"].lower() != name:
+                continue
+            if (anywhere and parent_id is None) or category["parent_id"] == parent_id:
+                return category
+        return None
+
+    def resolve(self, name, create=False):
+        """Category id for a name or a label path such as "Media / Music".
+
+        A plain name matches a category anywhere in the tree; a path is
+        followed from a root down. With create=True, what is missing is
+        created: an unknown name as a root, the missing tail of a path under
+        the last category found.
+        """
+        category = self.find(name)
+        if category is not None:
+            return category["id"]
+        parts = [part.strip() for part in name.split(PATH_SEPARATOR)]
+        if len(parts) == 1 or not all(parts):
+            return self.add(name.strip()) if create and name.strip() else None
+        with self.lock:
+            parent_id = None
+            for depth, part in enumerate(parts):
+                category = self.find(part, parent_id, anywhere=False)
+                if category is None:
+                    if not create:
+                        return None
+                    for missing in parts[depth:]:
+                        parent_id = self.add(missing, parent_id)
+                    return parent_id
+                parent_id = category["id"]
+            return parent_id
+
+    def _parent_path(self, parent_id, pending=None):
+        return self._require(parent_id, pending)["path"] if parent_id is not None else "/"
+
+    # Changes are staged in `pending` (id -> new entry) and written with one
+    # put_many, so a move with its subtree or a whole import chunk is a single
+    # journal record, replayed entirely or not at all
+    def _stage_add(self, name, parent_id, category_id, pending):
+        if category_id is None:
+            category_id = max(self.store.next_id, max(pending, default=0) + 1)
+        elif category_id in self.store or category_id in pending:
+            raise CategoryError(f"Category {category_id} already exists")
+        path = f"{self._parent_path(parent_id, pending)}{category_id}/"
+        pending[category_id] = {"id": category_id, "name": name, "parent_id": parent_id, "path": path}
+        self._insert(path, category_id)
+        return category_id
+
+    def _stage_move(self, category_id, parent_id, pending):
+        category = self._require(category_id, pending)
+        old_path = category["path"]
+        parent_path = self._parent_path(parent_id, pending)
+        if parent_path.startswith(old_path):
+            raise CategoryError("A category cannot be moved under itself or its descendants")
+        new_path = f"{parent_path}{category_id}/"
+        if new_path == old_path:
+            return category
+        start, end = self._range(old_path)
+        moved = []
+        for descendant_id in self._ids[start:end]:
+            descendant = self._require(descendant_id, pending)
+            moved.append({**descendant, "path": new_path + descendant["path"][len(old_path):]})
+        moved[0]["parent_id"] = parent_id
+        del self._paths[start:end]
+        del self._ids[start:end]
+        for entry in moved:
+            self._insert(entry["path"], entry["id"])
+            pending[entry["id"]] = entry
+        return moved[0]
+
+    def _stage_rename(self, category_id, name, pending):
+        category = pending[category_id] = {**self._require(category_id, pending), "name": name}
+        return category
+
+    def _write(self, pending):
+        if pending:
+            self.store.put_many(list(pending.values()))
+
+    def add(self, name, parent_id=None, category_id=None):
+        with self.lock:
+            pending = {}
+            category_id = self._stage_add(name, parent_id, category_id, pending)
+            self._write(pending)
+        return category_id
+
+    def rename(self, category_id, name):
+        with self.lock:
+            pending = {}
+            category = self._stage_rename(category_id, name, pending)
+            self._write(pending)
+            return category
+
+    def move(self, category_id, parent_id):
+        """Reattach a category, with its subtree, under another parent (None for the root)"""
+        with self.lock:
+            pending = {}
+            category = self._stage_move(category_id, parent_id, pending)
+            self._write(pending)
+            return category
+
+    def on_delete(self, callback):
+        """Call callback(category_id, parent_id) after a category is deleted, to re-point references to it"""
+        self._delete_callbacks.append(callback)
+
+    def delete(self, category_id):
+        """Remove a category; its children, and whatever on_delete callbacks re-point, move up to its parent"""
+        with self.lock:
+            category = self._require(category_id)
+            pending = {}
+            for child in self.children(category_id):
+                self._stage_move(child["id"], category["parent_id"], pending)
+            self._write(pending)
+            start, _ = self._range(category["path"])
+            del self._paths[start]
+            del self._ids[start]
+            deleted = self.store.delete(category_id)
+        # Outside the lock: callbacks take other stores' locks, which may be
+        # held by threads waiting for this one
+        for callback in self._delete_callbacks:
+            callback(category_id, category["parent_id"])
+        return deleted
+
+    def put_many(self, entries, replace=True):
+        """Bulk import interface used by csv_io: adds new categories, renames and moves existing ones.
+
+        Parents must exist or come earlier in the input; entries whose parent
+        is unknown are skipped. The whole batch is one journal record.
+        Returns (inserted, replaced, skipped).
+        """
+        inserted = replaced = skipped = 0
+        with self.lock:
+            pending = {}
+            for entry in entries:
+                parent_id = entry.get("parent_id")
+                if parent_id is not None and parent_id not in self.store and parent_id not in pending:
+                    skipped += 1
+                    continue
+                if entry.get("id") in self.store or entry.get("id") in pending:
+                    if not replace:
+                        skipped += 1
+                        continue
+                    try:
+                        self._stage_move(entry["id"], parent_id, pending)
+                    except CategoryError:
+                        skipped += 1
+                        continue
+                    self._stage_rename(entry["id"], entry["name"], pending)
+                    replaced += 1
+                else:
+                    self._stage_add(entry["name"], parent_id, entry.get("id"), pending)
+                    inserted += 1
+            self._write(pending)
+        return inserted, replaced, skipped
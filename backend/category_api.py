@@ -1,54 +1,130 @@
-from flask import Flask, request, jsonify, Response
-import io
-
-app = Flask(__name__)
-
-categories = [
-    {"id": 1, "name": "Books"},
-    {"id": 2, "name": "Electronics"}
-]
-
-@app.route('/api/categories', methods=['GET'])
-def get_categories():
-    filter_text = request.args.get('filter', '').lower()
-    result = [c for c in categories if filter_text in c['name'].lower()] if filter_text else categories
-    return jsonify(result)
-
-@app.route('/api/categories', methods=['POST'])
-def add_category():
-    data = request.json
-    new_id = max((c['id'] for c in categories), default=0) + 1
-    categories.append({"id": new_id, "name": data['name']})
-    return jsonify({"message": "Added", "id": new_id})
-
-@app.route('/api/categories/<int:id>', methods=['PUT'])
-def edit_category(id):
-    data = request.json
-    for c in categories:
-        if c['id'] == id:
-            c['name'] = data['name']
-            return jsonify({"message": "Edited"})
-    return jsonify({"error": "Not found"}), 404
-
-@app.route('/api/categories/<int:id>', methods=['DELETE'])
-def delete_category(id):
-    global categories
-    categories = [c for c in categories if c['id'] != id]
-    return jsonify({"message": "Deleted"})
-
-@app.route('/api/categories/import', methods=['POST'])
-def import_categories():
-    file = request.files['file']
-    content = file.read().decode()
-    for line in content.strip().split('\n')[1:]:
-        id_str, name = line.split(',', 1)
-        categories.append({"id": int(id_str), "name": name})
-    return jsonify({"message": "Imported"})
-
-@app.route('/api/categories/export', methods=['GET'])
-def export_categories():
-    output = io.StringIO()
-    output.write("id,name\n")
-    for c in categories:
-        output.write(f"{c['id']},{c['name']}\n")
-    return Response(output.getvalue(), mimetype='text/csv')
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Optional
+import csv
+import logging
+import os
+from pathlib import Path
+
+from categories import CategoryError, CategoryTree
+from csv_io import CATEGORY_SCHEMA, SKIP, import_csv, iter_csv
+from persistence import StoreLocked, StorePersistence
+from stores import IndexedStore
+
+logger = logging.getLogger(__name__)
+
+# Category hierarchy, persisted as snapshot + write-ahead log. The store is
+# opened by the worker that locks the directory first; the other uvicorn
+# workers forward category requests to it (see catalog_proxy).
+CATEGORY_DATA_DIR = Path(os.environ.get('CATEGORY_DATA_DIR', Path(__file__).parent / 'data' / 'categories'))
+categories = IndexedStore(indexed=("parent_id",))
+category_tree = CategoryTree(categories)
+categories_persistence = StorePersistence(categories, CATEGORY_DATA_DIR)
+
+def open_categories():
+    try:
+        categories_persistence.open(seed=[
+            {"id": 1, "name": "Books"},
+            {"id": 2, "name": "Electronics"}
+        ])
+    except StoreLocked as e:
+        logger.warning(f"Category service disabled in this process: {e}")
+        return False
+    category_tree.reload()
+    categories_persistence.start()
+    return True
+
+def close_categories():
+    categories_persistence.close()
+
+def require_categories():
+    if categories.journal is None:
+        raise HTTPException(status_code=503, detail="Categories are served by another process")
+
+router = APIRouter(prefix="/api/categories", dependencies=[Depends(require_categories)])
+
+class CategoryCreate(BaseModel):
+    name: str
+    parent_id: Optional[int] = None
+
+class CategoryUpdate(BaseModel):
+    name: Optional[str] = None
+    # null moves the category to the root; leaving it out keeps the parent
+    parent_id: Optional[int] = None
+
+# Handlers are plain functions: FastAPI runs them in its threadpool, where
+# the store's reader/writer lock and journal fsyncs do not block the event loop
+@router.get("")
+def get_categories(filter: Optional[str] = None, parent_id: Optional[str] = None):
+    if parent_id is not None:
+        # ?parent_id=<id> lists its children, an empty parent_id the roots
+        if not parent_id:
+            return [category for category in categories.filter(filter) if category['parent_id'] is None]
+        try:
+            return categories.filter(filter, parent_id=int(parent_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="parent_id must be an integer")
+    return categories.filter(filter)
+
+@router.get("/suggest")
+def suggest_categories(q: str = "", limit: int = Query(10, ge=1, le=50)):
+    """Search-box suggestions for ?q: name completions first, then typo-tolerant matches"""
+    return [
+        {"id": category["id"], "name": category["name"], "label": category_tree.label(category["id"]),
+         "match": match, "score": score}
+        for category, match, score in categories.suggest(q, limit)
+    ]
+
+@router.get("/export")
+def export_categories(filter: Optional[str] = None):
+    # Path order puts parents before children, so the file imports back as is
+    entries = category_tree.entries()
+    if filter:
+        matching = {category['id'] for category in categories.filter(filter)}
+        entries = [category for category in entries if category['id'] in matching]
+    return StreamingResponse(iter_csv(entries, CATEGORY_SCHEMA.columns), media_type='text/csv',
+                             headers={"Content-Disposition": "attachment; filename=categories.csv"})
+
+@router.get("/{category_id}/subtree")
+def get_category_subtree(category_id: int):
+    """The category and all its descendants in path order, from one range of the path index"""
+    if category_tree.get(category_id) is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return category_tree.subtree(category_id)
+
+@router.post("")
+def add_category(category: CategoryCreate):
+    try:
+        new_id = category_tree.add(category.name, category.parent_id)
+    except CategoryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Added", "id": new_id}
+
+@router.put("/{category_id}")
+def edit_category(category_id: int, update: CategoryUpdate):
+    if category_tree.get(category_id) is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    changes = update.dict(exclude_unset=True)
+    try:
+        if 'parent_id' in changes:
+            category_tree.move(category_id, changes['parent_id'])
+        if changes.get('name'):
+            category_tree.rename(category_id, changes['name'])
+    except CategoryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Edited"}
+
+@router.delete("/{category_id}")
+def delete_category(category_id: int):
+    if category_tree.get(category_id) is not None:
+        category_tree.delete(category_id)
+    return {"message": "Deleted"}
+
+@router.post("/import")
+def import_categories(file: UploadFile = File(...), on_conflict: str = SKIP):
+    try:
+        summary = import_csv(category_tree, file.file, CATEGORY_SCHEMA, on_conflict)
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Import stopped: {e}")
+    return {"message": "Imported", **summary}
@@ -0,0 +1,104 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Mongo's TTL monitor runs once a minute, so expired entries linger that long
+TTL_MONITOR_INTERVAL = timedelta(seconds=60)
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+
+class ChangeLog:
+    """Append-only log of entity writes with a monotonic sequence number.
+
+    Entries expire through a TTL index; a client whose cursor is older than the
+    oldest surviving entry is told to resync, unless that entry is too recent
+    for anything after the cursor to have expired.
+    """
+
+    def __init__(self, db, retention=timedelta(days=7), settle=timedelta(seconds=2)):
+        self.db = db
+        self.retention = retention
+        # A seq is allocated before its entry is inserted, so a later seq can
+        # become visible first. Gaps younger than this are treated as in flight.
+        self.settle = settle
+
+    async def ensure_indexes(self):
+        await self.db.changes.create_index("seq", unique=True)
+        await self.db.changes.create_index("ts", expireAfterSeconds=int(self.retention.total_seconds()))
+
+    async def _next_seq(self):
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": "changes"}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    async def record(self, collection, entity_id, op=UPSERT):
+        seq = await self._next_seq()
+        await self.db.changes.insert_one({
+            "seq": seq,
+            "op": op,
+            "collection": collection,
+            "entity_id": entity_id,
+            "ts": datetime.now(timezone.utc),
+        })
+        return seq
+
+    async def current_seq(self):
+        counter = await self.db.counters.find_one({"_id": "changes"})
+        return counter["seq"] if counter else 0
+
+    def _expiring(self, entry):
+        """Whether the TTL index is deleting entries as old as this one"""
+        bound = datetime.now(timezone.utc) - self.retention + TTL_MONITOR_INTERVAL + self.settle
+        return entry["ts"] <= bound
+
+    async def read(self, since, limit=1000):
+        """Changes after `since` as (entries, cursor, resync_required, more)"""
+        current = await self.current_seq()
+        if since > current:
+            # Cursor from a different or reset database
+            return [], current, True, False
+        if since == current:
+            return [], since, False, False
+
+        oldest = await self.db.changes.find_one({}, {"seq": 1, "ts": 1}, sort=[("seq", 1)])
+        if oldest is None:
+            return [], current, True, False
+        if oldest["seq"] > since + 1 and self._expiring(oldest):
+            # The entries after the cursor may have expired
+            return [], current, True, False
+        # Otherwise the missing seqs were never written (an aborted insert) or
+        # are still landing; the gap check below tells the two apart
+
+        entries = await self.db.changes.find(
+            {"seq": {"$gt": since}}, {"_id": 0}
+        ).sort("seq", 1).to_list(limit)
+
+        settled_before = datetime.now(timezone.utc) - self.settle
+        cursor = since
+        accepted = []
+        for entry in entries:
+            if entry["seq"] != cursor + 1 and entry["ts"] > settled_before:
+                # Stop at a recent gap; the missing write may still be landing
+                break
+            accepted.append(entry)
+            cursor = entry["seq"]
+        more = len(entries) == limit and len(accepted) == len(entries)
+        return accepted, cursor, False, more
+
+
+def collapse(entries):
+    """Last operation per entity, grouped by collection"""
+    latest = {}
+    for entry in entries:
+        latest[(entry["collection"], entry["entity_id"])] = entry["op"]
+    grouped = {}
+    for (collection, entity_id), op in latest.items():
+        group = grouped.setdefault(collection, {"upserted": [], "deleted": []})
+        group["deleted" if op == DELETE else "upserted"].append(entity_id)
+    return grouped
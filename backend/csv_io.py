@@ -0,0 +1,128 @@
+import csv
+import io
+
+IMPORT_CHUNK_ROWS = 5000
+EXPORT_CHUNK_BYTES = 64 * 1024
+MAX_REPORTED_ERRORS = 100
+
+UPSERT = "upsert"
+SKIP = "skip"
+
+
+class CsvSchema:
+    """Columns of an import: which are required and how each value is parsed"""
+
+    def __init__(self, columns, required=(), parsers=None):
+        self.columns = columns
+        self.required = required
+        self.parsers = parsers or {}
+
+    def parse(self, row):
+        entry = {}
+        for column in self.columns:
+            value = (row.get(column) or "").strip()
+            if not value:
+                if column in self.required:
+                    raise ValueError(f"{column} is required")
+                if column == "id":
+                    continue
+                entry[column] = None
+                continue
+            parser = self.parsers.get(column)
+            try:
+                entry[column] = parser(value) if parser else value
+            except ValueError:
+                raise ValueError(f"{column} has an invalid value {value!r}")
+        return entry
+
+
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise ValueError(value)
+    return number
+
+
+AV_SCHEMA = CsvSchema(("id", "name", "type", "path", "category_id", "category"), required=("name", "type", "path"),
+                      parsers={"id": positive_int, "category_id": positive_int})
+CATEGORY_SCHEMA = CsvSchema(("id", "name", "parent_id"), required=("name",),
+                            parsers={"id": positive_int, "parent_id": positive_int})
+
+
+def import_csv(store, binary_stream, schema, on_conflict=SKIP, chunk_rows=IMPORT_CHUNK_ROWS, prepare=None):
+    """Stream CSV rows from a binary file object into an IndexedStore.
+
+    Rows are parsed with the csv module (quoted commas and newlines are
+    fine), validated against the schema and applied chunk by chunk with
+    put_many, so memory stays bounded by the chunk size. Invalid rows are
+    reported with the line they end on and do not stop the import; rows
+    without an id get new ones. prepare, if given, turns each parsed row
+    into the entry to store and may reject it with ValueError.
+    """
+    if on_conflict not in (UPSERT, SKIP):
+        raise ValueError(f"on_conflict must be {UPSERT} or {SKIP}")
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    header = reader.fieldnames or []
+    missing = [column for column in schema.required if column not in header]
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(missing)}")
+
+    summary = {"rows": 0, "inserted": 0, "replaced": 0, "skipped": 0, "invalid": 0, "errors": []}
+    chunk = []
+
+    def apply():
+        inserted, replaced, skipped = store.put_many(chunk, replace=on_conflict == UPSERT)
+        summary["inserted"] += inserted
+        summary["replaced"] += replaced
+        summary["skipped"] += skipped
+        chunk.clear()
+
+    for row in reader:
+        summary["rows"] += 1
+        try:
+            if None in row:
+                raise ValueError(f"has {len(header) + len(row[None])} fields, expected {len(header)}")
+            entry = schema.parse(row)
+            chunk.append(prepare(entry) if prepare else entry)
+        except ValueError as e:
+            summary["invalid"] += 1
+            if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                summary["errors"].append({"line": reader.line_num, "error": str(e)})
+            continue
+        if len(chunk) >= chunk_rows:
+            apply()
+    if chunk:
+        apply()
+    text.detach()
+    return summary
+
+
+class _LineBuffer:
+    """File-like target for csv.writer that is drained after each write"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def drain(self):
+        text = "".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        return text.encode("utf-8")
+
+
+def iter_csv(entries, columns, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Yield a CSV of entries as ~chunk_bytes byte chunks, quoting where needed"""
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for entry in entries:
+        writer.writerow([entry.get(column) for column in columns])
+        if buffer.size >= chunk_bytes:
+            yield buffer.drain()
+    yield buffer.drain()
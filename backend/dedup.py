@@ -0,0 +1,170 @@
+"""Duplicate media detection by content hash.
+
+Candidates are narrowed in stages so most files are never read in full:
+files of a unique size cannot have a duplicate, then files whose first
+and last chunks differ cannot either, and only what is left is hashed
+end to end. Hashes are cached by (path, size, mtime_ns), so a rescan of
+a large library only reads files added or changed since the last one.
+"""
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+PARTIAL_CHUNK = 64 * 1024
+READ_BUFFER = 1024 * 1024
+HASH_WORKERS = int(os.environ.get('AV_HASH_WORKERS', '8'))
+
+
+def _digest():
+    return hashlib.blake2b(digest_size=20)
+
+
+def partial_hash(path, size, chunk=PARTIAL_CHUNK):
+    """Hash of the first and last chunk; for files up to two chunks long this is the full hash"""
+    digest = _digest()
+    with open(path, "rb") as f:
+        if size <= 2 * chunk:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(chunk))
+            f.seek(size - chunk)
+            digest.update(f.read(chunk))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    # hashlib releases the GIL on large updates, so threads hash in parallel
+    digest = _digest()
+    buffer = bytearray(READ_BUFFER)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+
+def _groups_of_two_or_more(groups):
+    return {key: members for key, members in groups.items() if len(members) > 1}
+
+
+def find_duplicates(files, cache, workers=HASH_WORKERS, on_progress=None):
+    """Group {entry_id: path} by identical content.
+
+    Returns (groups, stats): each group lists the entry ids, paths, size and
+    content hash of one set of identical files, largest reclaimable space
+    first. Entries sharing a path or a hard-linked inode need no hashing.
+    The cache maps stat keys to {"partial": ..., "full": ...}.
+    """
+    stats = {"entries": len(files), "files": 0, "partial_hashed": 0, "full_hashed": 0, "bytes_read": 0,
+             "errors": []}
+    by_inode = defaultdict(list)
+    file_info = {}
+    for entry_id, path in files.items():
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            stats["errors"].append({"id": entry_id, "error": str(e)})
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if inode not in file_info:
+            key = cache.key(path, stat)
+            file_info[inode] = {"path": path, "size": stat.st_size, "key": key,
+                                "hashes": dict(cache.get(key) or {})}
+        by_inode[inode].append(entry_id)
+    stats["files"] = len(file_info)
+
+    by_size = defaultdict(list)
+    for inode, info in file_info.items():
+        by_size[info["size"]].append(inode)
+    candidates = [inode for members in _groups_of_two_or_more(by_size).values() for inode in members]
+
+    def hashed(inodes, kind, compute, cost):
+        todo = [inode for inode in inodes if kind not in file_info[inode]["hashes"]]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {inode: pool.submit(compute, file_info[inode]["path"], file_info[inode]["size"])
+                       for inode in todo}
+            for done, (inode, future) in enumerate(futures.items(), 1):
+                info = file_info[inode]
+                try:
+                    info["hashes"][kind] = future.result()
+                except OSError as e:
+                    info["error"] = str(e)
+                    stats["errors"].append({"path": info["path"], "error": str(e)})
+                    continue
+                stats[f"{kind}_hashed"] += 1
+                stats["bytes_read"] += cost(info["size"])
+                if on_progress:
+                    on_progress(kind, done, len(todo))
+        return [inode for inode in inodes if "error" not in file_info[inode]]
+
+    by_partial = defaultdict(list)
+    for inode in hashed(candidates, "partial", partial_hash, lambda size: min(size, 2 * PARTIAL_CHUNK)):
+        info = file_info[inode]
+        by_partial[(info["size"], info["hashes"]["partial"])].append(inode)
+
+    by_content = defaultdict(list)
+    need_full = []
+    for (size, partial), members in _groups_of_two_or_more(by_partial).items():
+        if size <= 2 * PARTIAL_CHUNK:
+            # The partial hash already covered the whole file
+            for inode in members:
+                file_info[inode]["hashes"].setdefault("full", partial)
+        need_full.extend(members)
+    for inode in hashed(need_full, "full", lambda path, size: full_hash(path), lambda size: size):
+        info = file_info[inode]
+        by_content[(info["size"], info["hashes"]["full"])].append(inode)
+
+    with cache.lock:
+        for info in file_info.values():
+            if info["hashes"] and "error" not in info:
+                cache.entries[info["key"]] = info["hashes"]
+    cache.save([info["key"] for info in file_info.values()])
+
+    grouped = set()
+    contents = []
+    for (size, content_hash), members in by_content.items():
+        grouped.update(members)
+        contents.append((size, content_hash, members))
+    # Entries sharing one file are duplicates even when no other file matches it
+    for inode, entry_ids in by_inode.items():
+        if len(entry_ids) > 1 and inode not in grouped:
+            info = file_info[inode]
+            contents.append((info["size"], info["hashes"].get("full"), [inode]))
+
+    groups = []
+    for size, content_hash, members in contents:
+        entry_ids = sorted(entry_id for inode in members for entry_id in by_inode[inode])
+        if len(entry_ids) < 2:
+            continue
+        groups.append({
+            "hash": content_hash,
+            "size": size,
+            "entries": entry_ids,
+            "paths": sorted(file_info[inode]["path"] for inode in members),
+            # Keeping one copy frees every other distinct file
+            "reclaimable_bytes": size * (len(members) - 1),
+        })
+    groups.sort(key=lambda group: (-group["reclaimable_bytes"], group["entries"][0]))
+    stats["groups"] = len(groups)
+    stats["reclaimable_bytes"] = sum(group["reclaimable_bytes"] for group in groups)
+    return groups, stats
+
+
+def merge_fields(keep, duplicates):
+    """Fields to set on the kept entry: blanks filled from the duplicates, their names and paths as aliases"""
+    data = {}
+    for duplicate in duplicates:
+        for field, value in duplicate.items():
+            if field not in ("id", "aliases", "media") and value not in (None, "") and keep.get(field) in (None, ""):
+                data.setdefault(field, value)
+    aliases = list(keep.get("aliases") or [])
+    for duplicate in duplicates:
+        for alias in [{"name": duplicate.get("name"), "path": duplicate.get("path")}, *(duplicate.get("aliases") or [])]:
+            if alias not in aliases and alias != {"name": keep.get("name"), "path": keep.get("path")}:
+                aliases.append(alias)
+    data["aliases"] = aliases
+    return data
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Event types pushed to status subscribers
+APPLICATION_STATUS = "application_status"
+DRIVE_STATUS = "drive_status"
+
+
+class Subscription:
+    def __init__(self, bus, scope=None, student_id=None, drive_id=None, status=None, queue_size=256):
+        self.bus = bus
+        self.scope = scope
+        self.student_id = student_id
+        self.drive_id = drive_id
+        self.status = status
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def matches(self, event):
+        if event.get("scope") != self.scope:
+            return False
+        data = event["data"]
+        if self.student_id and data.get("student_id") != self.student_id:
+            return False
+        if self.drive_id and data.get("drive_id") != self.drive_id:
+            return False
+        if self.status and data.get("status") != self.status:
+            return False
+        return True
+
+    def deliver(self, event):
+        if self.overflowed or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: cut it loose, the client reconnects with Last-Event-ID
+            self.overflowed = True
+            self.bus.unsubscribe(self)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class StatusEventBus:
+    """In-process pub/sub for application and drive status changes"""
+
+    def __init__(self, history_size=1000):
+        # Event ids are "<epoch>-<seq>"; a different epoch means the id came from
+        # another worker or an earlier process and cannot be resumed here.
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        # Scopes currently fed by a change stream, whose writes are not published locally
+        self._streamed_scopes = set()
+
+    def publish(self, event_type, data, scope=None):
+        # scope keeps events of different tenants apart
+        self._seq += 1
+        event = {"id": f"{self.epoch}-{self._seq}", "seq": self._seq, "scope": scope, "event": event_type, "data": data}
+        self._history.append(event)
+        for subscription in list(self._subscribers):
+            subscription.deliver(event)
+        return event
+
+    def publish_local(self, event_type, data, scope=None):
+        if scope not in self._streamed_scopes:
+            self.publish(event_type, data, scope)
+
+    def set_streamed(self, scope, streamed):
+        """Mark whether a change stream feeds this scope; each tenant's watcher sets only its own"""
+        if streamed:
+            self._streamed_scopes.add(scope)
+        else:
+            self._streamed_scopes.discard(scope)
+
+    def subscribe(self, **filters):
+        subscription = Subscription(self, **filters)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+
+    def since(self, last_event_id: str) -> Optional[list]:
+        """Events after last_event_id, or None when the client must resync"""
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq >= self._seq:
+            return []
+        if not self._history or seq < self._history[0]["seq"] - 1:
+            return None
+        return [event for event in self._history if event["seq"] > seq]
+
+
+def format_sse(event_type, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_events(request, bus, subscription, last_event_id=None, heartbeat=15.0):
+    try:
+        yield "retry: 3000\n\n"
+        # The subscription exists before the replay, so events published meanwhile
+        # are both in the backlog and queued; the queued copies are skipped
+        replayed = 0
+        if last_event_id:
+            backlog = bus.since(last_event_id)
+            if backlog is None:
+                yield format_sse("resync", {"reason": "history unavailable"})
+            else:
+                for event in backlog:
+                    replayed = event["seq"]
+                    if subscription.matches(event):
+                        yield format_sse(event["event"], event["data"], event["id"])
+
+        while not subscription.overflowed:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            if event["seq"] <= replayed:
+                continue
+            yield format_sse(event["event"], event["data"], event["id"])
+    finally:
+        subscription.close()
+
+
+async def watch_status_changes(db, bus, scope=None):
+    """Feed the bus from Mongo change streams so every worker sees every write"""
+    pipeline = [{"$match": {
+        "operationType": "update",
+        "$or": [
+            {"ns.coll": "applications", "updateDescription.updatedFields.application_status": {"$exists": True}},
+            {"ns.coll": "drives", "updateDescription.updatedFields.status": {"$exists": True}},
+        ],
+    }}]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                bus.set_streamed(scope, True)
+                logger.info("Status events fed from change stream")
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    doc = change.get("fullDocument") or {}
+                    if change["ns"]["coll"] == "applications":
+                        bus.publish(APPLICATION_STATUS, {
+                            "application_id": doc.get("id"),
+                            "student_id": doc.get("student_id"),
+                            "drive_id": doc.get("drive_id"),
+                            "status": doc.get("application_status"),
+                        }, scope)
+                    else:
+                        bus.publish(DRIVE_STATUS, {"drive_id": doc.get("id"), "status": doc.get("status")}, scope)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            bus.set_streamed(scope, False)
+            resume_token = None
+            logger.warning(f"Status change stream unavailable, publishing locally: {e}")
+            await asyncio.sleep(5)
@@ -0,0 +1,418 @@
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PAID = "paid"
+PENDING = "pending"
+PARTIAL = "partial"
+EXEMPTED = "exempted"
+FEE_STATUSES = (PAID, PENDING, PARTIAL, EXEMPTED)
+
+# Payment states; a payment is "recorded" until the student balance and the
+# totals have both been updated
+RECORDED = "recorded"
+APPLIED = "applied"
+
+GROUPS = ("batch", "branch", "section")
+
+# Amounts are rupees as floats; half a paisa absorbs rounding in comparisons
+EPSILON = 0.005
+
+
+class PaymentRejected(Exception):
+    pass
+
+
+class DuplicateReceipt(Exception):
+    pass
+
+
+async def ensure_fee_indexes(db):
+    await db.crt_payments.create_index("id", unique=True)
+    await db.crt_payments.create_index("receipt_number", unique=True)
+    await db.crt_payments.create_index([("student_id", 1), ("paid_at", 1)])
+    await db.crt_payments.create_index([("state", 1), ("paid_at", 1)])
+    await db.crt_fee_totals.create_index([("batch", 1), ("branch", 1), ("section", 1)])
+    # Defaulter lists walk crt_fee_balance from the top, per batch and branch or overall
+    await db.students.create_index([("year_of_passing", 1), ("branch", 1), ("crt_fee_balance", -1)])
+    await db.students.create_index([("crt_fee_balance", -1)])
+
+
+def derive_status(amount, paid, exempted=False):
+    if exempted:
+        return EXEMPTED
+    if paid >= amount - EPSILON:
+        return PAID
+    return PARTIAL if paid > 0 else PENDING
+
+
+def outstanding_balance(amount, paid, status):
+    """The crt_fee_balance kept on each student: what is still owed, 0 when exempted"""
+    if status == EXEMPTED:
+        return 0.0
+    return max(round(float(amount) - float(paid), 2), 0.0)
+
+
+# Incremental totals, one document per (batch, branch, section) cell
+def _cell(student):
+    batch, branch, section = student["year_of_passing"], student["branch"], student["section"]
+    return f"{batch}|{branch}|{section}", {"batch": batch, "branch": branch, "section": section}
+
+
+def _contribution(student):
+    status = student["crt_fee_status"]
+    amount = float(student["crt_fee_amount"])
+    paid = float(student.get("crt_fee_paid", 0))
+    outstanding = 0.0 if status == EXEMPTED or paid >= amount - EPSILON else amount - paid
+    return {
+        "students": 1,
+        "fee_due": 0.0 if status == EXEMPTED else amount,
+        "collected": paid,
+        "outstanding": outstanding,
+        "defaulters": 1 if outstanding > 0 else 0,
+        f"status.{status}": 1,
+    }
+
+
+async def apply_student_change(db, before, after):
+    """Move a student's share of the totals from `before` to `after`.
+
+    Either side may be None for inserts and deletes; a change of branch,
+    section or batch moves the share between cells.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    labels = {}
+    for student, sign in ((before, -1), (after, 1)):
+        if student is None:
+            continue
+        key, labels[key] = _cell(student)
+        for field, value in _contribution(student).items():
+            deltas[key][field] += sign * value
+    for key, delta in deltas.items():
+        delta = {field: value for field, value in delta.items() if value}
+        if not delta:
+            continue
+        # version lets a concurrent rebuild notice that the cell moved under it
+        await db.crt_fee_totals.update_one(
+            {"_id": key}, {"$inc": {**delta, "version": 1}, "$setOnInsert": labels[key]}, upsert=True
+        )
+
+
+async def _scan_cells(db, query):
+    cells = {}
+    async for student in db.students.find(query, {
+        "_id": 0, "year_of_passing": 1, "branch": 1, "section": 1,
+        "crt_fee_status": 1, "crt_fee_amount": 1, "crt_fee_paid": 1,
+    }):
+        key, labels = _cell(student)
+        cell = cells.setdefault(key, {**labels, "status": {}})
+        for field, value in _contribution(student).items():
+            if field.startswith("status."):
+                status = field.split(".", 1)[1]
+                cell["status"][status] = cell["status"].get(status, 0) + value
+            else:
+                cell[field] = cell.get(field, 0) + value
+    return cells
+
+
+async def _replace_cell(db, key, cell, version):
+    """Write a rebuilt cell unless an incremental update landed since `version` was read"""
+    try:
+        result = await db.crt_fee_totals.replace_one(
+            {"_id": key, "version": version}, {**cell, "version": (version or 0) + 1}, upsert=True,
+        )
+    except DuplicateKeyError:
+        # The cell exists with a newer version, so the upsert collided with it
+        return False
+    return bool(result.matched_count or result.upserted_id is not None)
+
+
+async def _rebuild_cell(db, key, labels, cell, version, attempts):
+    for _ in range(attempts):
+        # A cell whose last student left is kept empty; fee_report skips it
+        if await _replace_cell(db, key, cell or {**labels, "students": 0, "status": {}}, version):
+            return
+        current = await db.crt_fee_totals.find_one({"_id": key}, {"version": 1})
+        version = current.get("version") if current else None
+        cell = (await _scan_cells(db, {
+            "year_of_passing": labels["batch"], "branch": labels["branch"], "section": labels["section"],
+        })).get(key)
+    raise RuntimeError(f"Fee totals cell {key} kept changing during the rebuild")
+
+
+async def rebuild_fee_totals(db, query=None, attempts=5):
+    """Recompute the cells of the students matching query from scratch.
+
+    Payments and edits keep updating the totals meanwhile: a cell is only
+    replaced if its version is still the one read before the students were
+    scanned, otherwise that cell is rescanned on its own.
+    """
+    query = query or {}
+    cell_query = {group: query[field] for group, field in (("batch", "year_of_passing"), ("branch", "branch"),
+                                                           ("section", "section")) if field in query}
+    existing = {cell["_id"]: cell async for cell in db.crt_fee_totals.find(
+        cell_query, {"batch": 1, "branch": 1, "section": 1, "version": 1},
+    )}
+    cells = await _scan_cells(db, query)
+    for key in existing.keys() | cells.keys():
+        labels = {group: (cells.get(key) or existing[key])[group] for group in GROUPS}
+        await _rebuild_cell(db, key, labels, cells.get(key), existing.get(key, {}).get("version"), attempts)
+    return len(cells)
+
+
+def reset_fee_fields(student):
+    """Start a new student with nothing paid; returns the status they were created with.
+
+    Only the ledger moves money, so a student created as paid gets an
+    opening payment from open_fee_account instead of a bare status.
+    """
+    requested = student["crt_fee_status"]
+    student["crt_fee_paid"] = 0.0
+    student["crt_payment_ids"] = []
+    student["crt_fee_status"] = derive_status(student["crt_fee_amount"], 0.0, requested == EXEMPTED)
+    student["crt_fee_balance"] = outstanding_balance(student["crt_fee_amount"], 0.0, student["crt_fee_status"])
+    return requested
+
+
+async def open_fee_account(db, student, requested_status):
+    """Add a newly inserted student to the totals, recording an opening payment if created as paid"""
+    await apply_student_change(db, None, student)
+    if requested_status != PAID or student["crt_fee_amount"] <= 0:
+        return None
+    receipt_number = student.get("crt_receipt_number")
+    try:
+        return await record_payment(db, student["id"], student["crt_fee_amount"], mode="opening",
+                                    receipt_number=receipt_number)
+    except DuplicateReceipt:
+        return await record_payment(db, student["id"], student["crt_fee_amount"], mode="opening",
+                                    note=f"Imported receipt {receipt_number}")
+
+
+async def update_student_fees(db, student_id, update_data, attempts=3):
+    """$set update_data on a student and move their share of the totals.
+
+    crt_fee_status is derived from the paid amount unless the update exempts
+    the student. The write is guarded by every field the totals depend on,
+    so a payment or edit landing in between is retried instead of lost.
+    Returns (before, after), or None when the student does not exist.
+    """
+    for _ in range(attempts):
+        before = await db.students.find_one({"id": student_id})
+        if before is None:
+            return None
+        data = dict(update_data)
+        paid = float(before.get("crt_fee_paid", 0))
+        data["crt_fee_status"] = derive_status(data["crt_fee_amount"], paid, data["crt_fee_status"] == EXEMPTED)
+        data["crt_fee_balance"] = outstanding_balance(data["crt_fee_amount"], paid, data["crt_fee_status"])
+        guard = {field: before.get(field) for field in (
+            "crt_fee_paid", "crt_fee_amount", "crt_fee_status", "year_of_passing", "branch", "section",
+        )}
+        result = await db.students.update_one({"id": student_id, **guard}, {"$set": data})
+        if result.matched_count:
+            after = {**before, **data}
+            await apply_student_change(db, before, after)
+            return before, after
+    raise RuntimeError(f"Student {student_id} kept changing during the update")
+
+
+# Ledger
+async def next_receipt_number(db, now=None):
+    year = (now or datetime.now(timezone.utc)).year
+    counter = await db.counters.find_one_and_update(
+        {"_id": f"crt_receipt:{year}"}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    return f"CRT{year}-{counter['seq']:05d}"
+
+
+async def _apply_to_student(db, payment):
+    """Add the payment to the student once; returns (before, after) or None if already applied"""
+    paid = {"$ifNull": ["$crt_fee_paid", 0]}
+    new_paid = {"$add": [paid, payment["amount"]]}
+    before = await db.students.find_one_and_update(
+        {
+            "id": payment["student_id"],
+            "crt_payment_ids": {"$ne": payment["id"]},
+            # Overpayment is rejected atomically against the current balance
+            "$expr": {"$lte": [new_paid, {"$add": ["$crt_fee_amount", EPSILON]}]},
+        },
+        [
+            {"$set": {
+                "crt_fee_paid": new_paid,
+                "crt_payment_ids": {"$concatArrays": [{"$ifNull": ["$crt_payment_ids", []]}, [payment["id"]]]},
+                "crt_receipt_number": payment["receipt_number"],
+            }},
+            {"$set": {
+                "crt_fee_status": {"$cond": [
+                    {"$eq": ["$crt_fee_status", EXEMPTED]}, EXEMPTED,
+                    {"$cond": [{"$gte": ["$crt_fee_paid", {"$subtract": ["$crt_fee_amount", EPSILON]}]}, PAID, PARTIAL]},
+                ]},
+                "crt_fee_balance": {"$cond": [
+                    {"$eq": ["$crt_fee_status", EXEMPTED]}, 0.0,
+                    {"$max": [{"$round": [{"$subtract": ["$crt_fee_amount", "$crt_fee_paid"]}, 2]}, 0.0]},
+                ]},
+            }},
+        ],
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        return None
+    after = dict(before)
+    after["crt_fee_paid"] = float(before.get("crt_fee_paid", 0)) + payment["amount"]
+    if before["crt_fee_status"] != EXEMPTED:
+        after["crt_fee_status"] = derive_status(after["crt_fee_amount"], after["crt_fee_paid"])
+    after["crt_fee_balance"] = outstanding_balance(after["crt_fee_amount"], after["crt_fee_paid"],
+                                                   after["crt_fee_status"])
+    return before, after
+
+
+async def record_payment(db, student_id, amount, mode="cash", receipt_number=None, note=None, paid_at=None):
+    """Append a payment to crt_payments and apply it to the student and the totals.
+
+    The ledger entry is written first in the "recorded" state; the student
+    update is guarded by the payment id, so reconcile_payments can finish a
+    payment interrupted at any step without counting it twice. A retried
+    request with the same receipt number returns the original payment.
+    """
+    amount = round(float(amount), 2)
+    if amount <= 0:
+        raise PaymentRejected("Amount must be positive")
+    student = await db.students.find_one({"id": student_id})
+    if not student:
+        raise LookupError(student_id)
+    balance = float(student["crt_fee_amount"]) - float(student.get("crt_fee_paid", 0))
+    if amount > balance + EPSILON:
+        raise PaymentRejected(f"Amount exceeds the outstanding balance of {balance:g}")
+
+    now = datetime.now(timezone.utc)
+    payment = {
+        "id": str(uuid.uuid4()),
+        "receipt_number": receipt_number or await next_receipt_number(db, now),
+        "student_id": student_id,
+        "roll_no": student["roll_no"],
+        "amount": float(amount),
+        "mode": mode,
+        "note": note,
+        "batch": student["year_of_passing"],
+        "branch": student["branch"],
+        "section": student["section"],
+        "paid_at": paid_at or now,
+        "recorded_at": now,
+        "state": RECORDED,
+    }
+    try:
+        await db.crt_payments.insert_one(payment)
+    except DuplicateKeyError:
+        existing = await db.crt_payments.find_one({"receipt_number": payment["receipt_number"]})
+        if existing and existing["student_id"] == student_id and existing["amount"] == payment["amount"]:
+            existing.pop("_id", None)
+            return existing
+        raise DuplicateReceipt(payment["receipt_number"])
+    payment.pop("_id", None)
+
+    change = await _apply_to_student(db, payment)
+    if change is None:
+        # A concurrent payment used up the balance first
+        await db.crt_payments.delete_one({"id": payment["id"], "state": RECORDED})
+        raise PaymentRejected("Amount exceeds the outstanding balance")
+    await apply_student_change(db, *change)
+    await db.crt_payments.update_one({"id": payment["id"]}, {"$set": {"state": APPLIED}})
+    payment["state"] = APPLIED
+    return payment
+
+
+async def reconcile_payments(db, older_than=timedelta(minutes=5)):
+    """Finish payments left in the "recorded" state by a crashed request.
+
+    Whether the totals were updated before the crash is unknown, so the
+    affected cells are rebuilt from their students instead of incremented.
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    finished = 0
+    async for payment in db.crt_payments.find({"state": RECORDED, "recorded_at": {"$lt": cutoff}}):
+        student = await db.students.find_one({"id": payment["student_id"]}, {"crt_payment_ids": 1})
+        applied = student is not None and payment["id"] in student.get("crt_payment_ids", [])
+        if not applied and (student is None or await _apply_to_student(db, payment) is None):
+            logger.warning(f"Dropping CRT payment {payment['receipt_number']} that cannot be applied")
+            await db.crt_payments.update_one({"id": payment["id"]}, {"$set": {"state": "rejected"}})
+            continue
+        await rebuild_fee_totals(db, {
+            "year_of_passing": payment["batch"], "branch": payment["branch"], "section": payment["section"],
+        })
+        await db.crt_payments.update_one({"id": payment["id"]}, {"$set": {"state": APPLIED}})
+        finished += 1
+    return finished
+
+
+# Reports; served from crt_fee_totals, whose size depends on the number of
+# batches, branches and sections rather than on the number of students
+def _empty_totals():
+    return {"students": 0, "fee_due": 0.0, "collected": 0.0, "outstanding": 0.0, "defaulters": 0,
+            "status": {status: 0 for status in FEE_STATUSES}}
+
+
+def _add(totals, cell):
+    for field in ("students", "fee_due", "collected", "outstanding", "defaulters"):
+        totals[field] += cell.get(field, 0)
+    for status, count in cell.get("status", {}).items():
+        totals["status"][status] = totals["status"].get(status, 0) + count
+
+
+def _finish(totals):
+    for field in ("fee_due", "collected", "outstanding"):
+        totals[field] = round(totals[field], 2)
+    totals["collection_rate"] = round(totals["collected"] / totals["fee_due"] * 100, 1) if totals["fee_due"] else 0
+    return totals
+
+
+async def fee_report(db, group_by=None, batch=None, branch=None, section=None):
+    """Totals overall, or per batch, branch or section, optionally filtered"""
+    query = {field: value for field, value in (("batch", batch), ("branch", branch), ("section", section))
+             if value is not None}
+    overall = _empty_totals()
+    groups = {}
+    async for cell in db.crt_fee_totals.find(query, {"_id": 0}):
+        if not cell.get("students"):
+            # Left behind when the last student moved to another cell
+            continue
+        _add(overall, cell)
+        if group_by:
+            group = cell[group_by] if group_by != "section" else f"{cell['branch']}-{cell['section']}"
+            _add(groups.setdefault(group, _empty_totals()), cell)
+    report = _finish(overall)
+    if group_by:
+        report["groups"] = {group: _finish(totals) for group, totals in sorted(groups.items())}
+    return report
+
+
+async def list_defaulters(db, batch=None, branch=None, limit=100):
+    """The `limit` students owing the most, largest balance first.
+
+    Mongo walks the crt_fee_balance indexes from the top and stops after
+    `limit` students, so the cost does not grow with the size of the batch.
+    """
+    query = {"crt_fee_balance": {"$gt": EPSILON}}
+    if batch is not None:
+        query["year_of_passing"] = batch
+    if branch is not None:
+        query["branch"] = branch
+    cursor = db.students.find(query, {
+        "_id": 0, "id": 1, "name": 1, "roll_no": 1, "year_of_passing": 1, "branch": 1, "section": 1,
+        "crt_fee_amount": 1, "crt_fee_paid": 1, "crt_fee_balance": 1,
+    }).sort("crt_fee_balance", -1).limit(limit)
+    return [{
+        "id": student["id"],
+        "name": student["name"],
+        "roll_no": student["roll_no"],
+        "batch": student["year_of_passing"],
+        "branch": student["branch"],
+        "section": student["section"],
+        "fee_amount": student["crt_fee_amount"],
+        "paid": float(student.get("crt_fee_paid", 0)),
+        "balance": student["crt_fee_balance"],
+    } async for student in cursor]
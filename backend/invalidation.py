@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """Per-process cache keyed by (collection, id); id None holds collection-wide results.
+
+    `generation` counts invalidations. A reader takes it before loading from
+    Mongo and passes it to set(), which drops the value if an invalidation
+    arrived in between, since the loaded document may predate that write.
+    With `ttl` (seconds) entries also expire, for setups without a transport.
+    """
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = {}
+        # Collection-wide entries can depend on several collections (e.g. dashboard stats)
+        self._dependents = {}
+
+    def get(self, collection, key=None):
+        entry = self._entries.get((collection, key))
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.monotonic():
+            self._entries.pop((collection, key), None)
+            return None
+        return value
+
+    def set(self, collection, key, value, depends_on=(), generation=None):
+        if generation is not None and generation != self.generation:
+            return False
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[(collection, key)] = (value, expires)
+        for dependency in depends_on:
+            self._dependents.setdefault(dependency, set()).add((collection, key))
+        return True
+
+    def invalidate(self, collection, key=None):
+        self.generation += 1
+        self._entries.pop((collection, None), None)
+        if key is None:
+            for entry_key in [k for k in self._entries if k[0] == collection]:
+                del self._entries[entry_key]
+        else:
+            self._entries.pop((collection, key), None)
+        for entry_key in self._dependents.pop(collection, ()):
+            self._entries.pop(entry_key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._dependents.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InvalidationBus:
+    """Broadcasts "collection / id changed" to every worker's caches.
+
+    Each worker stamps its messages with (origin, seq) and tracks the highest
+    seq seen per origin. A jump in seq, or a heartbeat announcing a seq we never
+    received, means messages were lost and every registered cache is flushed.
+    """
+
+    def __init__(self, transport=None):
+        self.origin = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.vector = {}
+        self.caches = []
+        self.flushes = 0
+        self.transport = transport
+
+    def register(self, cache):
+        self.caches.append(cache)
+        return cache
+
+    def _apply(self, collection, key):
+        for cache in self.caches:
+            cache.invalidate(collection, key)
+
+    def flush(self, reason):
+        self.flushes += 1
+        logger.info(f"Flushing {len(self.caches)} caches: {reason}")
+        for cache in self.caches:
+            cache.clear()
+
+    async def publish(self, collection, key=None):
+        self._apply(collection, key)
+        self.seq += 1
+        if self.transport:
+            await self.transport.send({"o": self.origin, "s": self.seq, "c": collection, "i": key})
+
+    def receive(self, message):
+        origin, seq = message["o"], message["s"]
+        if origin == self.origin:
+            return
+        last = self.vector.get(origin, 0)
+        if seq > last:
+            self.vector[origin] = seq
+        expected = seq if "c" in message else seq + 1
+        if last + 1 < expected:
+            self.flush(f"missed {expected - last - 1} messages from {origin}")
+        elif "c" in message and seq > last:
+            self._apply(message["c"], message.get("i"))
+
+    async def heartbeat(self):
+        if self.transport:
+            await self.transport.send({"o": self.origin, "s": self.seq})
+
+    async def start(self, heartbeat_interval=2.0):
+        if not self.transport:
+            return
+        await self.transport.start(self)
+        while True:
+            await asyncio.sleep(heartbeat_interval)
+            await self.heartbeat()
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    def status(self):
+        return {
+            "origin": self.origin,
+            "seq": self.seq,
+            "vector": dict(self.vector),
+            "flushes": self.flushes,
+            "caches": {cache.name: len(cache) for cache in self.caches},
+        }
+
+
+class _DatagramReceiver(asyncio.DatagramProtocol):
+    def __init__(self, bus):
+        self.bus = bus
+
+    def datagram_received(self, data, addr):
+        try:
+            self.bus.receive(json.loads(data))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Dropping malformed invalidation message: {e}")
+
+
+class UnixSocketTransport:
+    """Broadcasts datagrams to every worker socket in a shared directory"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.path = None
+        self.sock = None
+        self.endpoint = None
+
+    async def start(self, bus):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"{os.getpid()}-{bus.origin}.sock"
+        loop = asyncio.get_running_loop()
+        self.endpoint, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramReceiver(bus), local_addr=str(self.path), family=socket.AF_UNIX
+        )
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    async def send(self, message):
+        if not self.sock:
+            return
+        payload = json.dumps(message).encode()
+        for peer in self.directory.glob("*.sock"):
+            if peer == self.path:
+                continue
+            try:
+                self.sock.sendto(payload, str(peer))
+            except BlockingIOError:
+                # Peer queue is full; its version vector will notice the gap
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone, remove its stale socket
+                peer.unlink(missing_ok=True)
+
+    def close(self):
+        if self.endpoint:
+            self.endpoint.close()
+        if self.sock:
+            self.sock.close()
+        if self.path:
+            self.path.unlink(missing_ok=True)
+
+
+class ChangeStreamTransport:
+    """Uses Mongo change streams as the broadcast medium (requires a replica set).
+
+    `watchable` is a database or a client; `key` maps a change's namespace to
+    the cache key used for it, or None to ignore the change.
+    """
+
+    def __init__(self, watchable, collections, key=None):
+        self.watchable = watchable
+        self.collections = list(collections)
+        self.key = key or (lambda ns: ns["coll"])
+        self.task = None
+
+    async def start(self, bus):
+        self.task = asyncio.create_task(self._watch(bus))
+
+    async def _watch(self, bus):
+        pipeline = [{"$match": {"ns.coll": {"$in": self.collections}}}]
+        resume_token = None
+        while True:
+            try:
+                async with self.watchable.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        collection = self.key(change["ns"])
+                        if collection is None:
+                            continue
+                        doc = change.get("fullDocument") or {}
+                        # Deletes carry only _id, so they invalidate the whole collection
+                        bus._apply(collection, doc.get("id"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Whatever happened while we were disconnected is unknown
+                resume_token = None
+                bus.flush(f"change stream interrupted: {e}")
+                await asyncio.sleep(5)
+
+    async def send(self, message):
+        # Writes themselves are the broadcast
+        pass
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
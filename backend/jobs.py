@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+async def ensure_job_indexes(db):
+    await db.jobs.create_index("id", unique=True)
+    await db.jobs.create_index([("status", 1), ("run_after", 1)])
+    await db.jobs.create_index([("status", 1), ("lease_expires", 1)])
+
+
+async def enqueue(db, job_type, payload=None, max_attempts=3):
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type,
+        "payload": payload or {},
+        "status": QUEUED,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_after": now,
+        "progress": {"done": 0, "total": None, "message": None},
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    await db.jobs.insert_one(job)
+    job.pop("_id", None)
+    return job
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JobContext:
+    """Handed to job handlers for payload access and progress reporting"""
+
+    def __init__(self, db, job, owner, min_interval=0.5):
+        self.db = db
+        self.job = job
+        self.owner = owner
+        self.min_interval = min_interval
+        self._last_report = 0.0
+
+    @property
+    def payload(self):
+        return self.job["payload"]
+
+    async def progress(self, done, total=None, message=None):
+        now = time.monotonic()
+        if now - self._last_report < self.min_interval and done != total:
+            return
+        self._last_report = now
+        result = await self.db.jobs.update_one(
+            {"id": self.job["id"], "lease_owner": self.owner},
+            {"$set": {
+                "progress": {"done": done, "total": total, "message": message},
+                "updated_at": datetime.now(timezone.utc),
+            }},
+        )
+        if result.matched_count == 0:
+            raise LeaseLost(self.job["id"])
+
+
+class JobWorkerPool:
+    """asyncio workers claiming jobs with find_one_and_update leases.
+
+    A job whose worker dies is reclaimed once its lease expires; failures are
+    retried with exponential backoff until max_attempts is reached. A job
+    whose worker died on its last attempt is marked failed instead.
+    """
+
+    def __init__(self, db, handlers, concurrency=2, lease_ttl=60.0, poll_interval=1.0, retry_base=5.0):
+        self.db = db
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after a local enqueue"""
+        self._wakeup.set()
+
+    async def fail_abandoned(self, now):
+        """Fail jobs whose lease expired on their last attempt; nothing would reclaim them"""
+        result = await self.db.jobs.update_many(
+            {"type": {"$in": list(self.handlers)}, "status": RUNNING, "lease_expires": {"$lt": now},
+             "$expr": {"$gte": ["$attempts", "$max_attempts"]}},
+            {"$set": {"status": FAILED, "error": "Worker stopped during the final attempt", "updated_at": now},
+             "$unset": {"lease_owner": "", "lease_expires": ""}},
+        )
+        if result.modified_count:
+            logger.error(f"Failed {result.modified_count} jobs abandoned on their final attempt")
+        return result.modified_count
+
+    async def claim(self):
+        now = datetime.now(timezone.utc)
+        await self.fail_abandoned(now)
+        return await self.db.jobs.find_one_and_update(
+            {"type": {"$in": list(self.handlers)}, "$or": [
+                {"status": QUEUED, "run_after": {"$lte": now}},
+                # Reclaim jobs of dead workers, unless they keep killing workers
+                {"status": RUNNING, "lease_expires": {"$lt": now}, "$expr": {"$lt": ["$attempts", "$max_attempts"]}},
+            ]},
+            {"$set": {
+                "status": RUNNING,
+                "lease_owner": self.owner,
+                "lease_expires": now + timedelta(seconds=self.lease_ttl),
+                "updated_at": now,
+            }, "$inc": {"attempts": 1}},
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _renew(self, job, handler_task):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            result = await self.db.jobs.update_one(
+                {"id": job["id"], "lease_owner": self.owner},
+                {"$set": {"lease_expires": datetime.now(timezone.utc) + timedelta(seconds=self.lease_ttl)}},
+            )
+            if result.matched_count == 0:
+                logger.warning(f"Lost lease on job {job['id']}, stopping it")
+                handler_task.cancel()
+                return
+
+    async def _finish(self, job, update):
+        update["updated_at"] = datetime.now(timezone.utc)
+        await self.db.jobs.update_one(
+            {"id": job["id"], "lease_owner": self.owner},
+            {"$set": update, "$unset": {"lease_owner": "", "lease_expires": ""}},
+        )
+
+    async def run_job(self, job):
+        handler = self.handlers[job["type"]]
+        context = JobContext(self.db, job, self.owner)
+        handler_task = asyncio.create_task(handler(context))
+        renew_task = asyncio.create_task(self._renew(job, handler_task))
+        try:
+            result = await handler_task
+        except LeaseLost:
+            return
+        except asyncio.CancelledError:
+            if not renew_task.done():
+                # The pool itself is shutting down; the lease will expire and
+                # another worker picks the job up
+                raise
+            return
+        except Exception as e:
+            if job["attempts"] < job["max_attempts"]:
+                delay = self.retry_base * 2 ** (job["attempts"] - 1) * random.uniform(0.8, 1.2)
+                logger.warning(f"Job {job['id']} ({job['type']}) failed, retrying in {delay:.0f}s: {e}")
+                await self._finish(job, {
+                    "status": QUEUED,
+                    "error": str(e),
+                    "run_after": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                })
+            else:
+                logger.error(f"Job {job['id']} ({job['type']}) failed permanently: {e}")
+                await self._finish(job, {"status": FAILED, "error": str(e)})
+            return
+        finally:
+            renew_task.cancel()
+        await self._finish(job, {"status": SUCCEEDED, "result": result, "error": None})
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} could not be completed: {e}")
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        return self._tasks
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
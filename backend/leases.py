@@ -0,0 +1,43 @@
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    """Time-limited ownership document so only one worker runs a singleton task"""
+
+    def __init__(self, collection, name, ttl=30.0):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.held = False
+
+    async def acquire(self):
+        """Take or renew the lease; returns whether this worker holds it"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl)}},
+                upsert=True,
+            )
+            held = True
+        except DuplicateKeyError:
+            # Someone else holds an unexpired lease, so the upsert collided with it
+            held = False
+        if held != self.held:
+            logger.info(f"Lease {self.name} {'acquired' if held else 'lost'} by {self.owner}")
+        self.held = held
+        return held
+
+    async def release(self):
+        if self.held:
+            await self.collection.delete_one({"_id": self.name, "owner": self.owner})
+            self.held = False
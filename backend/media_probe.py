@@ -0,0 +1,391 @@
+"""Duration, bitrate, codec and tag probing for MP3 and MP4 files in pure Python.
+
+Only headers are read: the ID3 tag (seeking over embedded pictures), the
+first MPEG frames with their Xing/VBRI header, or the MP4 box headers and
+the moov box.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MP3_SCAN_BYTES = 64 * 1024
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+UNSUPPORTED = "Unsupported format"
+
+
+# MP3
+_BITRATES = {
+    (1, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+_ID3_TEXT_FRAMES = {"TIT2": "title", "TPE1": "artist", "TALB": "album", "TT2": "title", "TP1": "artist", "TAL": "album"}
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _decode_id3_text(data):
+    if not data:
+        return None
+    encoding, text = data[0], data[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(encoding, "latin-1")
+    return text.decode(codec, "replace").split("\x00")[0].strip() or None
+
+
+def _read_id3v2(f, info):
+    """Tags from an ID3v2 header at the start of the file; returns the offset of the audio"""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    major, flags = header[3], header[5]
+    end = 10 + _syncsafe(header[6:10]) + (10 if flags & 0x10 else 0)
+    id_size, header_size = (3, 6) if major == 2 else (4, 10)
+    position = 10
+    while position + header_size <= end:
+        frame_header = f.read(header_size)
+        frame_id = frame_header[:id_size]
+        if len(frame_header) < header_size or not frame_id.strip(b"\x00"):
+            break
+        if major == 2:
+            size = int.from_bytes(frame_header[3:6], "big")
+        elif major == 4:
+            size = _syncsafe(frame_header[4:8])
+        else:
+            size = int.from_bytes(frame_header[4:8], "big")
+        field = _ID3_TEXT_FRAMES.get(frame_id.decode("latin-1", "replace"))
+        if field and size < 4096:
+            info.setdefault(field, _decode_id3_text(f.read(size)))
+        else:
+            f.seek(size, os.SEEK_CUR)
+        position += header_size + size
+    return end
+
+
+def _mpeg_frame(header):
+    """(version, layer, bitrate bps, sample rate, padding, channels) of a frame header, or None"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((header[1] >> 3) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((header[1] >> 1) & 3)
+    bitrate_index, rate_index = header[2] >> 4, (header[2] >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][bitrate_index - 1] * 1000
+    channels = 1 if header[3] >> 6 == 3 else 2
+    return version, layer, bitrate, _SAMPLE_RATES[version][rate_index], (header[2] >> 1) & 1, channels
+
+
+def _frame_length(version, layer, bitrate, sample_rate, padding):
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+    if layer == 3 and version != 1:
+        return 72 * bitrate // sample_rate + padding
+    return 144 * bitrate // sample_rate + padding
+
+
+def probe_mp3(path):
+    size = os.path.getsize(path)
+    info = {"format": "mp3", "size": size}
+    with open(path, "rb") as f:
+        audio_start = _read_id3v2(f, info)
+        audio_end = size
+        if size >= 128:
+            f.seek(size - 128)
+            tail = f.read(128)
+            if tail[:3] == b"TAG":
+                audio_end -= 128
+                for field, start, stop in (("title", 3, 33), ("artist", 33, 63), ("album", 63, 93)):
+                    if not info.get(field):
+                        info[field] = tail[start:stop].split(b"\x00")[0].decode("latin-1").strip() or None
+        f.seek(audio_start)
+        data = f.read(MP3_SCAN_BYTES)
+
+    # The first sync word whose next frame also parses is taken as real audio
+    offset = 0
+    while True:
+        offset = data.find(b"\xff", offset)
+        if offset < 0 or offset + 4 > len(data):
+            return info
+        frame = _mpeg_frame(data[offset:offset + 4])
+        if frame:
+            length = _frame_length(*frame[:5])
+            following = data[offset + length:offset + length + 4]
+            if len(following) < 4 or _mpeg_frame(following):
+                break
+        offset += 1
+
+    version, layer, bitrate, sample_rate, _, channels = frame
+    samples_per_frame = 384 if layer == 1 else 1152 if layer == 2 or version == 1 else 576
+    info.update(codec=f"mp{layer}", sample_rate=sample_rate, channels=channels)
+    audio_bytes = audio_end - audio_start - offset
+
+    # Xing/Info (VBR or LAME CBR) sits after the side information; VBRI at a fixed offset
+    side_info = (32 if channels == 2 else 17) if version == 1 else (17 if channels == 2 else 9)
+    xing = data[offset + 4 + side_info:offset + 4 + side_info + 16]
+    vbri = data[offset + 36:offset + 36 + 18]
+    frames = None
+    if xing[:4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(xing[4:8], "big")
+        fields = xing[8:]
+        if flags & 1:
+            frames = int.from_bytes(fields[:4], "big")
+            fields = fields[4:]
+        if flags & 2 and len(fields) >= 4:
+            audio_bytes = int.from_bytes(fields[:4], "big") or audio_bytes
+    elif vbri[:4] == b"VBRI":
+        audio_bytes = int.from_bytes(vbri[10:14], "big") or audio_bytes
+        frames = int.from_bytes(vbri[14:18], "big")
+
+    if frames:
+        duration = frames * samples_per_frame / sample_rate
+        info["bitrate"] = int(audio_bytes * 8 / duration) if duration else bitrate
+    else:
+        duration = audio_bytes * 8 / bitrate
+        info["bitrate"] = bitrate
+    info["duration"] = round(duration, 3)
+    return info
+
+
+# MP4 / ISO base media
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"udta", b"ilst"}
+_ILST_FIELDS = {b"\xa9nam": "title", b"\xa9ART": "artist", b"\xa9alb": "album"}
+
+
+def _boxes(data, start=0, end=None):
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[position:position + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[position + 8:position + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header or position + size > end:
+            return
+        yield kind, position + header, position + size
+        position += size
+
+
+def _find_moov(f, file_size):
+    position = 0
+    while position + 8 <= file_size:
+        f.seek(position)
+        header = f.read(16)
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - position
+        if size < header_size:
+            return None
+        if kind == b"moov":
+            if size > MAX_MOOV_BYTES:
+                return None
+            f.seek(position)
+            return f.read(size)
+        position += size
+    return None
+
+
+def _parse_track(data, start, end, track):
+    for kind, body, stop in _boxes(data, start, end):
+        if kind == b"tkhd":
+            version = data[body]
+            offset = body + 4 + (32 if version == 1 else 20) + 52
+            width, height = struct.unpack(">II", data[offset:offset + 8])
+            track["width"], track["height"] = width >> 16, height >> 16
+        elif kind == b"mdhd":
+            version = data[body]
+            if version == 1:
+                timescale, duration = struct.unpack(">IQ", data[body + 20:body + 32])
+            else:
+                timescale, duration = struct.unpack(">II", data[body + 12:body + 20])
+            track["duration"] = duration / timescale if timescale else None
+        elif kind == b"hdlr":
+            track["handler"] = data[body + 8:body + 12]
+        elif kind == b"stsd":
+            entry = body + 8
+            track["codec"] = data[entry + 4:entry + 8].decode("latin-1").strip()
+            if track.get("handler") == b"soun":
+                channels, = struct.unpack(">H", data[entry + 24:entry + 26])
+                sample_rate, = struct.unpack(">I", data[entry + 32:entry + 36])
+                track["channels"], track["sample_rate"] = channels, sample_rate >> 16
+            elif track.get("handler") == b"vide":
+                width, height = struct.unpack(">HH", data[entry + 32:entry + 36])
+                track.setdefault("width", width)
+                track.setdefault("height", height)
+        elif kind in _CONTAINERS:
+            _parse_track(data, start=body, end=stop, track=track)
+
+
+def _parse_tags(data, start, end, info):
+    for kind, body, stop in _boxes(data, start, end):
+        if kind == b"meta":
+            # ISO meta is a full box; QuickTime's is not
+            _parse_tags(data, body + 4 if data[body + 4:body + 8] != b"hdlr" else body, stop, info)
+        elif kind in (b"udta", b"ilst"):
+            _parse_tags(data, body, stop, info)
+        elif kind in _ILST_FIELDS:
+            for inner, value, value_end in _boxes(data, body, stop):
+                if inner == b"data":
+                    info.setdefault(_ILST_FIELDS[kind], data[value + 8:value_end].decode("utf-8", "replace") or None)
+
+
+def probe_mp4(path):
+    size = os.path.getsize(path)
+    info = {"format": "mp4", "size": size}
+    with open(path, "rb") as f:
+        moov = _find_moov(f, size)
+    if moov is None:
+        return info
+    tracks = []
+    for kind, body, stop in _boxes(moov, 8):
+        if kind == b"mvhd":
+            version = moov[body]
+            if version == 1:
+                timescale, duration = struct.unpack(">IQ", moov[body + 20:body + 32])
+            else:
+                timescale, duration = struct.unpack(">II", moov[body + 12:body + 20])
+            if timescale:
+                info["duration"] = round(duration / timescale, 3)
+        elif kind == b"trak":
+            track = {}
+            _parse_track(moov, body, stop, track)
+            tracks.append(track)
+        elif kind == b"udta":
+            _parse_tags(moov, body, stop, info)
+    video = next((track for track in tracks if track.get("handler") == b"vide"), None)
+    audio = next((track for track in tracks if track.get("handler") == b"soun"), None)
+    if video:
+        info.update(codec=video.get("codec"), width=video.get("width"), height=video.get("height"))
+    if audio:
+        info.update(sample_rate=audio.get("sample_rate"), channels=audio.get("channels"))
+        info["audio_codec" if video else "codec"] = audio.get("codec")
+    if info.get("duration"):
+        info["bitrate"] = int(size * 8 / info["duration"])
+    return info
+
+
+def probe(path):
+    """Metadata of one file, or {"error": ...}; top-level so worker processes can run it"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+        if head[4:8] == b"ftyp":
+            return probe_mp4(path)
+        if head[:3] == b"ID3" or _mpeg_frame(head[:4]):
+            return probe_mp3(path)
+        return {"size": os.path.getsize(path), "error": UNSUPPORTED}
+    except (OSError, struct.error, IndexError, ValueError) as e:
+        return {"error": str(e)}
+
+
+def _probe_many(paths):
+    return [probe(path) for path in paths]
+
+
+class ProbeCache:
+    """Per-file results (probes, content hashes) keyed by (path, size, mtime_ns), saved as JSON"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text())
+            except ValueError:
+                logger.warning(f"Ignoring unreadable probe cache {self.path}")
+
+    @staticmethod
+    def key(path, stat):
+        return f"{path}\x00{stat.st_size}\x00{stat.st_mtime_ns}"
+
+    # Scans and API threads share one cache, so every access takes the lock
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+
+    def save(self, keys=None):
+        """Store results; with `keys`, drop entries of those files' older versions"""
+        with self.lock:
+            if keys is not None:
+                live = {key.split("\x00", 1)[0]: key for key in keys}
+                self.entries = {key: value for key, value in self.entries.items()
+                                if live.get(key.split("\x00", 1)[0], key) == key}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = self.path.with_suffix(".tmp")
+            temporary.write_text(json.dumps(self.entries))
+            os.replace(temporary, self.path)
+
+
+def probe_cached(path, cache):
+    key = cache.key(path, os.stat(path))
+    info = cache.get(key)
+    if info is None:
+        info = probe(path)
+        if info.get("error") in (None, UNSUPPORTED):
+            cache.put(key, info)
+            cache.save([key])
+    return info
+
+
+def scan(files, cache, workers=None, batch_size=32, on_progress=None):
+    """Probe {entry_id: path} in a process pool, reusing cached results for unchanged files.
+
+    Returns {entry_id: metadata}. Files are stat'ed here and only those
+    whose (path, size, mtime) is not cached are sent to the workers, in
+    batches to keep pickling overhead low.
+    """
+    results, pending, live = {}, {}, []
+    for entry_id, path in files.items():
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            results[entry_id] = {"error": str(e)}
+            continue
+        key = cache.key(path, stat)
+        live.append(key)
+        cached = cache.get(key)
+        if cached is not None:
+            results[entry_id] = cached
+        else:
+            pending.setdefault(key, []).append(entry_id)
+
+    keys = list(pending)
+    batches = [keys[start:start + batch_size] for start in range(0, len(keys), batch_size)]
+    done = len(results)
+    if batches:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            probed = pool.map(_probe_many, [[key.split("\x00", 1)[0] for key in batch] for batch in batches])
+            for batch, infos in zip(batches, probed):
+                for key, info in zip(batch, infos):
+                    if info.get("error") in (None, UNSUPPORTED):
+                        cache.put(key, info)
+                    for entry_id in pending[key]:
+                        results[entry_id] = info
+                        done += 1
+                if on_progress:
+                    on_progress(done, len(files))
+    cache.save(live)
+    return results
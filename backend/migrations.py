@@ -0,0 +1,144 @@
+"""Resumable data migrations.
+
+Run from the backend directory:
+
+    python migrations.py dates_to_bson
+    python migrations.py fee_ledger
+
+Each migration runs on the database of every tenant in TENANTS (or DB_NAME
+for a single-tenant deployment); checkpoints live in each database.
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from fees import rebuild_fee_totals
+from tenancy import TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+# Fields that used to be written as ISO strings by prepare_for_mongo
+DATE_FIELDS = {
+    "students": ["created_at"],
+    "companies": ["created_at"],
+    "drives": ["drive_date", "created_at"],
+    "applications": ["applied_date", "selected_date"],
+    "offer_letters": ["offer_date", "joining_date"],
+}
+
+
+def parse_iso_datetime(value):
+    parsed = datetime.fromisoformat(value if 'T' in value else value + 'T00:00:00')
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def migrate_dates_to_bson(db, batch_size=500):
+    """Rewrite ISO string dates as BSON datetimes, checkpointing after every batch"""
+    checkpoints = db.migrations
+    migrated = 0
+    for collection, fields in DATE_FIELDS.items():
+        checkpoint_id = f"dates_to_bson:{collection}"
+        checkpoint = await checkpoints.find_one({"_id": checkpoint_id}) or {}
+        if checkpoint.get("done"):
+            continue
+
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        last_id = checkpoint.get("last_id")
+        while True:
+            batch_query = dict(query)
+            if last_id is not None:
+                batch_query["_id"] = {"$gt": last_id}
+            projection = {field: 1 for field in fields}
+            docs = await db[collection].find(batch_query, projection).sort("_id", 1).to_list(batch_size)
+            if not docs:
+                break
+
+            operations = []
+            for doc in docs:
+                update = {}
+                for field in fields:
+                    value = doc.get(field)
+                    if isinstance(value, str):
+                        try:
+                            update[field] = parse_iso_datetime(value)
+                        except ValueError:
+                            logger.warning(f"{collection} {doc['_id']}: unparseable {field} {value!r}")
+                if update:
+                    operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+            if operations:
+                await db[collection].bulk_write(operations, ordered=False)
+            migrated += len(operations)
+
+            last_id = docs[-1]["_id"]
+            await checkpoints.update_one({"_id": checkpoint_id}, {"$set": {"last_id": last_id}}, upsert=True)
+
+        await checkpoints.update_one({"_id": checkpoint_id}, {"$set": {"done": True}}, upsert=True)
+        logger.info(f"{collection}: dates migrated to BSON")
+    return migrated
+
+
+async def migrate_fee_ledger(db):
+    """Seed crt_fee_paid for students from before the fee ledger, then build the totals.
+
+    Students marked paid are taken as having paid in full; partial payments
+    were never recorded, so they start from zero and need their payments
+    entered. Safe to rerun: only students without crt_fee_paid are touched.
+    """
+    missing = {"crt_fee_paid": {"$exists": False}}
+    paid = await db.students.update_many(
+        {**missing, "crt_fee_status": "paid"},
+        [{"$set": {"crt_fee_paid": "$crt_fee_amount", "crt_payment_ids": []}}],
+    )
+    rest = await db.students.update_many(missing, {"$set": {"crt_fee_paid": 0.0, "crt_payment_ids": []}})
+    cells = await rebuild_fee_totals(db)
+    logger.info(f"fee_ledger: rebuilt {cells} fee total cells")
+    return paid.modified_count + rest.modified_count
+
+
+async def migrate_fee_balance(db):
+    """Store crt_fee_balance on students from before it was kept; the defaulter report sorts by it.
+
+    Runs after fee_ledger. Safe to rerun: only students without the field are touched.
+    """
+    result = await db.students.update_many(
+        {"crt_fee_balance": {"$exists": False}},
+        [{"$set": {"crt_fee_balance": {"$cond": [
+            {"$eq": ["$crt_fee_status", "exempted"]}, 0.0,
+            {"$max": [{"$round": [{"$subtract": ["$crt_fee_amount", {"$ifNull": ["$crt_fee_paid", 0]}]}, 2]}, 0.0]},
+        ]}}}],
+    )
+    return result.modified_count
+
+
+MIGRATIONS = {
+    "dates_to_bson": migrate_dates_to_bson,
+    "fee_ledger": migrate_fee_ledger,
+    "fee_balance": migrate_fee_balance,
+}
+
+
+async def main(names):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        for tenant in TenantRegistry.from_env(os.environ):
+            db = client[tenant.db_name]
+            for name in names:
+                count = await MIGRATIONS[name](db)
+                logger.info(f"{tenant.name}: {name}: {count} documents updated")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main(sys.argv[1:] or list(MIGRATIONS)))
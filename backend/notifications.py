@@ -0,0 +1,387 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import smtplib
+import string
+import threading
+import time
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from queue import Empty, LifoQueue
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+# Eligibility
+_CGPA_RE = re.compile(r"(?:c?gpa)\D{0,15}?(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*\+?\s*c?gpa", re.I)
+_NO_BACKLOGS_RE = re.compile(r"\bno\s+(?:active\s+|pending\s+|standing\s+)?backlogs?\b", re.I)
+_MAX_BACKLOGS_RE = re.compile(r"(?:max(?:imum)?|up\s*to|<=?)\s*(\d+)\s*(?:active\s+)?backlogs?", re.I)
+_BATCH_RE = re.compile(r"\b(20\d\d)\s*(?:batch|pass(?:\s*out|ing)?)", re.I)
+
+
+def eligibility_query(criteria, branches):
+    """Students query for a drive's free-text eligibility criteria.
+
+    Recognises a minimum CGPA, backlog limits, a passing-out batch and any of
+    the known branch names; text that is not understood does not narrow the
+    audience, so a drive is never announced to fewer students than it should.
+    """
+    query = {}
+    match = _CGPA_RE.search(criteria)
+    if match:
+        query["cgpa"] = {"$gte": float(match.group(1) or match.group(2))}
+    if _NO_BACKLOGS_RE.search(criteria):
+        query["backlogs_count"] = 0
+    else:
+        match = _MAX_BACKLOGS_RE.search(criteria)
+        if match:
+            query["backlogs_count"] = {"$lte": int(match.group(1))}
+    match = _BATCH_RE.search(criteria)
+    if match:
+        query["year_of_passing"] = int(match.group(1))
+    mentioned = [branch for branch in branches
+                 if re.search(rf"(?<![A-Za-z]){re.escape(branch)}(?![A-Za-z])", criteria, re.I)]
+    if mentioned:
+        query["branch"] = {"$in": mentioned}
+    return query
+
+
+# Templates
+class MessageTemplate:
+    """str.format style template parsed once and rendered by joining parts"""
+
+    def __init__(self, subject, body):
+        self.subject = self._compile(subject)
+        self.body = self._compile(body)
+
+    @staticmethod
+    def _compile(template):
+        parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if literal:
+                parts.append((literal, None))
+            if field is not None:
+                if conversion or "." in field or "[" in field:
+                    raise ValueError(f"Unsupported template field {{{field}}}")
+                parts.append((field, spec or ""))
+        return parts
+
+    @staticmethod
+    def _render(parts, context):
+        return "".join(
+            text if spec is None else format(context.get(text, ""), spec)
+            for text, spec in parts
+        )
+
+    def render(self, context):
+        return self._render(self.subject, context), self._render(self.body, context)
+
+
+DRIVE_ANNOUNCEMENT = MessageTemplate(
+    "New placement drive: {company_name} - {role}",
+    "Dear {name},\n\n"
+    "{company_name} is hiring for the role of {role} (CTC {ctc:g} LPA).\n\n"
+    "Date: {drive_date:%d %b %Y, %I:%M %p}\n"
+    "Location: {location}\n"
+    "Eligibility: {eligibility_criteria}\n\n"
+    "You are eligible for this drive. Contact the placement cell to apply.\n\n"
+    "{job_description}\n",
+)
+
+
+class Message:
+    __slots__ = ("student_id", "to", "subject", "body")
+
+    def __init__(self, student_id, to, subject, body):
+        self.student_id = student_id
+        self.to = to
+        self.subject = subject
+        self.body = body
+
+
+class SendFailure:
+    __slots__ = ("message", "error", "permanent")
+
+    def __init__(self, message, error, permanent=False):
+        self.message = message
+        self.error = error
+        self.permanent = permanent
+
+
+# Transports; send() is blocking and runs in a thread, one batch at a time
+class FileSinkTransport:
+    """Appends messages as JSON lines, one write per batch"""
+
+    def __init__(self, path, sender):
+        self.path = path
+        self.sender = sender
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        sent_at = datetime.now(timezone.utc).isoformat()
+        lines = "".join(json.dumps({
+            "from": self.sender, "to": message.to, "subject": message.subject,
+            "body": message.body, "student_id": message.student_id, "sent_at": sent_at,
+        }) + "\n" for message in messages)
+        with self._lock, open(self.path, "a", encoding="utf-8") as sink:
+            sink.write(lines)
+        return []
+
+    def close(self):
+        pass
+
+
+class SmtpTransport:
+    """SMTP delivery over a pool of reused connections.
+
+    Each batch borrows one connection and sends all of its messages in the
+    same session; connections that drop are replaced on the next batch.
+    """
+
+    def __init__(self, host, port, sender, username=None, password=None, starttls=False, pool_size=8, timeout=30):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._idle = LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def _checkin(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except Exception:
+            connection.close()
+
+    def send(self, messages):
+        failures = []
+        index = 0
+        try:
+            connection = self._checkout()
+        except (smtplib.SMTPException, OSError) as e:
+            return [SendFailure(message, str(e)) for message in messages]
+        try:
+            for index, message in enumerate(messages):
+                email = EmailMessage()
+                email["From"] = self.sender
+                email["To"] = message.to
+                email["Subject"] = message.subject
+                email.set_content(message.body)
+                try:
+                    connection.send_message(email)
+                except smtplib.SMTPRecipientsRefused as e:
+                    failures.append(SendFailure(message, str(e), permanent=True))
+                except smtplib.SMTPResponseException as e:
+                    failures.append(SendFailure(message, f"{e.smtp_code} {e.smtp_error!r}", permanent=e.smtp_code >= 500))
+                    if e.smtp_code == 421:
+                        # Server is closing the session; the rest of the batch is retried
+                        failures.extend(SendFailure(rest, "connection closed") for rest in messages[index + 1:])
+                        connection.close()
+                        return failures
+        except (smtplib.SMTPServerDisconnected, OSError) as e:
+            done = {id(failure.message) for failure in failures}
+            failures.extend(SendFailure(rest, str(e)) for rest in messages[index:] if id(rest) not in done)
+            connection.close()
+            return failures
+        self._checkin(connection)
+        return failures
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                return
+            try:
+                connection.quit()
+            except Exception:
+                connection.close()
+
+
+def transport_from_env(environ):
+    """NOTIFY_TRANSPORT=smtp sends through SMTP_HOST:SMTP_PORT (a local relay
+    such as MailHog by default); otherwise messages go to NOTIFY_SINK_PATH"""
+    sender = environ.get('NOTIFY_FROM', 'placements@localhost')
+    if environ.get('NOTIFY_TRANSPORT') == 'smtp':
+        return SmtpTransport(
+            environ.get('SMTP_HOST', 'localhost'),
+            int(environ.get('SMTP_PORT', '1025')),
+            sender,
+            username=environ.get('SMTP_USERNAME'),
+            password=environ.get('SMTP_PASSWORD'),
+            starttls=environ.get('SMTP_STARTTLS') == 'on',
+            pool_size=int(environ.get('NOTIFY_CONCURRENCY', '8')),
+        )
+    return FileSinkTransport(environ.get('NOTIFY_SINK_PATH', 'outbox.jsonl'), sender)
+
+
+# Metrics
+class NotificationMetrics:
+    """Process-wide delivery counters since startup"""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.send_seconds = 0.0
+
+    def snapshot(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "batches": self.batches,
+            "messages_per_second": round(self.sent / self.send_seconds, 1) if self.send_seconds else None,
+        }
+
+
+metrics = NotificationMetrics()
+
+
+# Fan-out
+STUDENT_FIELDS = {"_id": 0, "id": 1, "name": 1, "email": 1, "roll_no": 1, "branch": 1}
+
+
+async def announce_drive(db, drive, transport, template=DRIVE_ANNOUNCEMENT, batch_size=100, concurrency=8,
+                         retries=3, retry_base=1.0, progress=None):
+    """Send the drive announcement to every eligible student not notified yet.
+
+    Students are streamed in id order and grouped into batches that are sent
+    by at most `concurrency` threads. Failed messages are retried with
+    backoff; permanent (5xx) failures are not. Every student who was sent
+    the message, or failed permanently, gets a `drive_notifications`
+    document keyed by drive and student, so a retried job or a later
+    announce skips them even when new students shift the batches.
+    """
+    branches = await db.students.distinct("branch")
+    query = eligibility_query(drive["eligibility_criteria"], branches)
+    query["email"] = {"$nin": [None, ""]}
+    total = await db.students.count_documents(query)
+
+    run = await db.notification_runs.find_one_and_update(
+        {"drive_id": drive["id"]},
+        {"$setOnInsert": {"drive_id": drive["id"], "sent": 0, "failed": 0, "failures": []},
+         "$set": {"total": total, "started_at": datetime.now(timezone.utc)}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    context = dict(drive)
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"sent": run.get("sent", 0), "failed": run.get("failed", 0), "retried": 0}
+    started = time.monotonic()
+
+    def notification_id(student_id):
+        return f"{drive['id']}:{student_id}"
+
+    async def deliver(messages):
+        async with semaphore:
+            notified = {
+                record["student_id"] async for record in db.drive_notifications.find(
+                    {"_id": {"$in": [notification_id(message.student_id) for message in messages]}},
+                    {"student_id": 1},
+                )
+            }
+            messages = [message for message in messages if message.student_id not in notified]
+            if not messages:
+                return
+            attempted = messages
+            batch_started = time.monotonic()
+            failures = []
+            for attempt in range(retries + 1):
+                attempt_failures = await asyncio.to_thread(transport.send, messages)
+                failures.extend(failure for failure in attempt_failures if failure.permanent)
+                messages = [failure.message for failure in attempt_failures if not failure.permanent]
+                if not messages:
+                    break
+                if attempt == retries:
+                    failures.extend(failure for failure in attempt_failures if not failure.permanent)
+                    break
+                counts["retried"] += len(messages)
+                metrics.retried += len(messages)
+                await asyncio.sleep(retry_base * 2 ** attempt * random.uniform(0.8, 1.2))
+            metrics.send_seconds += time.monotonic() - batch_started
+        # Students whose messages still fail transiently are tried again next time
+        retry_later = {failure.message.student_id for failure in failures if not failure.permanent}
+        permanent = {failure.message.student_id for failure in failures if failure.permanent}
+        now = datetime.now(timezone.utc)
+        records = [
+            {"_id": notification_id(message.student_id), "drive_id": drive["id"], "student_id": message.student_id,
+             "status": "failed" if message.student_id in permanent else "sent", "at": now}
+            for message in attempted if message.student_id not in retry_later
+        ]
+        if records:
+            try:
+                await db.drive_notifications.insert_many(records, ordered=False)
+            except BulkWriteError:
+                # Another run of the same drive recorded some of them first
+                pass
+        sent = len(attempted) - len(failures)
+        counts["sent"] += sent
+        counts["failed"] += len(failures)
+        metrics.sent += sent
+        metrics.failed += len(failures)
+        metrics.batches += 1
+        await db.notification_runs.update_one({"drive_id": drive["id"]}, {
+            "$inc": {"sent": sent, "failed": len(failures)},
+            "$push": {"failures": {"$each": [
+                {"student_id": f.message.student_id, "email": f.message.to, "error": f.error} for f in failures
+            ], "$slice": -100}},
+        })
+        if progress:
+            await progress(counts["sent"] + counts["failed"], total)
+
+    pending = set()
+    batch = []
+
+    def flush():
+        nonlocal batch
+        pending.add(asyncio.create_task(deliver(batch)))
+        batch = []
+
+    async for student in db.students.find(query, STUDENT_FIELDS).sort("id", 1):
+        context.update(student)
+        subject, body = template.render(context)
+        batch.append(Message(student["id"], student["email"], subject, body))
+        if len(batch) >= batch_size:
+            flush()
+            # Keep a bounded number of rendered batches in memory
+            if len(pending) >= concurrency * 2:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    task.result()
+    if batch:
+        flush()
+    if pending:
+        await asyncio.gather(*pending)
+
+    elapsed = time.monotonic() - started
+    await db.notification_runs.update_one(
+        {"drive_id": drive["id"]}, {"$set": {"finished_at": datetime.now(timezone.utc)}}
+    )
+    return {
+        "eligible": total,
+        "sent": counts["sent"],
+        "failed": counts["failed"],
+        "retried": counts["retried"],
+        "seconds": round(elapsed, 2),
+    }
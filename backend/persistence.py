@@ -0,0 +1,280 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Each log record is framed as big-endian (length, crc32) followed by JSON
+FRAME = struct.Struct(">II")
+SNAPSHOT_MAGIC = b"IDXSNAP1"
+_SEGMENT_RE = re.compile(r"^(wal|snapshot)-(\d{8})\.(log|bin)$")
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_log(path):
+    """Yield the records of a log segment; returns the length of its valid prefix.
+
+    A crash can leave a partly written last record, which is detected by
+    its length or checksum and ends the segment.
+    """
+    valid = 0
+    with open(path, "rb") as log:
+        while True:
+            header = log.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return valid
+            length, checksum = FRAME.unpack(header)
+            payload = log.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return valid
+            valid += FRAME.size + length
+            yield json.loads(payload)
+
+
+class WriteAheadLog:
+    """Append-only log with group commit.
+
+    append() only writes to the file buffer; sync(lsn) makes that record
+    durable. The first thread to sync becomes the leader, waits a moment
+    for others to append, and one fsync covers all of them while the rest
+    wait for it.
+    """
+
+    def __init__(self, path, group_window=0.002):
+        self.group_window = group_window
+        self._lock = threading.Lock()
+        self._synced = threading.Condition()
+        self._file = open(path, "ab")
+        self._lsn = 0
+        self._durable = 0
+        self._syncing = False
+
+    def append(self, record):
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._file.write(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._lsn += 1
+            return self._lsn
+
+    def _flush(self):
+        with self._lock:
+            self._file.flush()
+            target = self._lsn
+            fd = self._file.fileno()
+        os.fsync(fd)
+        return target
+
+    def sync(self, lsn):
+        with self._synced:
+            while self._durable < lsn:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+                self._syncing = True
+                self._synced.release()
+                try:
+                    if self.group_window:
+                        time.sleep(self.group_window)
+                    target = self._flush()
+                finally:
+                    self._synced.acquire()
+                    self._syncing = False
+                self._durable = max(self._durable, target)
+                self._synced.notify_all()
+
+    def rotate(self, path):
+        """Continue in a new segment once everything so far is durable"""
+        with self._synced:
+            while self._syncing:
+                self._synced.wait()
+            with self._lock:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = open(path, "ab")
+                self._durable = self._lsn
+            self._synced.notify_all()
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+class StoreLocked(RuntimeError):
+    """Another process has the store directory open"""
+
+
+class StorePersistence:
+    """Snapshot plus write-ahead log durability for an IndexedStore.
+
+    The directory holds snapshot-N.bin, the pickled store state (including
+    its indexes) as of the start of wal-N.log, and the log segments written
+    since. Opening memory-maps the newest snapshot and replays only the
+    segments after it; a snapshot is taken every `snapshot_every` records,
+    after which older segments and snapshots are deleted. One process at a
+    time may open a directory, enforced with a lock file.
+    """
+
+    def __init__(self, store, directory, snapshot_every=50000, check_interval=30.0, group_window=0.002):
+        self.store = store
+        self.directory = Path(directory)
+        self.snapshot_every = snapshot_every
+        self.check_interval = check_interval
+        self.group_window = group_window
+        self.sequence = 0
+        self.records_since_snapshot = 0
+        self.wal = None
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+    def _files(self, kind):
+        found = {}
+        for path in self.directory.iterdir():
+            match = _SEGMENT_RE.match(path.name)
+            if match and match.group(1) == kind:
+                found[int(match.group(2))] = path
+        return dict(sorted(found.items()))
+
+    def _path(self, kind, sequence):
+        return self.directory / (f"wal-{sequence:08d}.log" if kind == "wal" else f"snapshot-{sequence:08d}.bin")
+
+    def _load_snapshot(self):
+        for sequence, path in reversed(self._files("snapshot").items()):
+            try:
+                with open(path, "rb") as snapshot, mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                        raise ValueError("bad magic")
+                    with memoryview(mapped) as view:
+                        state = pickle.loads(view[len(SNAPSHOT_MAGIC):])
+            except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+                logger.warning(f"Skipping unreadable snapshot {path}: {e}")
+                continue
+            self.store.restore(state)
+            return sequence
+        return 0
+
+    def open(self, seed=()):
+        """Load the store from disk, or from seed when the directory is new, and start journaling"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(self.directory / "LOCK", "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise StoreLocked(f"{self.directory} is in use by another process")
+        started = time.monotonic()
+        snapshot_sequence = self._load_snapshot()
+        segments = {sequence: path for sequence, path in self._files("wal").items() if sequence >= snapshot_sequence}
+        fresh = not snapshot_sequence and not segments
+
+        replayed = 0
+        last = max(segments, default=None)
+        for sequence, path in segments.items():
+            records = read_log(path)
+            while True:
+                try:
+                    record = next(records)
+                except StopIteration as done:
+                    valid = done.value
+                    break
+                self.store.replay(record)
+                replayed += 1
+            if valid < path.stat().st_size:
+                if sequence != last:
+                    raise RuntimeError(f"{path} is corrupt before the end of the log")
+                logger.warning(f"Truncating torn tail of {path} at byte {valid}")
+                with open(path, "r+b") as log:
+                    log.truncate(valid)
+                    os.fsync(log.fileno())
+
+        self.sequence = max([snapshot_sequence, *segments])
+        if fresh:
+            for entry in seed:
+                self.store.put(dict(entry))
+        self.records_since_snapshot = replayed
+        self.sequence += 1
+        self.wal = WriteAheadLog(self._path("wal", self.sequence), self.group_window)
+        _fsync_directory(self.directory)
+        self.store.journal = self
+        if fresh or replayed >= self.snapshot_every:
+            self.snapshot()
+        logger.info(f"Loaded {len(self.store)} records from {self.directory} in "
+                    f"{(time.monotonic() - started) * 1000:.0f} ms ({replayed} log records replayed)")
+        return self
+
+    # Journal interface used by IndexedStore, called with the store lock held
+    def append(self, record):
+        self.records_since_snapshot += 1
+        return self.wal.append(record)
+
+    def sync(self, lsn):
+        self.wal.sync(lsn)
+
+    def snapshot(self):
+        with self._snapshot_lock:
+            with self.store.lock.read():
+                # Pickling under the read side gives a consistent state;
+                # writers wait for it, readers do not
+                data = pickle.dumps(self.store.state(), protocol=pickle.HIGHEST_PROTOCOL)
+                self.sequence += 1
+                sequence = self.sequence
+                self.wal.rotate(self._path("wal", sequence))
+                self.records_since_snapshot = 0
+
+            path = self._path("snapshot", sequence)
+            temporary = path.with_suffix(".tmp")
+            with open(temporary, "wb") as snapshot:
+                snapshot.write(SNAPSHOT_MAGIC)
+                snapshot.write(data)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(temporary, path)
+            _fsync_directory(self.directory)
+
+            for kind in ("wal", "snapshot"):
+                for old_sequence, old_path in self._files(kind).items():
+                    if old_sequence < sequence:
+                        old_path.unlink()
+            logger.info(f"Snapshot {path.name}: {len(data)} bytes")
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            if self.records_since_snapshot >= self.snapshot_every:
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    logger.error(f"Snapshot of {self.directory} failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"snapshots:{self.directory.name}", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self.wal:
+            self.wal.close()
+            self.wal = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
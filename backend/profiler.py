@@ -0,0 +1,302 @@
+"""On-demand sampling profiler for individual requests.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or is
+picked by PROFILE_SAMPLE_RATE. While any profiled request is in flight a
+background thread samples every PROFILE_INTERVAL_MS. Each sample checks
+whether the request's task is the one running on the event loop: if so
+the thread's stack is recorded as CPU time, otherwise the task's chain
+of awaits is recorded as await time (Mongo round trips, threadpool
+handlers, locks). Samples are weighted by the time since the previous
+one and saved per request, to be downloaded as collapsed stacks
+(flamegraph.pl, speedscope) or speedscope JSON.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MAX_DEPTH = 128
+CPU = "cpu"
+AWAIT = "await"
+
+try:
+    from _asyncio import _current_tasks
+except ImportError:
+    from asyncio.tasks import _current_tasks
+
+
+_labels = {}
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+    return label
+
+
+def _thread_stack(frame, root_code):
+    """Labels from root_code's frame down to the leaf; the whole stack if root_code is not on it"""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_label(frame.f_code))
+        if frame.f_code is root_code:
+            break
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def _await_stack(task, root_code):
+    """Labels along the task's await chain, starting at root_code, ending at what it waits on"""
+    labels = []
+    started = False
+    awaitable = task.get_coro()
+    while awaitable is not None and len(labels) < MAX_DEPTH:
+        frame = (getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+                 or getattr(awaitable, "ag_frame", None))
+        if frame is None:
+            if hasattr(awaitable, "cr_await") or hasattr(awaitable, "gi_yieldfrom"):
+                break
+            # A Future or other awaitable object at the end of the chain
+            labels.append(f"<{type(awaitable).__name__}>")
+            break
+        started = started or frame.f_code is root_code
+        if started:
+            labels.append(_label(frame.f_code))
+        awaitable = (getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+                     or getattr(awaitable, "ag_await", None))
+    return ";".join(labels) or "<unknown>"
+
+
+class RequestProfile:
+    def __init__(self, scope, trigger, loop, task):
+        self.id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        self.meta = {
+            "id": self.id,
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "trigger": trigger,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.loop = loop
+        self.task = task
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        # Microseconds per stack, for CPU and await samples
+        self.stacks = {CPU: defaultdict(int), AWAIT: defaultdict(int)}
+
+    def result(self, status, truncated):
+        wall_us = int((time.perf_counter() - self.started) * 1e6)
+        cpu_us = sum(self.stacks[CPU].values())
+        await_us = sum(self.stacks[AWAIT].values())
+        return {
+            **self.meta,
+            "status": status,
+            "truncated": truncated,
+            "wall_ms": round(wall_us / 1000, 2),
+            "cpu_ms": round(cpu_us / 1000, 2),
+            "await_ms": round(await_us / 1000, 2),
+            "stacks": {kind: dict(stacks) for kind, stacks in self.stacks.items()},
+        }
+
+
+class StackSampler:
+    """Background thread sampling the requests registered with it; idle when there are none"""
+
+    def __init__(self, interval, root_code, max_seconds):
+        self.interval = interval
+        self.root_code = root_code
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.active = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, profile):
+        with self.lock:
+            self.active[profile.id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, profile):
+        with self.lock:
+            self.active.pop(profile.id, None)
+
+    def _sample(self, elapsed_us):
+        frames = sys._current_frames()
+        now = time.perf_counter()
+        for profile in list(self.active.values()):
+            if now - profile.started > self.max_seconds:
+                continue
+            if _current_tasks.get(profile.loop) is profile.task:
+                stack = _thread_stack(frames.get(profile.thread_id), self.root_code)
+                profile.stacks[CPU][stack] += elapsed_us
+            else:
+                profile.stacks[AWAIT][_await_stack(profile.task, self.root_code)] += elapsed_us
+
+    def _run(self):
+        last = time.perf_counter()
+        while True:
+            if not self.active:
+                self._wake.clear()
+                self._wake.wait()
+                last = time.perf_counter()
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self.lock:
+                self._sample(int((now - last) * 1e6))
+            last = now
+
+
+class ProfileStore:
+    """Finished profiles as JSON files, newest `keep` retained; shared by all worker processes"""
+
+    def __init__(self, directory, keep=100):
+        self.directory = Path(directory)
+        self.keep = keep
+
+    def save(self, result):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{result['id']}.json"
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(result))
+        os.replace(temporary, path)
+        for old in sorted(self.directory.glob("*.json"))[:-self.keep]:
+            old.unlink(missing_ok=True)
+
+    def list(self):
+        profiles = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True) if self.directory.exists() else ():
+            try:
+                result = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            result.pop("stacks", None)
+            profiles.append(result)
+        return profiles
+
+    def load(self, profile_id):
+        if not profile_id.replace("-", "").isalnum():
+            return None
+        path = self.directory / f"{profile_id}.json"
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+
+def collapsed(result):
+    """Brendan Gregg's collapsed format, one "kind;frame;...;frame microseconds" line per stack"""
+    lines = []
+    for kind, stacks in result["stacks"].items():
+        for stack, weight in sorted(stacks.items()):
+            lines.append(f"{kind};{stack} {weight}")
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(result):
+    """A speedscope file with one sampled profile for CPU time and one for await time"""
+    frames, frame_index, profiles = [], {}, []
+    for kind, stacks in result["stacks"].items():
+        samples, weights = [], []
+        for stack, weight in stacks.items():
+            indexes = []
+            for label in stack.split(";"):
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indexes.append(frame_index[label])
+            samples.append(indexes)
+            weights.append(weight)
+        profiles.append({
+            "type": "sampled",
+            "name": f"{result['method']} {result['path']} ({kind})",
+            "unit": "microseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{result['method']} {result['path']} {result['id']}",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+        "exporter": "request-profiler",
+    }
+
+
+def authorized(value, token):
+    return bool(token) and value is not None and hmac.compare_digest(value.encode(), token.encode())
+
+
+class ProfilerMiddleware:
+    """Profiles requests with an authorized X-Profile header, or a sampled fraction of all requests.
+
+    Header-triggered responses carry X-Profile-Id naming the saved profile.
+    Paths under exempt_prefixes (long-lived streams, the profile downloads
+    themselves) are never profiled.
+    """
+
+    def __init__(self, app, store: ProfileStore, token=None, sample_rate=0.0, interval=0.005, max_seconds=30.0,
+                 exempt_prefixes=()):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.exempt_prefixes = tuple(exempt_prefixes)
+        # Stacks are cut at this middleware, above which only the server's own frames sit
+        self.sampler = StackSampler(interval, ProfilerMiddleware.__call__.__code__, max_seconds)
+
+    def _trigger(self, scope):
+        if scope.get("path", "").startswith(self.exempt_prefixes):
+            return None
+        for name, value in scope["headers"]:
+            if name.lower() == b"x-profile":
+                return "header" if authorized(value.decode("latin-1"), self.token) else None
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        trigger = self._trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope, trigger, asyncio.get_running_loop(), asyncio.current_task())
+        status = {"code": None}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if trigger == "header":
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        self.sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.sampler.remove(profile)
+            truncated = time.perf_counter() - profile.started > self.sampler.max_seconds
+            result = profile.result(status["code"], truncated)
+            try:
+                await asyncio.to_thread(self.store.save, result)
+            except OSError as e:
+                logger.error(f"Could not save profile {profile.id}: {e}")
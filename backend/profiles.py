@@ -0,0 +1,59 @@
+from archive import archive_name
+
+# Drive fields dropped before the join result leaves the server
+DRIVE_EXCLUDED = ("_id", "job_description", "eligibility_criteria", "company_id", "company_name", "role", "ctc",
+                  "created_at")
+
+
+async def ensure_profile_indexes(db):
+    # applications.student_id is covered by the (student_id, applied_date) index
+    await db.offer_letters.create_index("student_id")
+    await db.drives.create_index("id")
+
+
+def profile_pipeline(student_ids, archived=False):
+    """One aggregation returning students with their applications, drives and offers.
+
+    Every $lookup is a plain localField/foreignField equality join, so each
+    uses the index on the foreign field. Archived students are joined to the
+    archived applications and offers that were moved with them.
+    """
+    applications = archive_name("applications") if archived else "applications"
+    offers = archive_name("offer_letters") if archived else "offer_letters"
+    return [
+        {"$match": {"id": {"$in": student_ids}}},
+        {"$lookup": {"from": applications, "localField": "id", "foreignField": "student_id", "as": "applications"}},
+        {"$lookup": {"from": offers, "localField": "id", "foreignField": "student_id", "as": "offers"}},
+        # An array localField joins every drive the student applied to at once
+        {"$lookup": {"from": "drives", "localField": "applications.drive_id", "foreignField": "id", "as": "drives"}},
+        {"$project": {"_id": 0, **{f"drives.{field}": 0 for field in DRIVE_EXCLUDED}}},
+    ]
+
+
+def _split(doc):
+    drives = {drive["id"]: drive for drive in doc.pop("drives")}
+    applications = doc.pop("applications")
+    for application in applications:
+        drive = drives.get(application["drive_id"], {})
+        application["drive_status"] = drive.get("status")
+        application["drive_date"] = drive.get("drive_date")
+        application["drive_location"] = drive.get("location")
+    return {"student": doc, "applications": applications, "offers": doc.pop("offers")}
+
+
+async def load_profiles(db, student_ids, include_archived=False):
+    """Profiles for many students in one round trip, keyed by id.
+
+    Ids are deduplicated, so a caller collecting ids from many components
+    (DataLoader style) pays for each student once; archived students are
+    looked up in a second aggregation only for the ids still missing.
+    """
+    wanted = list(dict.fromkeys(student_ids))
+    profiles = {}
+    async for doc in db.students.aggregate(profile_pipeline(wanted)):
+        profiles[doc["id"]] = _split(doc)
+    missing = [student_id for student_id in wanted if student_id not in profiles]
+    if include_archived and missing:
+        async for doc in db[archive_name("students")].aggregate(profile_pipeline(missing, archived=True)):
+            profiles[doc["id"]] = _split(doc)
+    return profiles
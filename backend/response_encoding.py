@@ -0,0 +1,196 @@
+import json
+import zlib
+from typing import Optional
+
+from fastapi import Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Formats that are already compressed gain nothing from another pass
+INCOMPRESSIBLE_TYPES = (
+    b"application/zip", b"application/gzip", b"application/pdf",
+    b"application/vnd.openxmlformats", b"image/", b"audio/", b"video/",
+)
+
+
+# List payload formats
+def to_columns(rows):
+    """Columnar shape: each key once, values in parallel arrays"""
+    columns = {}
+    for index, row in enumerate(rows):
+        for key in row:
+            if key not in columns:
+                columns[key] = [None] * index
+        for key, values in columns.items():
+            values.append(row.get(key))
+    return {"count": len(rows), "columns": columns}
+
+
+class ListEncoding:
+    def __init__(self, columns=False, use_msgpack=False):
+        self.columns = columns
+        self.use_msgpack = use_msgpack
+
+    @property
+    def is_default(self):
+        return not self.columns and not self.use_msgpack
+
+
+def list_encoding(request: Request, format: Optional[str] = Query(None, pattern="^columns$")):
+    """Negotiates ?format=columns and Accept: application/msgpack for list routes"""
+    accept = request.headers.get("accept", "")
+    return ListEncoding(
+        columns=format == "columns",
+        use_msgpack=msgpack is not None and MSGPACK_MEDIA_TYPE in accept,
+    )
+
+
+def encode_list(items, encoding: ListEncoding):
+    if encoding.is_default:
+        return items
+    data = jsonable_encoder(items)
+    if encoding.columns:
+        data = to_columns(data)
+    if encoding.use_msgpack:
+        return Response(msgpack.packb(data), media_type=MSGPACK_MEDIA_TYPE, headers={"Vary": "Accept"})
+    return Response(json.dumps(data, separators=(",", ":")), media_type="application/json", headers={"Vary": "Accept"})
+
+
+# Response compression
+def _compressor(encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if encoding == "br":
+        return brotli.Compressor(quality=4)
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _finish(compressor, encoding):
+    if encoding == "br":
+        return compressor.finish()
+    return compressor.flush()
+
+
+def _compress_chunk(compressor, encoding, data):
+    if encoding == "br":
+        return compressor.process(data)
+    return compressor.compress(data)
+
+
+def available_encodings():
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding):
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """gzip, brotli or zstd response compression above a size threshold.
+
+    Brotli and zstd are used only when their packages are installed. Event
+    streams, byte-range responses, already-encoded responses and compressed
+    media types pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size=1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] == "http.response.zerocopysend" and state["start"] is not None:
+                # A file handed to the server as is; never compressed
+                state["passthrough"] = True
+                await send(state["start"])
+                state["start"] = None
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if state["compressor"] is None:
+                start = state["start"]
+                response_headers = {k.lower(): v for k, v in start["headers"]}
+                content_type = response_headers.get(b"content-type", b"")
+                if (b"content-encoding" in response_headers
+                        or b"content-range" in response_headers
+                        or content_type.startswith(b"text/event-stream")
+                        or content_type.startswith(INCOMPRESSIBLE_TYPES)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                state["compressor"] = _compressor(encoding)
+                new_headers = [(k, v) for k, v in start["headers"]
+                               if k.lower() not in (b"content-length", b"content-encoding")]
+                new_headers.append((b"content-encoding", encoding.encode()))
+                new_headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    compressed = _compress_chunk(state["compressor"], encoding, body) + _finish(state["compressor"], encoding)
+                    new_headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start, "headers": new_headers})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send({**start, "headers": new_headers})
+
+            chunk = _compress_chunk(state["compressor"], encoding, body)
+            if not more_body:
+                chunk += _finish(state["compressor"], encoding)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,216 @@
+import asyncio
+import io
+import logging
+import os
+import re
+import unicodedata
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePath
+from xml.etree import ElementTree
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+logger = logging.getLogger(__name__)
+
+# Keeps technology names such as c++, c#, node.js and .net intact
+_TOKEN_RE = re.compile(r"\.?[a-z0-9][a-z0-9+#.]*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i in is it my of on or the to was were will with".split()
+)
+MAX_TERMS = 2000
+
+
+def normalize_tokens(text):
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    tokens = set()
+    for token in _TOKEN_RE.findall(text):
+        token = token.rstrip(".")
+        if len(token) > 1 and len(token) <= 40 and token not in STOPWORDS:
+            tokens.add(token)
+    return tokens
+
+
+# Text extraction; runs in worker processes
+_DOCX_TEXT = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}t"
+_PDF_STREAM_RE = re.compile(rb"stream\r?\n(.*?)\r?\nendstream", re.S)
+_PDF_STRING_RE = re.compile(rb"\(((?:\\.|[^\\)])*)\)")
+_PDF_TEXT_OP_RE = re.compile(rb"(\((?:\\.|[^\\)])*\)\s*Tj|\[(?:[^\]]*)\]\s*TJ)")
+
+
+def _docx_text(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    return " ".join(node.text or "" for node in root.iter(_DOCX_TEXT))
+
+
+def _pdf_text_fallback(data):
+    """Pulls Tj/TJ string operands out of (Flate-compressed) content streams"""
+    parts = []
+    for stream in _PDF_STREAM_RE.findall(data):
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass
+        for operator in _PDF_TEXT_OP_RE.findall(stream):
+            # TJ splits words into kerned fragments, so only operators are spaced
+            for literal in _PDF_STRING_RE.findall(operator):
+                parts.append(re.sub(rb"\\(.)", rb"\1", literal).decode("latin-1"))
+            parts.append(" ")
+    return "".join(parts)
+
+
+def _pdf_text(data):
+    if pypdf is None:
+        return _pdf_text_fallback(data)
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    return " ".join(page.extract_text() or "" for page in reader.pages)
+
+
+def extract_terms(data, filename):
+    """Normalized terms of a PDF or DOCX resume; top-level so it can be pickled"""
+    suffix = PurePath(filename or "").suffix.lower()
+    try:
+        if suffix == ".docx" or data[:2] == b"PK":
+            text = _docx_text(data)
+        else:
+            text = _pdf_text(data)
+    except Exception as e:
+        logger.warning(f"Could not extract text from {filename}: {e}")
+        return []
+    return sorted(normalize_tokens(text))[:MAX_TERMS]
+
+
+_pool = None
+
+
+def extraction_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor()
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class ResumeIndex:
+    """Inverted index from resume and skill terms to student ids.
+
+    resume_postings holds one document per term with the ids of students
+    whose resume or skills contain it; resume_terms keeps each student's
+    current terms so an update only touches the postings that changed.
+    """
+
+    def __init__(self, db, attempts=10):
+        self.db = db
+        self.attempts = attempts
+
+    async def update(self, student_id, terms):
+        """Move the student's postings to `terms`.
+
+        resume_terms carries a version. The postings diff is applied, then the
+        new terms are written only if the version is unchanged; when another
+        update of the same student committed in between, the diff is redone
+        against its terms. The last update to commit leaves the postings
+        matching its terms, whatever the others wrote before losing.
+        """
+        terms = set(terms)
+        for _ in range(self.attempts):
+            previous = await self.db.resume_terms.find_one({"_id": student_id})
+            old_terms = set(previous["terms"]) if previous else set()
+            version = previous.get("version") if previous else None
+            added, removed = terms - old_terms, old_terms - terms
+            if added:
+                await self.db.resume_postings.bulk_write([
+                    _posting_update(term, {"$addToSet": {"ids": student_id}}, upsert=True) for term in added
+                ], ordered=False)
+            if removed:
+                await self.db.resume_postings.bulk_write([
+                    _posting_update(term, {"$pull": {"ids": student_id}}) for term in removed
+                ], ordered=False)
+            try:
+                await self.db.resume_terms.replace_one(
+                    {"_id": student_id, "version": version},
+                    {"terms": sorted(terms), "version": (version or 0) + 1},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                # Another update of this student committed first
+                continue
+            return len(added), len(removed)
+        raise RuntimeError(f"Resume terms of {student_id} kept changing during the update")
+
+    async def remove(self, student_id):
+        await self.update(student_id, [])
+        await self.db.resume_terms.delete_one({"_id": student_id})
+
+    async def search(self, query):
+        """Ids of students matching every term of the query, or None for an empty query"""
+        terms = normalize_tokens(query)
+        if not terms:
+            return None
+        postings = await self.db.resume_postings.find({"_id": {"$in": list(terms)}}).to_list(None)
+        if len(postings) < len(terms):
+            return set()
+        postings.sort(key=lambda posting: len(posting["ids"]))
+        ids = set(postings[0]["ids"])
+        for posting in postings[1:]:
+            ids.intersection_update(posting["ids"])
+            if not ids:
+                break
+        return ids
+
+
+def _posting_update(term, update, upsert=False):
+    return UpdateOne({"_id": term}, update, upsert=upsert)
+
+
+async def terms_for_student(student, bucket):
+    """Resume terms (extracted in the process pool) plus normalized self-reported skills"""
+    terms = normalize_tokens(" ".join(student.get("skills") or []))
+    if student.get("resume_file_id"):
+        grid_out = await bucket.open_download_stream(ObjectId(student["resume_file_id"]))
+        data = await grid_out.read()
+        loop = asyncio.get_running_loop()
+        terms.update(await loop.run_in_executor(extraction_pool(), extract_terms, data, grid_out.filename))
+    return terms
+
+
+async def reindex_all(db, bucket, progress=None, concurrency=None):
+    """Rebuild every student's postings, keeping all cores of the pool busy"""
+    index = ResumeIndex(db)
+    total = await db.students.count_documents({})
+    # Two files in flight per core keeps the pool busy while GridFS reads wait
+    semaphore = asyncio.Semaphore(concurrency or (os.cpu_count() or 1) * 2)
+    done = 0
+
+    async def reindex(student):
+        nonlocal done
+        async with semaphore:
+            terms = await terms_for_student(student, bucket)
+            await index.update(student["id"], terms)
+        done += 1
+        if progress:
+            await progress(done, total)
+
+    batch = []
+    async for student in db.students.find({}, {"id": 1, "skills": 1, "resume_file_id": 1}):
+        batch.append(asyncio.create_task(reindex(student)))
+        if len(batch) >= 500:
+            await asyncio.gather(*batch)
+            batch = []
+    await asyncio.gather(*batch)
+    return {"indexed_students": done}
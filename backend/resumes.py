@@ -0,0 +1,161 @@
+import hashlib
+import re
+import zipfile
+from pathlib import PurePath
+
+from bson import ObjectId
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+CHUNK_SIZE = 256 * 1024
+RESUME_BUCKET = "resumes"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ResumeTooLarge(Exception):
+    pass
+
+
+def resume_bucket(database):
+    return AsyncIOMotorGridFSBucket(database, bucket_name=RESUME_BUCKET)
+
+
+async def ensure_resume_indexes(database):
+    await database[f"{RESUME_BUCKET}.files"].create_index("metadata.sha256")
+
+
+async def store_resume(database, upload, max_bytes):
+    """Store an uploaded resume in GridFS, reusing an identical existing file.
+
+    The upload is hashed in a first pass over Starlette's spooled temp file,
+    so a duplicate is never written; returns (file_id, sha256).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await upload.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            raise ResumeTooLarge(max_bytes)
+        digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    existing = await database[f"{RESUME_BUCKET}.files"].find_one({"metadata.sha256": sha256}, {"_id": 1})
+    if existing:
+        return existing["_id"], sha256
+
+    await upload.seek(0)
+    bucket = resume_bucket(database)
+    stream = bucket.open_upload_stream(
+        upload.filename or "resume",
+        chunk_size_bytes=CHUNK_SIZE,
+        metadata={"sha256": sha256, "content_type": upload.content_type},
+    )
+    try:
+        while chunk := await upload.read(CHUNK_SIZE):
+            await stream.write(chunk)
+    except BaseException:
+        await stream.abort()
+        raise
+    await stream.close()
+    return stream._id, sha256
+
+
+async def release_resume(database, file_id):
+    """Delete a resume file once no student, current or archived, refers to it.
+
+    Identical uploads share one file, so it can outlive the student that
+    uploaded it. Returns whether the file was deleted.
+    """
+    for collection in ("students", "students_archive"):
+        if await database[collection].count_documents({"resume_file_id": file_id}, limit=1):
+            return False
+    try:
+        await resume_bucket(database).delete(ObjectId(file_id))
+    except NoFile:
+        # Released concurrently by another request
+        return False
+    return True
+
+
+def parse_range(header, length):
+    """(start, end) inclusive for a single "bytes=" range, None for the whole
+    file, or ValueError when the range cannot be satisfied"""
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple or malformed ranges: serve the whole file
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        suffix = int(last)
+        if suffix == 0 or length == 0:
+            raise ValueError(header)
+        return max(length - suffix, 0), length - 1
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+async def iter_grid_out(grid_out, start=0, end=None):
+    """Yield a GridFS file's bytes [start, end] without buffering the file"""
+    if end is None:
+        end = grid_out.length - 1
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+class _ZipSink:
+    """Write target for zipfile that hands bytes out as they are produced"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+async def stream_zip(database, entries):
+    """Zip (base_name, file_id) pairs from GridFS on the fly in constant memory.
+
+    Each entry keeps the extension of its uploaded file name. Resumes are PDFs
+    and DOCX files that are already compressed, so entries are stored rather
+    than deflated.
+    """
+    bucket = resume_bucket(database)
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, file_id in entries:
+            grid_out = await bucket.open_download_stream(file_id)
+            suffix = PurePath(grid_out.filename or "").suffix
+            with archive.open(f"{name}{suffix}", "w", force_zip64=True) as member:
+                async for chunk in iter_grid_out(grid_out):
+                    member.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone
+
+from leases import Lease
+
+logger = logging.getLogger(__name__)
+
+
+class DriveLifecycleScheduler:
+    """Moves drives upcoming -> ongoing at drive_date and ongoing -> completed
+    once drive_duration has passed.
+
+    Only drives due within `horizon` are held in a min-heap, loaded with an
+    indexed (status, drive_date) range query; writes to drives reach the
+    scheduler through the invalidation bus, so it never polls the collection.
+    Without an invalidation transport, writes on other workers never arrive;
+    pass `refresh_interval` (seconds) to reload the window that often instead.
+    One worker at a time runs transitions, guarded by a lease document.
+    """
+
+    def __init__(self, db, on_transition, drive_duration=timedelta(hours=24),
+                 horizon=timedelta(hours=6), lease_ttl=30.0, drives_key="drives", refresh_interval=None):
+        self.db = db
+        # Invalidation bus key for this scheduler's drives collection
+        self.drives_key = drives_key
+        self.name = f"drive_scheduler:{drives_key}"
+        self.on_transition = on_transition
+        self.drive_duration = drive_duration
+        self.horizon = horizon
+        self.refresh_interval = refresh_interval
+        self.lease = Lease(db.leases, "drive_lifecycle", ttl=lease_ttl)
+        self._heap = []
+        self._scheduled = {}
+        self._pending_ids = set()
+        self._window_end = None
+        self._refresh_at = None
+        self._wakeup = asyncio.Event()
+
+    # Invalidation bus hooks
+    def invalidate(self, collection, key=None):
+        if collection != self.drives_key:
+            return
+        if key is None:
+            self._window_end = None
+        else:
+            self._pending_ids.add(key)
+        self._wakeup.set()
+
+    def clear(self):
+        self._window_end = None
+        self._wakeup.set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, drive):
+        status = drive.get("status")
+        drive_date = drive.get("drive_date")
+        if not isinstance(drive_date, datetime):
+            return
+        if drive_date.tzinfo is None:
+            drive_date = drive_date.replace(tzinfo=timezone.utc)
+        if status == "upcoming":
+            due, target = drive_date, "ongoing"
+        elif status == "ongoing":
+            due, target = drive_date + self.drive_duration, "completed"
+        else:
+            return
+        if self._window_end and due > self._window_end:
+            return
+        key = (drive["id"], target)
+        if self._scheduled.get(key) == due:
+            return
+        self._scheduled[key] = due
+        heapq.heappush(self._heap, (due, drive["id"], target))
+
+    def _window_stale(self, now):
+        if self._window_end is None or now >= self._window_end:
+            return True
+        return self._refresh_at is not None and now >= self._refresh_at
+
+    async def _load_window(self, now):
+        self._heap.clear()
+        self._scheduled.clear()
+        self._pending_ids.clear()
+        self._window_end = now + self.horizon
+        if self.refresh_interval:
+            self._refresh_at = now + timedelta(seconds=self.refresh_interval)
+        query = {"$or": [
+            {"status": "upcoming", "drive_date": {"$lte": self._window_end}},
+            {"status": "ongoing", "drive_date": {"$lte": self._window_end - self.drive_duration}},
+        ]}
+        async for drive in self.db.drives.find(query, {"id": 1, "status": 1, "drive_date": 1}):
+            self._push(drive)
+        logger.info(f"Drive scheduler loaded {len(self._heap)} transitions until {self._window_end.isoformat()}")
+
+    async def _load_pending(self):
+        ids, self._pending_ids = list(self._pending_ids), set()
+        query = {"id": {"$in": ids}, "status": {"$in": ["upcoming", "ongoing"]}}
+        async for drive in self.db.drives.find(query, {"id": 1, "status": 1, "drive_date": 1}):
+            self._push(drive)
+
+    async def _apply_due(self, now):
+        due = {"ongoing": [], "completed": []}
+        while self._heap and self._heap[0][0] <= now:
+            _, drive_id, target = heapq.heappop(self._heap)
+            self._scheduled.pop((drive_id, target), None)
+            due[target].append(drive_id)
+
+        for target, source, cutoff in (
+            ("ongoing", "upcoming", now),
+            ("completed", "ongoing", now - self.drive_duration),
+        ):
+            if not due[target]:
+                continue
+            # Re-check status and date so manual changes since loading are respected
+            query = {"id": {"$in": due[target]}, "status": source, "drive_date": {"$lte": cutoff}}
+            changed = [d["id"] async for d in self.db.drives.find(query, {"id": 1})]
+            if not changed:
+                continue
+            query["id"] = {"$in": changed}
+            await self.db.drives.update_many(query, {"$set": {"status": target}})
+            logger.info(f"Drive scheduler moved {len(changed)} drives to {target}")
+            await self.on_transition(changed, target)
+
+    async def run(self):
+        while True:
+            try:
+                if not await self.lease.acquire():
+                    self._window_end = None
+                    await asyncio.sleep(self.lease.ttl / 3)
+                    continue
+
+                now = datetime.now(timezone.utc)
+                if self._window_stale(now):
+                    await self._load_window(now)
+                if self._pending_ids:
+                    await self._load_pending()
+                await self._apply_due(now)
+
+                timeout = self.lease.ttl / 3
+                if self._heap:
+                    timeout = min(timeout, max((self._heap[0][0] - now).total_seconds(), 0))
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                await self.lease.release()
+                raise
+            except Exception as e:
+                logger.error(f"Drive scheduler error: {e}")
+                await asyncio.sleep(5)
@@ -1,5 +1,5 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Header, Depends, UploadFile, File
+from fastapi.responses import FileResponse, StreamingResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -9,16 +9,94 @@ from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone, date
+from datetime import datetime, timezone, date, timedelta
 from enum import Enum
+import asyncio
+import json
+
+from events import StatusEventBus, stream_events, watch_status_changes, APPLICATION_STATUS, DRIVE_STATUS
+from migrations import parse_iso_datetime
+from invalidation import InvalidationBus, LocalCache, UnixSocketTransport, ChangeStreamTransport
+from scheduler import DriveLifecycleScheduler
+from changelog import ChangeLog, collapse, UPSERT, DELETE
+from archive import archive_batch, archived_totals, archive_name, ensure_archive_indexes, union_pipeline
+from response_encoding import CompressionMiddleware, ListEncoding, list_encoding, encode_list
+from tenancy import TenantRegistry, TenantDatabase, TenantMiddleware
+from jobs import JobWorkerPool, enqueue, ensure_job_indexes
+from resumes import (
+    ResumeTooLarge, ensure_resume_indexes, iter_grid_out, parse_range, release_resume, resume_bucket, store_resume,
+    stream_zip,
+)
+from notifications import announce_drive, metrics as notification_metrics, transport_from_env
+from fees import (
+    DuplicateReceipt, PaymentRejected, ensure_fee_indexes, fee_report, list_defaulters, open_fee_account,
+    reconcile_payments, rebuild_fee_totals, record_payment, apply_student_change, reset_fee_fields,
+    update_student_fees,
+)
+from profiles import ensure_profile_indexes, load_profiles
+from resume_index import ResumeIndex, normalize_tokens, reindex_all, shutdown_pool, terms_for_student
+from av_db_api import router as av_db_router, av_db, open_av_db, close_av_db
+from category_api import router as category_router, categories, open_categories, close_categories
+from catalog_proxy import CatalogOwner, CatalogProxyMiddleware
+from profiler import ProfileStore, ProfilerMiddleware, authorized, collapsed, speedscope
+from bson import ObjectId
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+
+# One deployment can serve several colleges (TENANTS, see tenancy.py). `db`
+# resolves to the current request's tenant database; all share the client's pool.
+tenants = TenantRegistry.from_env(os.environ)
+db = TenantDatabase(client, tenants)
+
+# Status change events; set STATUS_EVENTS_SOURCE=change_stream on multi-worker
+# deployments (requires a replica set) so every worker sees every write
+status_events = StatusEventBus()
+
+# Per-process caches kept coherent across uvicorn workers. CACHE_INVALIDATION is
+# "unix" (datagram broadcast between workers on one host), "change_stream"
+# (Mongo replica set) or unset for a single worker. Unset, other workers' writes
+# are never seen, so cached entries expire after CACHE_TTL_SECONDS instead.
+CACHED_COLLECTIONS = ["students", "companies", "drives", "applications", "offer_letters", "archive_rollups"]
+
+def tenant_cache_key(ns):
+    tenant = tenants.by_db.get(ns["db"])
+    return f"{tenant.name}:{ns['coll']}" if tenant else None
+
+invalidation_mode = os.environ.get('CACHE_INVALIDATION')
+if invalidation_mode == 'unix':
+    invalidation_transport = UnixSocketTransport(os.environ.get('CACHE_INVALIDATION_DIR', '/tmp/placement-cache-bus'))
+elif invalidation_mode == 'change_stream':
+    invalidation_transport = ChangeStreamTransport(client, CACHED_COLLECTIONS, key=tenant_cache_key)
+else:
+    invalidation_transport = None
+invalidation_bus = InvalidationBus(invalidation_transport)
+cache_ttl = None if invalidation_transport else float(os.environ.get('CACHE_TTL_SECONDS', '5'))
+entity_cache = invalidation_bus.register(LocalCache("entities", ttl=cache_ttl))
+stats_cache = invalidation_bus.register(LocalCache("stats", ttl=cache_ttl))
+
+# Write log behind GET /api/sync
+change_log = ChangeLog(db, retention=timedelta(days=float(os.environ.get('CHANGELOG_RETENTION_DAYS', '7'))))
+
+async def entity_changed(collection, entity_id, op=UPSERT):
+    """Called by every write route: invalidates caches and appends to the change log"""
+    await invalidation_bus.publish(tenants.scoped(collection), entity_id)
+    await change_log.record(collection, entity_id, op)
+
+async def find_entity(collection, entity_id):
+    cache_key = tenants.scoped(collection)
+    cached = entity_cache.get(cache_key, entity_id)
+    if cached is None:
+        generation = entity_cache.generation
+        cached = await db[collection].find_one({"id": entity_id})
+        if cached is None:
+            return None
+        entity_cache.set(cache_key, entity_id, cached, generation=generation)
+    return dict(cached)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -40,28 +118,45 @@ class DriveStatus(str, Enum):
     CANCELLED = "cancelled"
 
 # Helper functions for MongoDB serialization
+# Dates are stored as native BSON datetimes (UTC) so they can be range-queried,
+# sorted and indexed; BSON has no date-only type, so dates become midnight UTC.
 def prepare_for_mongo(data):
     if isinstance(data, dict):
         for key, value in data.items():
-            if isinstance(value, date) and not isinstance(value, datetime):
-                data[key] = value.isoformat()
-            elif isinstance(value, datetime):
-                data[key] = value.isoformat()
+            if isinstance(value, datetime):
+                if value.tzinfo is None:
+                    data[key] = value.replace(tzinfo=timezone.utc)
+            elif isinstance(value, date):
+                data[key] = datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
     return data
 
 def parse_from_mongo(item):
+    # Only documents not yet rewritten by `python migrations.py dates_to_bson`
+    # still hold ISO strings
     if isinstance(item, dict):
         for key, value in item.items():
-            if isinstance(value, str) and key.endswith('_date'):
+            if isinstance(value, str) and (key.endswith('_date') or key == 'created_at'):
                 try:
-                    if 'T' in value:
-                        item[key] = datetime.fromisoformat(value)
-                    else:
-                        item[key] = datetime.fromisoformat(value + 'T00:00:00')
-                except:
+                    item[key] = parse_iso_datetime(value)
+                except ValueError:
                     pass
     return item
 
+def date_range_query(field, date_from, date_to):
+    query = {}
+    if date_from:
+        query["$gte"] = date_from
+    if date_to:
+        query["$lte"] = date_to
+    return {field: query} if query else {}
+
+def parse_sort(sort, allowed):
+    # "drive_date" sorts ascending, "-drive_date" descending
+    field = sort.lstrip('-')
+    if field not in allowed:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {field}; use one of {', '.join(allowed)}")
+    return field, -1 if sort.startswith('-') else 1
+
 # Enums for new fields
 class BacklogStatus(str, Enum):
     CLEARED = "cleared"
@@ -87,6 +182,8 @@ class Student(BaseModel):
     email: EmailStr
     phone: str
     resume_url: Optional[str] = None
+    # GridFS file behind resume_url when the resume was uploaded here
+    resume_file_id: Optional[str] = None
     # Academic Information
     ssc_percentage: float
     inter_diploma_percentage: float
@@ -96,6 +193,10 @@ class Student(BaseModel):
     # CRT Information
     crt_fee_status: CRTFeeStatus
     crt_fee_amount: float
+    # Sum of the student's payments in the CRT fee ledger
+    crt_fee_paid: float = 0
+    # What is still owed, kept in step with crt_fee_paid for the defaulter report
+    crt_fee_balance: float = 0
     crt_receipt_number: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -195,6 +296,40 @@ class OfferLetterCreate(BaseModel):
     joining_date: datetime
     final_ctc: float
 
+class ApplicationWithDrive(Application):
+    drive_status: Optional[DriveStatus] = None
+    drive_date: Optional[datetime] = None
+    drive_location: Optional[str] = None
+
+class StudentProfile(BaseModel):
+    student: Student
+    applications: List[ApplicationWithDrive]
+    offers: List[OfferLetter]
+
+class CRTPayment(BaseModel):
+    id: str
+    receipt_number: str
+    student_id: str
+    roll_no: str
+    amount: float
+    mode: str
+    note: Optional[str] = None
+    batch: int
+    branch: str
+    section: str
+    paid_at: datetime
+    recorded_at: datetime
+    state: str
+
+class CRTPaymentCreate(BaseModel):
+    student_id: str
+    amount: float = Field(gt=0)
+    mode: str = "cash"
+    # Generated when omitted; resending the same receipt number is idempotent
+    receipt_number: Optional[str] = None
+    note: Optional[str] = None
+    paid_at: Optional[datetime] = None
+
 # Student endpoints
 @api_router.post("/students", response_model=Student)
 async def create_student(student: StudentCreate):
@@ -206,21 +341,83 @@ async def create_student(student: StudentCreate):
     student_dict = student.dict()
     student_obj = Student(**student_dict)
     student_data = prepare_for_mongo(student_obj.dict())
+    requested_fee_status = reset_fee_fields(student_data)
     await db.students.insert_one(student_data)
-    return student_obj
+    await open_fee_account(db, student_data, requested_fee_status)
+    await entity_changed("students", student_obj.id)
+    await resume_index.update(student_obj.id, normalize_tokens(" ".join(student_obj.skills)))
+    created = await db.students.find_one({"id": student_obj.id})
+    return Student(**parse_from_mongo(created))
 
 @api_router.get("/students", response_model=List[Student])
-async def get_students():
-    students = await db.students.find().to_list(1000)
-    return [Student(**parse_from_mongo(student)) for student in students]
+async def get_students(include_archived: bool = False, encoding: ListEncoding = Depends(list_encoding)):
+    if include_archived:
+        students = await db.students.aggregate(union_pipeline("students", {}, True)).to_list(None)
+    else:
+        students = await db.students.find().to_list(1000)
+    return encode_list([Student(**parse_from_mongo(student)) for student in students], encoding)
+
+# Registered before /students/{student_id} so "search" is not taken for an id
+@api_router.get("/students/search", response_model=List[Student])
+async def search_students(
+    q: Optional[str] = None,
+    branch: Optional[str] = None,
+    min_cgpa: Optional[float] = None,
+    max_backlogs: Optional[int] = None,
+    encoding: ListEncoding = Depends(list_encoding),
+):
+    """Students whose resume text or skills contain every term of q, within the filters"""
+    filter_query = {}
+    if q:
+        ids = await resume_index.search(q)
+        if ids is not None:
+            filter_query["id"] = {"$in": list(ids)}
+    if branch:
+        filter_query["branch"] = branch
+    if min_cgpa is not None:
+        filter_query["cgpa"] = {"$gte": min_cgpa}
+    if max_backlogs is not None:
+        filter_query["backlogs_count"] = {"$lte": max_backlogs}
+
+    students = await db.students.find(filter_query).to_list(1000)
+    return encode_list([Student(**parse_from_mongo(student)) for student in students], encoding)
 
 @api_router.get("/students/{student_id}", response_model=Student)
-async def get_student(student_id: str):
-    student = await db.students.find_one({"id": student_id})
+async def get_student(student_id: str, include_archived: bool = False):
+    student = await find_entity("students", student_id)
+    if not student and include_archived:
+        student = await db[archive_name("students")].find_one({"id": student_id})
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     return Student(**parse_from_mongo(student))
 
+# Student profiles: student, applications with drive status and offers in one aggregation
+PROFILE_BATCH_LIMIT = 500
+
+def build_profile(profile):
+    applications = [ApplicationWithDrive(**parse_from_mongo(app)) for app in profile["applications"]]
+    offers = [OfferLetter(**parse_from_mongo(offer)) for offer in profile["offers"]]
+    return StudentProfile(
+        student=Student(**parse_from_mongo(profile["student"])),
+        applications=sorted(applications, key=lambda app: app.applied_date, reverse=True),
+        offers=sorted(offers, key=lambda offer: offer.offer_date, reverse=True),
+    )
+
+@api_router.get("/students/{student_id}/profile", response_model=StudentProfile)
+async def get_student_profile(student_id: str, include_archived: bool = False):
+    profiles = await load_profiles(db, [student_id], include_archived)
+    if student_id not in profiles:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return build_profile(profiles[student_id])
+
+@api_router.post("/students/profiles", response_model=List[Optional[StudentProfile]])
+async def get_student_profiles(student_ids: List[str], include_archived: bool = False):
+    """Profiles for a shortlist in request order; null for unknown ids"""
+    if len(student_ids) > PROFILE_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {PROFILE_BATCH_LIMIT} students per request")
+    profiles = await load_profiles(db, student_ids, include_archived)
+    return [build_profile(profiles[student_id]) if student_id in profiles else None for student_id in student_ids]
+
 @api_router.put("/students/{student_id}", response_model=Student)
 async def update_student(student_id: str, student_update: StudentCreate):
     existing = await db.students.find_one({"id": student_id})
@@ -228,18 +425,123 @@ async def update_student(student_id: str, student_update: StudentCreate):
         raise HTTPException(status_code=404, detail="Student not found")
     
     update_data = prepare_for_mongo(student_update.dict())
-    await db.students.update_one({"id": student_id}, {"$set": update_data})
+    if existing.get("resume_file_id"):
+        # resume_url points at the uploaded file and is managed by the resume endpoints
+        update_data.pop("resume_url", None)
+    if update_data["crt_receipt_number"] is None:
+        update_data.pop("crt_receipt_number")
+    change = await update_student_fees(db, student_id, update_data)
+    if change is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    _, after = change
+    payment_error = None
+    if student_update.crt_fee_status == CRTFeeStatus.PAID and after["crt_fee_status"] != CRTFeeStatus.PAID:
+        # Marking a student paid records the remaining balance in the ledger
+        try:
+            await record_payment(db, student_id, after["crt_fee_amount"] - after.get("crt_fee_paid", 0),
+                                 mode="manual", receipt_number=student_update.crt_receipt_number)
+        except LookupError:
+            payment_error = HTTPException(status_code=404, detail="Student not found")
+        except PaymentRejected as e:
+            payment_error = HTTPException(status_code=400, detail=str(e))
+        except DuplicateReceipt:
+            payment_error = HTTPException(status_code=409, detail="Receipt number is already used by another payment")
+    # The other fields are already written, so caches are invalidated either way
+    await entity_changed("students", student_id)
+    if payment_error:
+        raise payment_error
+    if update_data["skills"] != existing.get("skills"):
+        await enqueue_job("index_resume", {"student_id": student_id})
     
     updated = await db.students.find_one({"id": student_id})
     return Student(**parse_from_mongo(updated))
 
 @api_router.delete("/students/{student_id}")
 async def delete_student(student_id: str):
-    result = await db.students.delete_one({"id": student_id})
-    if result.deleted_count == 0:
+    deleted = await db.students.find_one_and_delete({"id": student_id})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Student not found")
+    # Payments stay in the ledger; only the student's share of the totals goes
+    await apply_student_change(db, deleted, None)
+    await entity_changed("students", student_id, DELETE)
+    await resume_index.remove(student_id)
+    if deleted.get("resume_file_id"):
+        await release_resume(db.for_tenant(tenants.current()), deleted["resume_file_id"])
     return {"message": "Student deleted successfully"}
 
+# Resume endpoints
+RESUME_MAX_BYTES = int(float(os.environ.get('RESUME_MAX_MB', '10')) * 1024 * 1024)
+
+@api_router.post("/students/{student_id}/resume", response_model=Student)
+async def upload_resume(student_id: str, file: UploadFile = File(...)):
+    """Store a resume in GridFS; identical files are stored once"""
+    student = await db.students.find_one({"id": student_id})
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    database = db.for_tenant(tenants.current())
+    try:
+        file_id, _ = await store_resume(database, file, RESUME_MAX_BYTES)
+    except ResumeTooLarge:
+        raise HTTPException(status_code=413, detail=f"Resume exceeds {RESUME_MAX_BYTES // (1024 * 1024)} MB")
+
+    # Swapping the id atomically tells this request which file it replaced,
+    # even when uploads for the same student race
+    previous = await db.students.find_one_and_update({"id": student_id}, {"$set": {
+        "resume_file_id": str(file_id),
+        "resume_url": f"/api/students/{student_id}/resume",
+    }}, projection={"resume_file_id": 1})
+    if previous is None:
+        # The student was deleted while the file was being stored
+        await release_resume(database, str(file_id))
+        raise HTTPException(status_code=404, detail="Student not found")
+    await entity_changed("students", student_id)
+    await enqueue_job("index_resume", {"student_id": student_id})
+
+    old_file_id = previous.get("resume_file_id")
+    if old_file_id and old_file_id != str(file_id):
+        await release_resume(database, old_file_id)
+
+    updated = await db.students.find_one({"id": student_id})
+    return Student(**parse_from_mongo(updated))
+
+@api_router.get("/students/{student_id}/resume")
+async def download_resume(
+    student_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """Stream a resume with Range and ETag support"""
+    student = await find_entity("students", student_id)
+    if not student or not student.get("resume_file_id"):
+        raise HTTPException(status_code=404, detail="Resume not found")
+
+    grid_out = await resume_bucket(db.for_tenant(tenants.current())).open_download_stream(ObjectId(student["resume_file_id"]))
+    metadata = grid_out.metadata or {}
+    etag = f'"{metadata.get("sha256", str(grid_out._id))}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Last-Modified": grid_out.upload_date.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        "Content-Disposition": f'inline; filename="{grid_out.filename}"',
+    }
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    media_type = metadata.get("content_type") or "application/octet-stream"
+    try:
+        byte_range = parse_range(range_header, grid_out.length)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{grid_out.length}"})
+    if byte_range is None:
+        headers["Content-Length"] = str(grid_out.length)
+        return StreamingResponse(iter_grid_out(grid_out), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{grid_out.length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_grid_out(grid_out, start, end), status_code=206, media_type=media_type, headers=headers)
+
 # Company endpoints
 @api_router.post("/companies", response_model=Company)
 async def create_company(company: CompanyCreate):
@@ -247,16 +549,17 @@ async def create_company(company: CompanyCreate):
     company_obj = Company(**company_dict)
     company_data = prepare_for_mongo(company_obj.dict())
     await db.companies.insert_one(company_data)
+    await entity_changed("companies", company_obj.id)
     return company_obj
 
 @api_router.get("/companies", response_model=List[Company])
-async def get_companies():
+async def get_companies(encoding: ListEncoding = Depends(list_encoding)):
     companies = await db.companies.find().to_list(1000)
-    return [Company(**parse_from_mongo(company)) for company in companies]
+    return encode_list([Company(**parse_from_mongo(company)) for company in companies], encoding)
 
 @api_router.get("/companies/{company_id}", response_model=Company)
 async def get_company(company_id: str):
-    company = await db.companies.find_one({"id": company_id})
+    company = await find_entity("companies", company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     return Company(**parse_from_mongo(company))
@@ -265,7 +568,7 @@ async def get_company(company_id: str):
 @api_router.post("/drives", response_model=Drive)
 async def create_drive(drive: DriveCreate):
     # Get company name
-    company = await db.companies.find_one({"id": drive.company_id})
+    company = await find_entity("companies", drive.company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     
@@ -274,20 +577,32 @@ async def create_drive(drive: DriveCreate):
     drive_obj = Drive(**drive_dict)
     drive_data = prepare_for_mongo(drive_obj.dict())
     await db.drives.insert_one(drive_data)
+    await entity_changed("drives", drive_obj.id)
+    if os.environ.get('NOTIFY_ON_CREATE', 'on') != 'off':
+        await enqueue_job("announce_drive", {"drive_id": drive_obj.id})
     return drive_obj
 
 @api_router.get("/drives", response_model=List[Drive])
-async def get_drives(status: Optional[DriveStatus] = None):
-    filter_query = {}
+async def get_drives(
+    status: Optional[DriveStatus] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    sort: Optional[str] = None,
+    encoding: ListEncoding = Depends(list_encoding),
+):
+    filter_query = date_range_query("drive_date", date_from, date_to)
     if status:
         filter_query["status"] = status
     
-    drives = await db.drives.find(filter_query).to_list(1000)
-    return [Drive(**parse_from_mongo(drive)) for drive in drives]
+    cursor = db.drives.find(filter_query)
+    if sort:
+        cursor = cursor.sort(*parse_sort(sort, ["drive_date", "created_at"]))
+    drives = await cursor.to_list(1000)
+    return encode_list([Drive(**parse_from_mongo(drive)) for drive in drives], encoding)
 
 @api_router.get("/drives/{drive_id}", response_model=Drive)
 async def get_drive(drive_id: str):
-    drive = await db.drives.find_one({"id": drive_id})
+    drive = await find_entity("drives", drive_id)
     if not drive:
         raise HTTPException(status_code=404, detail="Drive not found")
     return Drive(**parse_from_mongo(drive))
@@ -300,18 +615,43 @@ async def update_drive_status(drive_id: str, status: DriveStatus):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Drive not found")
+    await entity_changed("drives", drive_id)
+    status_events.publish_local(DRIVE_STATUS, {"drive_id": drive_id, "status": status.value}, tenants.current().name)
     return {"message": "Drive status updated successfully"}
 
+@api_router.get("/drives/{drive_id}/resumes.zip")
+async def download_drive_resumes(drive_id: str):
+    """Zip of every uploaded resume of the drive's applicants, streamed as it is built"""
+    drive = await find_entity("drives", drive_id)
+    if not drive:
+        raise HTTPException(status_code=404, detail="Drive not found")
+
+    student_ids = await db.applications.distinct("student_id", {"drive_id": drive_id})
+    students = await db.students.find(
+        {"id": {"$in": student_ids}, "resume_file_id": {"$ne": None}},
+        {"roll_no": 1, "name": 1, "resume_file_id": 1},
+    ).to_list(None)
+    entries = [
+        (f"{s['roll_no']}_{s['name'].replace(' ', '_')}", ObjectId(s["resume_file_id"]))
+        for s in students
+    ]
+    filename = f"{drive['company_name']}_{drive['role']}_resumes.zip".replace(' ', '_')
+    return StreamingResponse(
+        stream_zip(db.for_tenant(tenants.current()), entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 # Application endpoints
 @api_router.post("/applications", response_model=Application)
 async def create_application(application: ApplicationCreate):
     # Check if student exists
-    student = await db.students.find_one({"id": application.student_id})
+    student = await find_entity("students", application.student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
     # Check if drive exists
-    drive = await db.drives.find_one({"id": application.drive_id})
+    drive = await find_entity("drives", application.drive_id)
     if not drive:
         raise HTTPException(status_code=404, detail="Drive not found")
     
@@ -331,24 +671,41 @@ async def create_application(application: ApplicationCreate):
     application_obj = Application(**application_dict)
     application_data = prepare_for_mongo(application_obj.dict())
     await db.applications.insert_one(application_data)
+    await entity_changed("applications", application_obj.id)
     return application_obj
 
 @api_router.get("/applications", response_model=List[Application])
-async def get_applications(student_id: Optional[str] = None, drive_id: Optional[str] = None):
-    filter_query = {}
+async def get_applications(
+    student_id: Optional[str] = None,
+    drive_id: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    sort: Optional[str] = None,
+    include_archived: bool = False,
+    encoding: ListEncoding = Depends(list_encoding),
+):
+    filter_query = date_range_query("applied_date", date_from, date_to)
     if student_id:
         filter_query["student_id"] = student_id
     if drive_id:
         filter_query["drive_id"] = drive_id
     
-    applications = await db.applications.find(filter_query).to_list(1000)
-    return [Application(**parse_from_mongo(app)) for app in applications]
+    sort_spec = parse_sort(sort, ["applied_date", "selected_date"]) if sort else None
+    if include_archived:
+        pipeline = union_pipeline("applications", filter_query, True, sort=sort_spec)
+        applications = await db.applications.aggregate(pipeline).to_list(None)
+    else:
+        cursor = db.applications.find(filter_query)
+        if sort_spec:
+            cursor = cursor.sort(*sort_spec)
+        applications = await cursor.to_list(1000)
+    return encode_list([Application(**parse_from_mongo(app)) for app in applications], encoding)
 
 @api_router.put("/applications/{application_id}/status", response_model=Application)
 async def update_application_status(application_id: str, status_update: ApplicationStatusUpdate):
     update_data = {"application_status": status_update.status}
     if status_update.status == ApplicationStatus.SELECTED:
-        update_data["selected_date"] = datetime.now(timezone.utc).isoformat()
+        update_data["selected_date"] = datetime.now(timezone.utc)
     
     result = await db.applications.update_one(
         {"id": application_id}, 
@@ -357,15 +714,42 @@ async def update_application_status(application_id: str, status_update: Applicat
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Application not found")
     
+    await entity_changed("applications", application_id)
     updated = await db.applications.find_one({"id": application_id})
+    status_events.publish_local(APPLICATION_STATUS, {
+        "application_id": application_id,
+        "student_id": updated["student_id"],
+        "drive_id": updated["drive_id"],
+        "status": status_update.status.value,
+    }, tenants.current().name)
     return Application(**parse_from_mongo(updated))
 
+# Live status updates (Server-Sent Events)
+@api_router.get("/events/status")
+async def stream_status_events(
+    request: Request,
+    student_id: Optional[str] = None,
+    drive_id: Optional[str] = None,
+    status: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """Push application and drive status changes as they happen"""
+    subscription = status_events.subscribe(
+        scope=tenants.current().name, student_id=student_id, drive_id=drive_id, status=status
+    )
+    return StreamingResponse(
+        stream_events(request, status_events, subscription, last_event_id_header or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Offer Letter endpoints
 @api_router.post("/offer-letters", response_model=OfferLetter)
 async def create_offer_letter(offer: OfferLetterCreate):
     # Get student and drive details
-    student = await db.students.find_one({"id": offer.student_id})
-    drive = await db.drives.find_one({"id": offer.drive_id})
+    student = await find_entity("students", offer.student_id)
+    drive = await find_entity("drives", offer.drive_id)
     
     if not student or not drive:
         raise HTTPException(status_code=404, detail="Student or Drive not found")
@@ -400,20 +784,33 @@ async def create_offer_letter(offer: OfferLetterCreate):
     offer_obj = OfferLetter(**offer_dict)
     offer_data = prepare_for_mongo(offer_obj.dict())
     await db.offer_letters.insert_one(offer_data)
+    await entity_changed("offer_letters", offer_obj.id)
     return offer_obj
 
 @api_router.get("/offer-letters", response_model=List[OfferLetter])
-async def get_offer_letters(student_id: Optional[str] = None):
+async def get_offer_letters(
+    student_id: Optional[str] = None,
+    include_archived: bool = False,
+    encoding: ListEncoding = Depends(list_encoding),
+):
     filter_query = {}
     if student_id:
         filter_query["student_id"] = student_id
     
-    offers = await db.offer_letters.find(filter_query).to_list(1000)
-    return [OfferLetter(**parse_from_mongo(offer)) for offer in offers]
+    if include_archived:
+        offers = await db.offer_letters.aggregate(union_pipeline("offer_letters", filter_query, True)).to_list(None)
+    else:
+        offers = await db.offer_letters.find(filter_query).to_list(1000)
+    return encode_list([OfferLetter(**parse_from_mongo(offer)) for offer in offers], encoding)
 
 # Dashboard stats with CRT information
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats():
+async def get_dashboard_stats(include_archived: bool = False):
+    cached = stats_cache.get(tenants.scoped("dashboard"), include_archived)
+    if cached is not None:
+        return cached
+    generation = stats_cache.generation
+
     total_students = await db.students.count_documents({})
     total_companies = await db.companies.count_documents({})
     total_drives = await db.drives.count_documents({})
@@ -422,14 +819,25 @@ async def get_dashboard_stats():
     selected_applications = await db.applications.count_documents({"application_status": "selected"})
     
     # CRT specific stats
-    crt_fee_paid = await db.students.count_documents({"crt_fee_status": "paid"})
-    crt_fee_pending = await db.students.count_documents({"crt_fee_status": "pending"})
+    fees = await fee_report(db)
+    crt_fee_paid = fees["status"]["paid"]
+    crt_fee_pending = fees["status"]["pending"]
     students_with_backlogs = await db.students.count_documents({"backlogs_count": {"$gt": 0}})
+
+    if include_archived:
+        # Archived batches contribute their precomputed rollups
+        archived = await archived_totals(db)
+        total_students += archived.get("students", 0)
+        total_applications += archived.get("applications", 0)
+        selected_applications += archived.get("selected", 0)
+        crt_fee_paid += archived.get("crt_fee_paid", 0)
+        crt_fee_pending += archived.get("crt_fee_pending", 0)
+        students_with_backlogs += archived.get("students_with_backlogs", 0)
     
     placement_rate = (selected_applications / total_students * 100) if total_students > 0 else 0
     crt_payment_rate = (crt_fee_paid / total_students * 100) if total_students > 0 else 0
     
-    return {
+    stats = {
         "total_students": total_students,
         "total_companies": total_companies,
         "total_drives": total_drives,
@@ -443,45 +851,384 @@ async def get_dashboard_stats():
         "crt_payment_rate": round(crt_payment_rate, 1),
         "students_with_backlogs": students_with_backlogs
     }
+    stats_cache.set(tenants.scoped("dashboard"), include_archived, stats, depends_on=[
+        tenants.scoped(collection) for collection in ["students", "companies", "drives", "applications", "archive_rollups"]
+    ], generation=generation)
+    return stats
 
 # CRT specific endpoints
 @api_router.get("/crt/fee-status")
 async def get_crt_fee_status():
     """Get CRT fee status summary"""
-    paid = await db.students.count_documents({"crt_fee_status": "paid"})
-    pending = await db.students.count_documents({"crt_fee_status": "pending"})
-    partial = await db.students.count_documents({"crt_fee_status": "partial"})
-    exempted = await db.students.count_documents({"crt_fee_status": "exempted"})
-    
+    report = await fee_report(db)
+    return {
+        **report["status"],
+        "total": report["students"],
+        "fee_due": report["fee_due"],
+        "collected": report["collected"],
+        "outstanding": report["outstanding"],
+    }
+
+@api_router.post("/crt/payments", response_model=CRTPayment)
+async def create_crt_payment(payment: CRTPaymentCreate):
+    """Record a full or partial CRT fee payment and issue its receipt"""
+    try:
+        recorded = await record_payment(db, payment.student_id, payment.amount, mode=payment.mode,
+                                        receipt_number=payment.receipt_number, note=payment.note,
+                                        paid_at=payment.paid_at)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Student not found")
+    except PaymentRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DuplicateReceipt:
+        raise HTTPException(status_code=409, detail="Receipt number is already used by another payment")
+    await entity_changed("students", payment.student_id)
+    await entity_changed("crt_payments", recorded["id"])
+    return CRTPayment(**recorded)
+
+@api_router.get("/crt/payments", response_model=List[CRTPayment])
+async def get_crt_payments(
+    student_id: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    encoding: ListEncoding = Depends(list_encoding),
+):
+    filter_query = date_range_query("paid_at", date_from, date_to)
+    if student_id:
+        filter_query["student_id"] = student_id
+    payments = await db.crt_payments.find(filter_query).sort("paid_at", -1).to_list(1000)
+    return encode_list([CRTPayment(**payment) for payment in payments], encoding)
+
+@api_router.get("/crt/payments/{receipt_number}", response_model=CRTPayment)
+async def get_crt_payment(receipt_number: str):
+    payment = await db.crt_payments.find_one({"receipt_number": receipt_number})
+    if not payment:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return CRTPayment(**payment)
+
+@api_router.get("/students/{student_id}/fees")
+async def get_student_fees(student_id: str):
+    """A student's CRT fee balance and payment history"""
+    student = await find_entity("students", student_id)
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    payments = await db.crt_payments.find({"student_id": student_id}).sort("paid_at", 1).to_list(None)
+    paid = student.get("crt_fee_paid", 0)
     return {
+        "student_id": student_id,
+        "fee_status": student["crt_fee_status"],
+        "fee_amount": student["crt_fee_amount"],
         "paid": paid,
-        "pending": pending,
-        "partial": partial,
-        "exempted": exempted,
-        "total": paid + pending + partial + exempted
+        "balance": 0 if student["crt_fee_status"] == CRTFeeStatus.EXEMPTED else max(student["crt_fee_amount"] - paid, 0),
+        "payments": [CRTPayment(**payment) for payment in payments],
     }
 
+@api_router.get("/crt/reports/collection")
+async def get_crt_collection_report(
+    group_by: Optional[str] = Query(None, pattern="^(batch|branch|section)$"),
+    batch: Optional[int] = None,
+    branch: Optional[str] = None,
+    section: Optional[str] = None,
+):
+    """Fee due, collected and outstanding, overall or per batch, branch or section"""
+    return await fee_report(db, group_by, batch, branch, section)
+
+@api_router.get("/crt/reports/defaulters")
+async def get_crt_defaulter_report(
+    group_by: str = Query("branch", pattern="^(batch|branch|section)$"),
+    batch: Optional[int] = None,
+    branch: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=5000),
+):
+    """Students with an outstanding balance and the amount owed, largest first, with totals per group"""
+    report = await fee_report(db, group_by, batch, branch)
+    groups = sorted(report["groups"].items(), key=lambda item: item[1]["outstanding"], reverse=True)
+    return {
+        "defaulters": report["defaulters"],
+        "outstanding": report["outstanding"],
+        "groups": [
+            {group_by: group, "defaulters": totals["defaulters"], "outstanding": totals["outstanding"],
+             "students": totals["students"]}
+            for group, totals in groups if totals["defaulters"]
+        ],
+        "students": await list_defaulters(db, batch, branch, limit),
+    }
+
+@api_router.post("/crt/reconcile", status_code=202)
+async def reconcile_crt_fees(rebuild: bool = False):
+    """Finish interrupted payments; rebuild=true also recomputes every total from the students"""
+    return await enqueue_job("reconcile_crt_fees", {"rebuild": rebuild})
+
 @api_router.get("/crt/students", response_model=List[Student])
-async def get_crt_students(fee_status: Optional[CRTFeeStatus] = None):
+async def get_crt_students(fee_status: Optional[CRTFeeStatus] = None, encoding: ListEncoding = Depends(list_encoding)):
     """Get students filtered by CRT fee status"""
     filter_query = {}
     if fee_status:
         filter_query["crt_fee_status"] = fee_status
     
     students = await db.students.find(filter_query).to_list(1000)
-    return [Student(**parse_from_mongo(student)) for student in students]
+    return encode_list([Student(**parse_from_mongo(student)) for student in students], encoding)
 
 @api_router.get("/students/backlogs")
-async def get_students_with_backlogs():
+async def get_students_with_backlogs(encoding: ListEncoding = Depends(list_encoding)):
     """Get students with pending backlogs"""
     students = await db.students.find({
         "backlogs_count": {"$gt": 0},
         "backlog_status": "pending"
     }).to_list(1000)
-    return [Student(**parse_from_mongo(student)) for student in students]
+    return encode_list([Student(**parse_from_mongo(student)) for student in students], encoding)
+
+# Background jobs
+job_handlers = {}
+job_pools = {}
+
+def job_handler(job_type):
+    def register(handler):
+        job_handlers[job_type] = handler
+        return handler
+    return register
+
+async def enqueue_job(job_type, payload):
+    job = await enqueue(db, job_type, payload)
+    pool = job_pools.get(tenants.current().name)
+    if pool:
+        pool.notify()
+    return job
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, progress and result of a background job"""
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "lease_owner": 0, "lease_expires": 0, "payload": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@job_handler("import_students")
+async def import_students_job(ctx):
+    students = ctx.payload["students"]
+    inserted, skipped = 0, []
+    requested_fee_status = {}
+    for start in range(0, len(students), 500):
+        chunk = students[start:start + 500]
+        existing = await db.students.find(
+            {"roll_no": {"$in": [s["roll_no"] for s in chunk]}}, {"roll_no": 1}
+        ).to_list(None)
+        taken = {doc["roll_no"] for doc in existing}
+        new_students = []
+        for student in chunk:
+            if student["roll_no"] in taken:
+                skipped.append(student["roll_no"])
+                continue
+            taken.add(student["roll_no"])
+            student_data = prepare_for_mongo(Student(**student).dict())
+            requested_fee_status[student_data["id"]] = reset_fee_fields(student_data)
+            new_students.append(student_data)
+        if new_students:
+            await db.students.insert_many(new_students)
+            for student in new_students:
+                await open_fee_account(db, student, requested_fee_status.pop(student["id"]))
+                await entity_changed("students", student["id"])
+                await resume_index.update(student["id"], normalize_tokens(" ".join(student["skills"])))
+        inserted += len(new_students)
+        await ctx.progress(start + len(chunk), len(students))
+    return {"inserted": inserted, "skipped_roll_numbers": skipped}
+
+@api_router.post("/students/bulk", status_code=202)
+async def bulk_import_students(students: List[StudentCreate]):
+    """Import many students in the background; poll /api/jobs/{id} for progress"""
+    return await enqueue_job("import_students", {"students": [student.dict() for student in students]})
+
+@job_handler("reconcile_crt_fees")
+async def reconcile_crt_fees_job(ctx):
+    finished = await reconcile_payments(db)
+    cells = await rebuild_fee_totals(db) if ctx.payload.get("rebuild") else None
+    await invalidation_bus.publish(tenants.scoped("students"))
+    return {"finished_payments": finished, "rebuilt_cells": cells}
+
+# Resume text index
+resume_index = ResumeIndex(db)
+
+@job_handler("index_resume")
+async def index_resume_job(ctx):
+    fields = {"id": 1, "skills": 1, "resume_file_id": 1}
+    student = await db.students.find_one({"id": ctx.payload["student_id"]}, fields)
+    while student:
+        terms = await terms_for_student(student, resume_bucket(db.for_tenant(tenants.current())))
+        added, removed = await resume_index.update(student["id"], terms)
+        # Another job for this student may have read it earlier and committed
+        # first; index again until what was indexed is still current
+        current = await db.students.find_one({"id": student["id"]}, fields)
+        if current == student:
+            return {"indexed": True, "terms": len(terms), "added": added, "removed": removed}
+        student = current
+    return {"indexed": False}
+
+@job_handler("reindex_resumes")
+async def reindex_resumes_job(ctx):
+    return await reindex_all(db, resume_bucket(db.for_tenant(tenants.current())), progress=ctx.progress)
+
+@api_router.post("/resumes/reindex", status_code=202)
+async def reindex_resumes():
+    """Re-extract every resume on all cores and rebuild the term index"""
+    return await enqueue_job("reindex_resumes", {})
+
+# Drive announcements to eligible students
+notification_transport = transport_from_env(os.environ)
+
+@job_handler("announce_drive")
+async def announce_drive_job(ctx):
+    drive = await db.drives.find_one({"id": ctx.payload["drive_id"]})
+    if not drive:
+        return {"eligible": 0, "sent": 0, "failed": 0}
+    return await announce_drive(
+        db,
+        drive,
+        notification_transport,
+        batch_size=int(os.environ.get('NOTIFY_BATCH_SIZE', '100')),
+        concurrency=int(os.environ.get('NOTIFY_CONCURRENCY', '8')),
+        progress=ctx.progress,
+    )
+
+@api_router.post("/drives/{drive_id}/announce", status_code=202)
+async def announce_drive_again(drive_id: str):
+    """Announce a drive to students who have not been notified yet"""
+    if not await find_entity("drives", drive_id):
+        raise HTTPException(status_code=404, detail="Drive not found")
+    return await enqueue_job("announce_drive", {"drive_id": drive_id})
+
+@api_router.get("/drives/{drive_id}/notifications")
+async def get_drive_notifications(drive_id: str):
+    """Delivery counts and the latest failures of a drive's announcement"""
+    run = await db.notification_runs.find_one({"drive_id": drive_id}, {"_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Drive has not been announced")
+    return run
+
+@api_router.get("/notifications/metrics")
+async def get_notification_metrics():
+    return notification_metrics.snapshot()
+
+# Archival of graduated batches
+@job_handler("archive_batch")
+async def archive_batch_job(ctx):
+    year_of_passing = ctx.payload["year_of_passing"]
+    total = await db.students.count_documents({"year_of_passing": year_of_passing})
+    archived = 0
+
+    async def on_archived(collection, entity_ids):
+        nonlocal archived
+        for entity_id in entity_ids:
+            await entity_changed(collection, entity_id, DELETE)
+        if collection == "students":
+            archived += len(entity_ids)
+            await ctx.progress(archived, total)
+
+    await archive_batch(db, year_of_passing, on_archived=on_archived)
+    # Fee totals cover the hot students only
+    await rebuild_fee_totals(db, {"year_of_passing": year_of_passing})
+    await invalidation_bus.publish(tenants.scoped("archive_rollups"))
+    return {"archived_students": archived}
+
+@api_router.post("/archive/{year_of_passing}", status_code=202)
+async def start_archive(year_of_passing: int):
+    """Move a graduated batch and its applications and offers to the archive collections"""
+    if year_of_passing >= datetime.now(timezone.utc).year:
+        raise HTTPException(status_code=400, detail="Only batches that have already graduated can be archived")
+    return await enqueue_job("archive_batch", {"year_of_passing": year_of_passing})
+
+@api_router.get("/archive/{year_of_passing}")
+async def get_archive_status(year_of_passing: int):
+    run = await db.archive_runs.find_one({"_id": year_of_passing}, {"_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Batch has not been archived")
+    run["rollup"] = await db.archive_rollups.find_one({"_id": year_of_passing}, {"_id": 0})
+    return run
+
+# Delta sync
+SYNC_MODELS = {
+    "students": Student,
+    "companies": Company,
+    "drives": Drive,
+    "applications": Application,
+    "offer_letters": OfferLetter,
+    "crt_payments": CRTPayment,
+}
+
+@api_router.get("/sync")
+async def sync_changes(since: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=5000)):
+    """Entities changed since a cursor; resync_required means refetch everything"""
+    entries, cursor, resync_required, more = await change_log.read(since, limit)
+    changes = {}
+    for collection, group in collapse(entries).items():
+        docs = await db[collection].find({"id": {"$in": group["upserted"]}}).to_list(None)
+        model = SYNC_MODELS[collection]
+        changes[collection] = {
+            "upserted": [model(**parse_from_mongo(doc)) for doc in docs],
+            # Upserted ids whose document is already gone were deleted later
+            "deleted": group["deleted"] + list(set(group["upserted"]) - {doc["id"] for doc in docs}),
+        }
+    return {"cursor": cursor, "resync_required": resync_required, "more": more, "changes": changes}
+
+@api_router.get("/cache/status")
+async def get_cache_status():
+    """Invalidation bus version vector and cache sizes for this worker"""
+    return invalidation_bus.status()
+
+# Request profiles. Requests sent with X-Profile: <PROFILE_TOKEN>, plus a
+# PROFILE_SAMPLE_RATE fraction of all traffic, are sampled by ProfilerMiddleware
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+profile_store = ProfileStore(os.environ.get('PROFILE_DIR', ROOT_DIR / 'data' / 'profiles'),
+                             keep=int(os.environ.get('PROFILE_KEEP', '100')))
+
+def require_profile_token(x_profile: Optional[str] = Header(None)):
+    if not authorized(x_profile, PROFILE_TOKEN):
+        raise HTTPException(status_code=403, detail="A valid X-Profile token is required")
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_profile_token)])
+async def list_profiles():
+    """Saved request profiles, newest first, with their CPU and await totals"""
+    return await asyncio.to_thread(profile_store.list)
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+async def download_profile(profile_id: str, format: str = Query("speedscope", pattern="^(speedscope|collapsed|json)$")):
+    """One profile as speedscope JSON, collapsed stacks for flamegraph.pl, or the raw samples"""
+    result = await asyncio.to_thread(profile_store.load, profile_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return Response(collapsed(result), media_type="text/plain",
+                        headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed.txt"'})
+    if format == "speedscope":
+        return Response(json.dumps(speedscope(result)), media_type="application/json",
+                        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'})
+    return result
 
 # Include the router in the main app
 app.include_router(api_router)
+# AV catalog and categories: in-memory stores owned by one worker process,
+# which also serves them on a unix socket; the other workers proxy to it
+app.include_router(category_router)
+app.include_router(av_db_router)
+
+catalog_app = FastAPI()
+catalog_app.include_router(category_router)
+catalog_app.include_router(av_db_router)
+CATALOG_SOCKET = os.environ.get('CATALOG_SOCKET', '/tmp/placement-catalog.sock')
+
+def open_catalogs():
+    # Safe to retry: a store this process already holds is not reopened
+    return ((categories.journal is not None or open_categories())
+            and (av_db.journal is not None or open_av_db()))
+
+catalog_owner = CatalogOwner(catalog_app, CATALOG_SOCKET, open_catalogs,
+                             retry_interval=float(os.environ.get('CATALOG_RETRY_SECONDS', '5')))
+# Innermost, so forwarded catalog responses still pass through the rest
+app.add_middleware(CatalogProxyMiddleware, owner=catalog_owner, prefixes=["/api/categories", "/api/avdb"])
+
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')))
+
+# Event streams stay open indefinitely, so they do not hold a concurrency slot
+app.add_middleware(TenantMiddleware, registry=tenants, exempt_prefixes=["/api/events/"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -491,6 +1238,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so profiles include every other middleware
+app.add_middleware(
+    ProfilerMiddleware,
+    store=profile_store,
+    token=PROFILE_TOKEN,
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    interval=float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000,
+    max_seconds=float(os.environ.get('PROFILE_MAX_SECONDS', '30')),
+    exempt_prefixes=["/api/events/", "/api/admin/profiles"],
+)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -498,6 +1256,73 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_tasks = []
+
+async def ensure_indexes(database):
+    # Backs the from/to/sort filters on drives and applications
+    await database.drives.create_index("drive_date")
+    await database.drives.create_index([("status", 1), ("drive_date", 1)])
+    await database.applications.create_index("applied_date")
+    await database.applications.create_index([("student_id", 1), ("applied_date", 1)])
+    await database.applications.create_index([("drive_id", 1), ("applied_date", 1)])
+    # Drive announcements stream eligible students in id order; who was
+    # notified is keyed by "<drive_id>:<student_id>" in drive_notifications
+    await database.students.create_index("id")
+    await database.notification_runs.create_index("drive_id", unique=True)
+
+async def publish_drive_transitions(drive_ids, status):
+    for drive_id in drive_ids:
+        await entity_changed("drives", drive_id)
+        status_events.publish_local(DRIVE_STATUS, {"drive_id": drive_id, "status": status}, tenants.current().name)
+
+# Automatic upcoming -> ongoing -> completed transitions, one scheduler per
+# tenant; DRIVE_SCHEDULER=off disables
+drive_schedulers = {}
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # The first worker to lock the catalog data directories owns them; the
+    # others forward catalog requests to it and take over if it exits
+    catalog_owner.start()
+    for tenant in tenants:
+        # Tasks created here keep the tenant active for their whole lifetime
+        with tenants.activate(tenant):
+            await ensure_indexes(db)
+            await change_log.ensure_indexes()
+            await ensure_archive_indexes(db)
+            await ensure_job_indexes(db)
+            await ensure_resume_indexes(db)
+            await ensure_fee_indexes(db)
+            await ensure_profile_indexes(db)
+            # JOB_WORKERS=0 leaves jobs to separate `python worker.py` processes
+            job_workers = int(os.environ.get('JOB_WORKERS', '2'))
+            if job_workers:
+                job_pools[tenant.name] = JobWorkerPool(db, job_handlers, concurrency=job_workers)
+                background_tasks.extend(job_pools[tenant.name].start())
+            if os.environ.get('DRIVE_SCHEDULER', 'on') != 'off':
+                scheduler = drive_schedulers[tenant.name] = DriveLifecycleScheduler(
+                    db,
+                    publish_drive_transitions,
+                    drive_duration=timedelta(hours=float(os.environ.get('DRIVE_DURATION_HOURS', '24'))),
+                    drives_key=tenants.scoped("drives"),
+                    # Without a transport, drives written by other workers are only seen on reload
+                    refresh_interval=None if invalidation_transport else float(
+                        os.environ.get('DRIVE_SCHEDULER_REFRESH_SECONDS', '30')),
+                )
+                invalidation_bus.register(scheduler)
+                background_tasks.append(asyncio.create_task(scheduler.run()))
+            if os.environ.get('STATUS_EVENTS_SOURCE') == 'change_stream':
+                background_tasks.append(asyncio.create_task(watch_status_changes(db, status_events, tenant.name)))
+    background_tasks.append(asyncio.create_task(invalidation_bus.start()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    invalidation_bus.close()
+    shutdown_pool()
+    notification_transport.close()
+    await catalog_owner.stop()
+    close_av_db()
+    close_categories()
     client.close()
\ No newline at end of file
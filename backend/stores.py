@@ -0,0 +1,481 @@
+import bisect
+import heapq
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import islice
+from math import ceil
+
+# Names are indexed by every substring up to this length, so a filter of up
+# to NGRAM characters is a single lookup and longer ones intersect n-grams
+NGRAM = 3
+
+# Fuzzy suggestions share at least this fraction of the query's n-grams; at
+# most FUZZY_CANDIDATES names are counted per query
+FUZZY_MIN_SCORE = 0.5
+FUZZY_CANDIDATES = 5000
+
+
+def ngrams(text):
+    text = text.lower()
+    return {text[start:start + size] for size in range(1, NGRAM + 1) for start in range(len(text) - size + 1)}
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def word_suffixes(name):
+    """The normalized name from each word on, so completion matches any word start"""
+    name = normalize(name)
+    return {name[start:] for start in range(len(name)) if start == 0 or name[start - 1] == " "}
+
+
+class RWLock:
+    """Many readers or one writer, preferring writers.
+
+    Used as a context manager it takes the write side, which the writing
+    thread may re-enter; read() takes the read side, which readers and the
+    current writer may also re-enter.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+                return True
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._depth = 1
+        return True
+
+    def release(self):
+        with self._condition:
+            self._depth -= 1
+            if not self._depth:
+                self._writer = None
+                self._condition.notify_all()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        with self._condition:
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+
+class PrefixIndex:
+    """Sorted (key, id) array for prefix completion.
+
+    Changes are buffered and folded in before the next lookup: one at a
+    time with bisect when there are a few, or with a single sort after bulk
+    loads and journal replays.
+    """
+
+    REBUILD_AT = 256
+
+    def __init__(self):
+        self.keys = []
+        self.added = set()
+        self.removed = set()
+
+    def add(self, key, entry_id):
+        pair = (key, entry_id)
+        if pair in self.removed:
+            self.removed.discard(pair)
+        else:
+            self.added.add(pair)
+
+    def discard(self, key, entry_id):
+        pair = (key, entry_id)
+        if pair in self.added:
+            self.added.discard(pair)
+        else:
+            self.removed.add(pair)
+
+    @property
+    def pending(self):
+        return bool(self.added or self.removed)
+
+    def fold(self):
+        if len(self.added) + len(self.removed) > self.REBUILD_AT:
+            removed = self.removed
+            self.keys = sorted([pair for pair in self.keys if pair not in removed] + list(self.added))
+        else:
+            for pair in self.removed:
+                position = bisect.bisect_left(self.keys, pair)
+                if position < len(self.keys) and self.keys[position] == pair:
+                    del self.keys[position]
+            for pair in self.added:
+                bisect.insort(self.keys, pair)
+        self.added.clear()
+        self.removed.clear()
+
+    def complete(self, prefix, limit, scan=None):
+        """Up to limit (key, id) pairs whose key starts with prefix, in key order, one per id; call fold() first"""
+        scan = scan or limit * 8
+        found = {}
+        position = bisect.bisect_left(self.keys, (prefix,))
+        for key, entry_id in self.keys[position:position + scan]:
+            if not key.startswith(prefix):
+                break
+            found.setdefault(entry_id, key)
+            if len(found) == limit:
+                break
+        return [(key, entry_id) for entry_id, key in found.items()]
+
+
+class IndexedStore:
+    """Records keyed by id with secondary indexes on the given fields and name n-grams.
+
+    Lookups, edits and deletes are O(1) in the size of the catalog; filters
+    touch only the records in the smallest matching index. Mutations hold
+    the write side of a reader/writer lock and, when a journal is attached,
+    are written to it before the call returns; filters and suggestions hold
+    the read side. Edits replace an entry's dict instead of changing it, so
+    entries already handed to a reader never change underneath it.
+    """
+
+    def __init__(self, entries=(), indexed=()):
+        self.entries = {}
+        self.next_id = 1
+        self.indexes = {field: defaultdict(set) for field in indexed}
+        self.name_index = defaultdict(set)
+        self.prefix_index = PrefixIndex()
+        self.lock = RWLock()
+        self.journal = None
+        for entry in entries:
+            self.put(dict(entry))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        with self.lock.read():
+            return iter(list(self.entries.values()))
+
+    def __contains__(self, entry_id):
+        return entry_id in self.entries
+
+    def get(self, entry_id):
+        return self.entries.get(entry_id)
+
+    def _index(self, entry):
+        for field, index in self.indexes.items():
+            if entry.get(field) is not None:
+                index[entry[field]].add(entry["id"])
+        for gram in ngrams(entry.get("name", "")):
+            self.name_index[gram].add(entry["id"])
+        for key in word_suffixes(entry.get("name", "")):
+            self.prefix_index.add(key, entry["id"])
+
+    def _unindex(self, entry):
+        for field, index in self.indexes.items():
+            value = entry.get(field)
+            if value is not None:
+                index[value].discard(entry["id"])
+                if not index[value]:
+                    del index[value]
+        for gram in ngrams(entry.get("name", "")):
+            ids = self.name_index[gram]
+            ids.discard(entry["id"])
+            if not ids:
+                del self.name_index[gram]
+        for key in word_suffixes(entry.get("name", "")):
+            self.prefix_index.discard(key, entry["id"])
+
+    def _log(self, record):
+        return self.journal.append(record) if self.journal else None
+
+    def _commit(self, lsn):
+        if lsn is not None:
+            self.journal.sync(lsn)
+
+    def add(self, data):
+        """Insert under the next id and return it"""
+        with self.lock:
+            entry = {**data, "id": self.next_id}
+            self._put(entry)
+            lsn = self._log(["put", entry])
+        self._commit(lsn)
+        return entry["id"]
+
+    def _put(self, entry):
+        previous = self.entries.get(entry["id"])
+        if previous is not None:
+            self._unindex(previous)
+        self.entries[entry["id"]] = entry
+        self._index(entry)
+        self.next_id = max(self.next_id, entry["id"] + 1)
+
+    def put(self, entry):
+        """Insert or replace an entry under its own id"""
+        with self.lock:
+            self._put(entry)
+            lsn = self._log(["put", entry])
+        self._commit(lsn)
+
+    def put_many(self, entries, replace=True):
+        """Apply a batch at once; entries without an id get new ids.
+
+        With replace=False, entries whose id already exists are left alone.
+        Returns the number of (inserted, replaced, skipped) entries.
+        """
+        inserted = replaced = skipped = 0
+        applied = []
+        with self.lock:
+            for entry in entries:
+                if entry.get("id") is None:
+                    entry["id"] = self.next_id
+                    inserted += 1
+                elif entry["id"] in self.entries:
+                    if not replace:
+                        skipped += 1
+                        continue
+                    replaced += 1
+                else:
+                    inserted += 1
+                self._put(entry)
+                applied.append(entry)
+            # One record, so a batch is replayed entirely or not at all
+            lsn = self._log(["batch", applied]) if applied else None
+        self._commit(lsn)
+        return inserted, replaced, skipped
+
+    def _update(self, entry_id, data):
+        entry = self.entries.get(entry_id)
+        if entry is None:
+            return None
+        self._unindex(entry)
+        entry = self.entries[entry_id] = {**entry, **data}
+        self._index(entry)
+        return entry
+
+    def update(self, entry_id, data):
+        data = {key: value for key, value in data.items() if key != "id"}
+        with self.lock:
+            entry = self._update(entry_id, data)
+            if entry is None:
+                return None
+            lsn = self._log(["update", entry_id, data])
+        self._commit(lsn)
+        return entry
+
+    def _delete(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is not None:
+            self._unindex(entry)
+        return entry
+
+    def delete(self, entry_id):
+        with self.lock:
+            entry = self._delete(entry_id)
+            if entry is None:
+                return None
+            lsn = self._log(["delete", entry_id])
+        self._commit(lsn)
+        return entry
+
+    def merge(self, entry_id, data, removed_ids):
+        """Update one entry and delete others as a single journal record"""
+        data = {key: value for key, value in data.items() if key != "id"}
+        removed_ids = [removed_id for removed_id in removed_ids if removed_id != entry_id]
+        with self.lock:
+            entry = self._update(entry_id, data)
+            if entry is None:
+                return None
+            for removed_id in removed_ids:
+                self._delete(removed_id)
+            lsn = self._log(["merge", entry_id, data, removed_ids])
+        self._commit(lsn)
+        return entry
+
+    def replay(self, record):
+        """Apply a journal record without journaling it again"""
+        op = record[0]
+        if op == "put":
+            self._put(record[1])
+        elif op == "batch":
+            for entry in record[1]:
+                self._put(entry)
+        elif op == "update":
+            self._update(record[1], record[2])
+        elif op == "delete":
+            self._delete(record[1])
+        elif op == "merge":
+            self._update(record[1], record[2])
+            for removed_id in record[3]:
+                self._delete(removed_id)
+        else:
+            raise ValueError(f"Unknown journal record {op!r}")
+
+    def state(self):
+        return {"entries": self.entries, "next_id": self.next_id, "indexes": self.indexes,
+                "name_index": self.name_index}
+
+    def restore(self, state):
+        self.entries = state["entries"]
+        self.next_id = state["next_id"]
+        self.prefix_index = PrefixIndex()
+        if set(state["indexes"]) == set(self.indexes):
+            self.indexes = state["indexes"]
+            self.name_index = state["name_index"]
+            # The prefix array is not part of snapshots; it is sorted on first use
+            for entry in self.entries.values():
+                for key in word_suffixes(entry.get("name", "")):
+                    self.prefix_index.add(key, entry["id"])
+            return
+        # Indexed fields changed since the snapshot was taken
+        self.indexes = {field: defaultdict(set) for field in self.indexes}
+        self.name_index = defaultdict(set)
+        for entry in self.entries.values():
+            self._index(entry)
+
+    def _name_matches(self, text):
+        text = text.lower()
+        if len(text) <= NGRAM:
+            return self.name_index.get(text, set())
+        postings = sorted(
+            (self.name_index.get(text[start:start + NGRAM], set()) for start in range(len(text) - NGRAM + 1)),
+            key=len,
+        )
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates &= ids
+            if not candidates:
+                break
+        # Trigrams can all occur without the whole string occurring
+        return {entry_id for entry_id in candidates if text in self.entries[entry_id]["name"].lower()}
+
+    def _matching(self, field, value):
+        index = self.indexes[field]
+        if isinstance(value, (list, tuple, set, frozenset)):
+            # Any of several values, e.g. every category in a subtree
+            ids = set()
+            for each in value:
+                ids |= index.get(each, set())
+            return ids
+        return index.get(value, set())
+
+    def filter(self, text=None, **fields):
+        """Entries whose name contains text and whose indexed fields equal the given values, in id order.
+
+        A list of values matches any of them; None or empty values are ignored.
+        """
+        with self.lock.read():
+            candidate_sets = [self._matching(field, value) for field, value in fields.items() if value is not None
+                              and value != ""]
+            if text:
+                candidate_sets.append(self._name_matches(text))
+            if not candidate_sets:
+                # Entries put with explicit ids are not inserted in id order
+                return [self.entries[entry_id] for entry_id in sorted(self.entries)]
+            candidate_sets.sort(key=len)
+            ids = set(candidate_sets[0])
+            for candidates in candidate_sets[1:]:
+                ids &= candidates
+            return [self.entries[entry_id] for entry_id in sorted(ids)]
+
+    def _fuzzy(self, text, limit, exclude):
+        # Bigrams for short queries, where one typo spoils most trigrams
+        size = 2 if len(text) < 6 else NGRAM
+        grams = {text[start:start + size] for start in range(len(text) - size + 1)}
+        postings = sorted((self.name_index[gram] for gram in grams if gram in self.name_index), key=len)
+        needed = ceil(FUZZY_MIN_SCORE * len(grams))
+        # A name sharing `needed` of the n-grams is in one of the rarest
+        # len(postings) - needed + 1 postings; only those seed candidates
+        seeds = postings[:len(postings) - needed + 1]
+        if not seeds:
+            return []
+        # Set and Counter operations run in C; Python only sees the survivors.
+        # Seeds are counted rarest first within a budget; the remaining
+        # postings only add to candidates already found
+        counts = Counter()
+        budget = FUZZY_CANDIDATES
+        for position, ids in enumerate(postings):
+            if position < len(seeds) and budget > 0:
+                counts.update(ids if len(ids) <= budget else islice(ids, budget))
+                budget -= len(ids)
+            else:
+                counts.update(counts.keys() & ids)
+        levels = defaultdict(list)
+        for entry_id, common in counts.items():
+            if common >= needed:
+                levels[common].append(entry_id)
+        results = []
+        for common in sorted(levels, reverse=True):
+            ids = [entry_id for entry_id in levels[common] if entry_id not in exclude]
+            wanted = limit - len(results)
+            if len(ids) > wanted:
+                # Among equal scores, prefer names closest in length to the query
+                ids = heapq.nsmallest(wanted, ids, key=lambda entry_id: (
+                    abs(len(self.entries[entry_id]["name"]) - len(text)), entry_id))
+            results += [(common / len(grams), entry_id) for entry_id in ids]
+            if len(results) >= limit:
+                break
+        return results
+
+    def suggest(self, text, limit=10):
+        """Top names for a search box: prefix completions of any word first, then typo-tolerant n-gram matches.
+
+        Returns (entry, match, score) tuples; the work depends on the limit and
+        the postings of the query's n-grams, not on the size of the catalog.
+        """
+        text = normalize(text)
+        if not text:
+            return []
+        while True:
+            with self.lock.read():
+                if not self.prefix_index.pending:
+                    return self._suggest(text, limit)
+            # Folding changes into the prefix array needs the write side
+            with self.lock:
+                self.prefix_index.fold()
+
+    def _suggest(self, text, limit):
+        completions = self.prefix_index.complete(text, limit)
+        # Whole-name matches before later-word matches, then shorter names
+        completions.sort(key=lambda pair: (not normalize(self.entries[pair[1]]["name"]).startswith(text),
+                                           len(self.entries[pair[1]]["name"]), pair[0]))
+        results = [(self.entries[entry_id], "prefix", 1.0) for _, entry_id in completions]
+        if len(results) < limit and len(text) > 1:
+            seen = {entry_id for _, entry_id in completions}
+            results += [(self.entries[entry_id], "fuzzy", round(score, 3))
+                        for score, entry_id in self._fuzzy(text, limit - len(results), seen)]
+        return results
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+_current_tenant = ContextVar("current_tenant", default=None)
+
+
+class Tenant(BaseModel):
+    name: str
+    db_name: str
+    hosts: List[str] = []
+    # Requests per second and burst size; 0 disables the limit
+    rate_limit: float = 0
+    burst: int = 0
+    # Requests in flight at once; 0 disables the limit
+    max_concurrency: int = 0
+
+
+class TenantRegistry:
+    """Colleges served by this deployment, resolved per request from X-Tenant or Host"""
+
+    def __init__(self, tenants: List[Tenant], default: Optional[str] = None):
+        self.tenants = {tenant.name: tenant for tenant in tenants}
+        self.by_host = {host.lower(): tenant for tenant in tenants for host in tenant.hosts}
+        self.by_db = {tenant.db_name: tenant for tenant in tenants}
+        if default is None and len(tenants) == 1:
+            default = tenants[0].name
+        self.default = self.tenants.get(default) if default else None
+
+    @classmethod
+    def from_env(cls, environ):
+        # TENANTS is a JSON list of Tenant objects; without it the deployment
+        # serves a single tenant from DB_NAME as before
+        if not environ.get('TENANTS'):
+            return cls([Tenant(name="default", db_name=environ['DB_NAME'])])
+        tenants = [Tenant(**entry) for entry in json.loads(environ['TENANTS'])]
+        return cls(tenants, default=environ.get('DEFAULT_TENANT'))
+
+    def resolve(self, headers) -> Optional[Tenant]:
+        name = headers.get("x-tenant")
+        if name:
+            return self.tenants.get(name)
+        host = headers.get("host", "").split(":")[0].lower()
+        return self.by_host.get(host, self.default)
+
+    def current(self) -> Tenant:
+        tenant = _current_tenant.get()
+        if tenant is None:
+            if self.default is None:
+                raise LookupError("No tenant is active")
+            return self.default
+        return tenant
+
+    def scoped(self, name):
+        """Cache and bus key for `name` in the current tenant"""
+        return f"{self.current().name}:{name}"
+
+    @contextmanager
+    def activate(self, tenant: Tenant):
+        token = _current_tenant.set(tenant)
+        try:
+            yield tenant
+        finally:
+            _current_tenant.reset(token)
+
+    def __iter__(self):
+        return iter(self.tenants.values())
+
+
+class TenantDatabase:
+    """Database handle that routes to the current tenant's database.
+
+    Every tenant database comes from the same Motor client, so all tenants
+    share one connection pool.
+    """
+
+    def __init__(self, client, registry: TenantRegistry):
+        self._client = client
+        self._registry = registry
+        self._handles = {}
+
+    def for_tenant(self, tenant: Tenant):
+        handle = self._handles.get(tenant.name)
+        if handle is None:
+            handle = self._handles[tenant.name] = self._client[tenant.db_name]
+        return handle
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.for_tenant(self._registry.current()), name)
+
+    def __getitem__(self, name):
+        return self.for_tenant(self._registry.current())[name]
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """0 if a token was taken, otherwise seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class TenantMiddleware:
+    """Activates the request's tenant and applies its rate and concurrency limits.
+
+    Limits are per worker process. Long-lived streams (exempt_prefixes) count
+    against the rate limit but do not hold a concurrency slot.
+    """
+
+    def __init__(self, app, registry: TenantRegistry, exempt_prefixes=(), queue_timeout=2.0):
+        self.app = app
+        self.registry = registry
+        self.exempt_prefixes = tuple(exempt_prefixes)
+        self.queue_timeout = queue_timeout
+        self.buckets = {}
+        self.semaphores = {}
+
+    async def _reject(self, send, status, detail, headers=()):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        tenant = self.registry.resolve(headers)
+        if tenant is None:
+            await self._reject(send, 404, "Unknown tenant")
+            return
+
+        if tenant.rate_limit:
+            bucket = self.buckets.get(tenant.name)
+            if bucket is None:
+                bucket = self.buckets[tenant.name] = TokenBucket(tenant.rate_limit, tenant.burst or tenant.rate_limit)
+            wait = bucket.take()
+            if wait:
+                retry_after = str(max(1, round(wait))).encode()
+                await self._reject(send, 429, "Rate limit exceeded", [(b"retry-after", retry_after)])
+                return
+
+        with self.registry.activate(tenant):
+            if not tenant.max_concurrency or scope.get("path", "").startswith(self.exempt_prefixes):
+                await self.app(scope, receive, send)
+                return
+            semaphore = self.semaphores.get(tenant.name)
+            if semaphore is None:
+                semaphore = self.semaphores[tenant.name] = asyncio.Semaphore(tenant.max_concurrency)
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                await self._reject(send, 503, "Too many concurrent requests", [(b"retry-after", b"1")])
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                semaphore.release()
@@ -0,0 +1,36 @@
+"""Standalone background job worker.
+
+Run from the backend directory, alongside API processes started with
+JOB_WORKERS=0 so long jobs never share an event loop with requests:
+
+    python worker.py [concurrency]
+"""
+import asyncio
+import logging
+import sys
+
+import server
+from jobs import JobWorkerPool, ensure_job_indexes
+from resume_index import shutdown_pool
+
+logger = logging.getLogger(__name__)
+
+
+async def main(concurrency):
+    tasks = [asyncio.create_task(server.invalidation_bus.start())]
+    for tenant in server.tenants:
+        with server.tenants.activate(tenant):
+            await ensure_job_indexes(server.db)
+            pool = JobWorkerPool(server.db, server.job_handlers, concurrency=concurrency)
+            tasks.extend(pool.start())
+    logger.info(f"Job worker running {concurrency} workers per tenant for {', '.join(server.tenants.tenants)}")
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        server.invalidation_bus.close()
+        shutdown_pool()
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 4))
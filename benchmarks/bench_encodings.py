@@ -0,0 +1,89 @@
+"""Compare list payload encodings on a 10k-student list.
+
+Run from the repository root:
+
+    python benchmarks/bench_encodings.py [count]
+"""
+import gzip
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from response_encoding import brotli, msgpack, to_columns, zstandard  # noqa: E402
+
+BRANCHES = ["CSE", "ECE", "EEE", "MECH", "CIVIL", "IT"]
+SKILLS = ["Python", "Java", "C++", "SQL", "React", "ML", "AWS", "Docker"]
+
+
+def make_students(count):
+    random.seed(42)
+    now = datetime.now(timezone.utc).isoformat()
+    return [{
+        "id": str(uuid.uuid4()),
+        "name": f"Student {i}",
+        "roll_no": f"21A91A{i:05d}",
+        "branch": random.choice(BRANCHES),
+        "section": random.choice("ABC"),
+        "year": 4,
+        "cgpa": round(random.uniform(6, 10), 2),
+        "skills": random.sample(SKILLS, 3),
+        "email": f"student{i}@college.edu",
+        "phone": f"98{i:08d}",
+        "resume_url": None,
+        "ssc_percentage": round(random.uniform(60, 100), 1),
+        "inter_diploma_percentage": round(random.uniform(60, 100), 1),
+        "backlogs_count": random.choice([0, 0, 0, 1, 2]),
+        "backlog_status": "not_applicable",
+        "year_of_passing": 2025,
+        "crt_fee_status": random.choice(["paid", "pending", "partial", "exempted"]),
+        "crt_fee_amount": 5000.0,
+        "crt_receipt_number": None,
+        "created_at": now,
+    } for i in range(count)]
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def main(count):
+    students = make_students(count)
+    columns = to_columns(students)
+    shapes = {
+        "json rows": (lambda: json.dumps(students, separators=(",", ":")).encode(), json.loads),
+        "json columns": (lambda: json.dumps(columns, separators=(",", ":")).encode(), json.loads),
+    }
+    if msgpack is not None:
+        shapes["msgpack rows"] = (lambda: msgpack.packb(students), msgpack.unpackb)
+        shapes["msgpack columns"] = (lambda: msgpack.packb(columns), msgpack.unpackb)
+
+    compressors = {"identity": lambda b: b, "gzip": lambda b: gzip.compress(b, 6)}
+    if brotli is not None:
+        compressors["br"] = lambda b: brotli.compress(b, quality=4)
+    if zstandard is not None:
+        compressors["zstd"] = zstandard.ZstdCompressor(level=3).compress
+
+    print(f"{count} students")
+    print(f"{'format':<18}{'encoding':<10}{'bytes':>12}{'encode ms':>12}{'parse ms':>12}")
+    for name, (encode, decode) in shapes.items():
+        payload, encode_ms = timed(encode)
+        _, parse_ms = timed(lambda: decode(payload))
+        for encoding, compress in compressors.items():
+            compressed, compress_ms = timed(lambda: compress(payload), repeat=3)
+            print(f"{name:<18}{encoding:<10}{len(compressed):>12,}{encode_ms + compress_ms:>12.1f}{parse_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
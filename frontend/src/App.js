@@ -1348,6 +1348,18 @@ const Applications = () => {
     fetchDrives();
   }, []);
 
+  useEffect(() => {
+    const source = new EventSource(`${API}/events/status`);
+    source.addEventListener('application_status', (e) => {
+      const { application_id, status } = JSON.parse(e.data);
+      setApplications(prev => prev.map(app =>
+        app.id === application_id ? { ...app, application_status: status } : app
+      ));
+    });
+    source.addEventListener('resync', () => fetchApplications());
+    return () => source.close();
+  }, []);
+
   const fetchApplications = async () => {
     try {
       const response = await axios.get(`${API}/applications`);
@@ -1390,9 +1402,9 @@ const Applications = () => {
 
   const updateApplicationStatus = async (applicationId, status) => {
     try {
-      await axios.put(`${API}/applications/${applicationId}/status`, { status });
+      const response = await axios.put(`${API}/applications/${applicationId}/status`, { status });
+      setApplications(prev => prev.map(app => app.id === applicationId ? response.data : app));
       toast.success('Application status updated successfully');
-      fetchApplications();
     } catch (error) {
       toast.error('Failed to update application status');
     }
@@ -0,0 +1,401 @@
+"""In-memory stand-in for the parts of Motor the backend modules use.
+
+Covers find/update/insert/delete with the query and update operators the
+code issues; aggregation pipelines and pipeline-style updates are not
+supported and raise NotImplementedError.
+"""
+import copy
+import itertools
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _set(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset(doc, path):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+
+def _compare(a, b, op):
+    if a is _MISSING or a is None or b is None:
+        return False
+    try:
+        return op(a, b)
+    except TypeError:
+        return False
+
+
+def _equals(value, expected):
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    if value is _MISSING:
+        return expected is None
+    return value == expected
+
+
+def _expression(doc, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict) and len(expression) == 1:
+        (op, args), = expression.items()
+        values = [_expression(doc, arg) for arg in args]
+        comparisons = {"$lt": lambda a, b: a < b, "$lte": lambda a, b: a <= b, "$gt": lambda a, b: a > b,
+                       "$gte": lambda a, b: a >= b, "$eq": lambda a, b: a == b, "$ne": lambda a, b: a != b}
+        if op in comparisons:
+            return comparisons[op](*values)
+        raise NotImplementedError(op)
+    return expression
+
+
+def _match_condition(value, condition):
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return _equals(value, condition)
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = _equals(value, operand)
+        elif op == "$ne":
+            ok = not _equals(value, operand)
+        elif op == "$in":
+            ok = any(_equals(value, item) for item in operand)
+        elif op == "$nin":
+            ok = not any(_equals(value, item) for item in operand)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(operand)
+        elif op == "$lt":
+            ok = _compare(value, operand, lambda a, b: a < b)
+        elif op == "$lte":
+            ok = _compare(value, operand, lambda a, b: a <= b)
+        elif op == "$gt":
+            ok = _compare(value, operand, lambda a, b: a > b)
+        elif op == "$gte":
+            ok = _compare(value, operand, lambda a, b: a >= b)
+        else:
+            raise NotImplementedError(op)
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$expr":
+            if not _expression(doc, condition):
+                return False
+        elif not _match_condition(_get(doc, key), condition):
+            return False
+    return True
+
+
+def _project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include = {key for key, value in projection.items() if value and key != "_id"}
+    if include:
+        projected = {key: doc[key] for key in include if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            projected["_id"] = doc["_id"]
+        return projected
+    for key, value in projection.items():
+        if not value:
+            doc.pop(key, None)
+    return doc
+
+
+def _sort_key(spec):
+    def key(doc):
+        values = []
+        for field, direction in spec:
+            value = _get(doc, field)
+            present = value is not _MISSING and value is not None
+            values.append((present, value if present else 0))
+        return values
+    return key
+
+
+def _sorted(docs, spec):
+    # Stable sorts from the last key to the first honour mixed directions
+    for field, direction in reversed(spec):
+        docs = sorted(docs, key=_sort_key([(field, direction)]), reverse=direction < 0)
+    return docs
+
+
+def _apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        raise NotImplementedError("pipeline updates")
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                _set(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                current = _get(doc, path)
+                _set(doc, path, (0 if current is _MISSING else current) + value)
+            elif op in ("$push", "$addToSet"):
+                current = _get(doc, path)
+                items = list(current) if current is not _MISSING else []
+                each = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in each:
+                    if op == "$push" or item not in items:
+                        items.append(copy.deepcopy(item))
+                if isinstance(value, dict) and "$slice" in value:
+                    limit = value["$slice"]
+                    items = items[limit:] if limit < 0 else items[:limit]
+                _set(doc, path, items)
+            elif op == "$pull":
+                current = _get(doc, path)
+                if current is not _MISSING:
+                    _set(doc, path, [item for item in current if not _equals(item, value)])
+            else:
+                raise NotImplementedError(op)
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort = []
+        self._limit = 0
+        self._skip = 0
+
+    def sort(self, key, direction=1):
+        self._sort = list(key) if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def _docs(self):
+        docs = [doc for doc in self.collection.docs if matches(doc, self.query)]
+        if self._sort:
+            docs = _sorted(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(doc, self.projection) for doc in docs]
+
+    async def to_list(self, length=None):
+        docs = self._docs()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs():
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+        self.docs = []
+        self.unique = [("_id",)]
+
+    # Indexes: only uniqueness is modelled
+    async def create_index(self, keys, unique=False, **kwargs):
+        fields = (keys,) if isinstance(keys, str) else tuple(field for field, _ in keys)
+        if unique and fields not in self.unique:
+            self.unique.append(fields)
+        return "_".join(fields)
+
+    def _check_unique(self, doc, ignore=None):
+        for fields in self.unique:
+            values = tuple(_get(doc, field) for field in fields)
+            if all(value is _MISSING for value in values):
+                continue
+            for other in self.docs:
+                if other is not ignore and tuple(_get(other, field) for field in fields) == values:
+                    raise DuplicateKeyError(f"E11000 duplicate key on {self.name} {fields}")
+
+    def _insert(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return doc["_id"]
+
+    async def insert_one(self, doc):
+        doc["_id"] = self._insert(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        inserted, errors = [], []
+        for index, doc in enumerate(docs):
+            try:
+                doc["_id"] = self._insert(doc)
+                inserted.append(doc["_id"])
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted)
+
+    def _first(self, query, sort=None):
+        docs = [doc for doc in self.docs if matches(doc, query)]
+        if sort:
+            docs = _sorted(docs, sort)
+        return docs[0] if docs else None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self, query or {}, projection)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        doc = self._first(query or {}, sort)
+        return _project(doc, projection) if doc is not None else None
+
+    async def count_documents(self, query, limit=0):
+        count = sum(1 for doc in self.docs if matches(doc, query))
+        return min(count, limit) if limit else count
+
+    async def distinct(self, field, query=None):
+        values = []
+        for doc in self.docs:
+            value = _get(doc, field)
+            if value is not _MISSING and value not in values and matches(doc, query or {}):
+                values.append(value)
+        return values
+
+    def _upsert_doc(self, query, update):
+        doc = {key: value for key, value in query.items()
+               if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))}
+        _apply_update(doc, update, inserting=True)
+        return doc
+
+    def _update(self, doc, update):
+        updated = copy.deepcopy(doc)
+        _apply_update(updated, update)
+        self._check_unique(updated, ignore=doc)
+        doc.clear()
+        doc.update(updated)
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self._first(query)
+        if doc is None:
+            if not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            upserted_id = self._insert(self._upsert_doc(query, update))
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=upserted_id)
+        before = copy.deepcopy(doc)
+        self._update(doc, update)
+        return SimpleNamespace(matched_count=1, modified_count=int(before != doc), upserted_id=None)
+
+    async def update_many(self, query, update, upsert=False):
+        docs = [doc for doc in self.docs if matches(doc, query)]
+        if not docs and upsert:
+            return await self.update_one(query, update, upsert=True)
+        modified = 0
+        for doc in docs:
+            before = copy.deepcopy(doc)
+            self._update(doc, update)
+            modified += before != doc
+        return SimpleNamespace(matched_count=len(docs), modified_count=modified, upserted_id=None)
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE):
+        doc = self._first(query, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            inserted_id = self._insert(self._upsert_doc(query, update))
+            doc = self._first({"_id": inserted_id})
+            return _project(doc, projection) if return_document == ReturnDocument.AFTER else None
+        before = copy.deepcopy(doc)
+        self._update(doc, update)
+        return _project(doc if return_document == ReturnDocument.AFTER else before, projection)
+
+    async def replace_one(self, query, replacement, upsert=False):
+        doc = self._first(query)
+        if doc is None:
+            if not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            # Like Mongo, an upserted replacement takes its _id from the filter
+            replacement = {**({"_id": query["_id"]} if "_id" in query else {}), **replacement}
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._insert(replacement))
+        replacement = {**copy.deepcopy(replacement), "_id": doc["_id"]}
+        self._check_unique(replacement, ignore=doc)
+        doc.clear()
+        doc.update(replacement)
+        return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+
+    async def delete_one(self, query):
+        doc = self._first(query)
+        if doc is not None:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=int(doc is not None))
+
+    async def delete_many(self, query):
+        doomed = [doc for doc in self.docs if matches(doc, query)]
+        for doc in doomed:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=len(doomed))
+
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            await self.update_one(request._filter, request._doc, upsert=request._upsert)
+        return SimpleNamespace(acknowledged=True)
+
+    def aggregate(self, pipeline, **kwargs):
+        raise NotImplementedError("aggregate")
+
+
+class FakeDatabase:
+    _ids = itertools.count()
+
+    def __init__(self, name=None):
+        self.name = name or f"fake{next(self._ids)}"
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import httpx
+
+from catalog_proxy import CatalogOwner, CatalogProxyMiddleware
+
+
+async def local_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"x-served-by", b"local")]})
+    await send({"type": "http.response.body", "body": b"local"})
+
+
+def call(middleware, method, path, query=b"", headers=(), chunks=()):
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "raw_path": path.encode(),
+             "query_string": query, "headers": list(headers)}
+    asyncio.run(middleware(scope, receive, send))
+    start = sent[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def proxy(handler):
+    owner = CatalogOwner(local_app, "/nonexistent.sock", lambda: False,
+                         transport=httpx.MockTransport(handler))
+    return owner, CatalogProxyMiddleware(local_app, owner, ["/api/avdb", "/api/categories"])
+
+
+def test_non_owner_forwards_the_request_and_streams_the_response():
+    seen = {}
+
+    async def handler(request):
+        seen["method"] = request.method
+        seen["url"] = str(request.url)
+        seen["body"] = await request.aread()
+        seen["host"] = request.headers["host"]
+        seen["range"] = request.headers.get("range")
+
+        async def chunks():
+            yield b"o"
+            yield b"k"
+        return httpx.Response(206, headers={"content-range": "bytes 0-1/10"}, content=chunks())
+
+    _, middleware = proxy(handler)
+    status, headers, body = call(
+        middleware, "POST", "/api/avdb/import", query=b"dry_run=true",
+        headers=[(b"host", b"example.org"), (b"content-length", b"6"), (b"range", b"bytes=0-1")],
+        chunks=[b"abc", b"def"],
+    )
+    assert (status, body) == (206, b"ok")
+    assert headers[b"content-range"] == b"bytes 0-1/10"
+    assert seen == {"method": "POST", "url": "http://catalog/api/avdb/import?dry_run=true",
+                    "body": b"abcdef", "host": "catalog", "range": "bytes=0-1"}
+
+
+def test_owner_and_other_paths_are_served_locally():
+    def handler(request):
+        raise AssertionError("forwarded")
+
+    owner, middleware = proxy(handler)
+    assert call(middleware, "GET", "/api/students")[2] == b"local"
+    owner.owned = True
+    assert call(middleware, "GET", "/api/categories")[2] == b"local"
+
+
+def test_unreachable_owner_answers_503():
+    def handler(request):
+        raise httpx.ConnectError("no socket", request=request)
+
+    _, middleware = proxy(handler)
+    status, headers, body = call(middleware, "GET", "/api/categories")
+    assert status == 503
+    assert headers[b"retry-after"] == b"1"
+    assert "retry" in json.loads(body)["detail"]
@@ -0,0 +1,156 @@
+import io
+
+import pytest
+
+import av_db_api
+from categories import CategoryError, CategoryTree
+from csv_io import AV_SCHEMA, SKIP, import_csv
+from stores import IndexedStore
+
+
+class RecordingJournal:
+    def __init__(self):
+        self.records = []
+
+    def append(self, record):
+        self.records.append(record)
+        return len(self.records)
+
+    def sync(self, lsn):
+        pass
+
+
+def make_tree():
+    store = IndexedStore(indexed=("parent_id",))
+    tree = CategoryTree(store)
+    store.journal = RecordingJournal()
+    return tree, store.journal
+
+
+def names(categories):
+    return [category["name"] for category in categories]
+
+
+def test_subtree_and_move_rewrite_paths():
+    tree, _ = make_tree()
+    media = tree.add("Media")
+    music = tree.add("Music", media)
+    jazz = tree.add("Jazz", music)
+    video = tree.add("Video")
+    assert names(tree.subtree(media)) == ["Media", "Music", "Jazz"]
+    tree.move(music, video)
+    assert tree.get(jazz)["path"] == f"/{video}/{music}/{jazz}/"
+    assert names(tree.subtree(video)) == ["Video", "Music", "Jazz"]
+    assert tree.label(jazz) == "Video / Music / Jazz"
+    with pytest.raises(CategoryError):
+        tree.move(music, jazz)
+
+
+def test_move_is_one_journal_record():
+    tree, journal = make_tree()
+    root = tree.add("Root")
+    child = tree.add("Child", root)
+    tree.add("Grandchild", child)
+    other = tree.add("Other")
+    journal.records.clear()
+    tree.move(root, other)
+    assert [record[0] for record in journal.records] == ["batch"]
+    assert len(journal.records[0][1]) == 3
+
+
+def test_import_chunk_is_one_journal_record_and_replays():
+    tree, journal = make_tree()
+    existing = tree.add("Old name")
+    journal.records.clear()
+    summary = tree.put_many([
+        {"id": 10, "name": "Books", "parent_id": None},
+        {"id": 11, "name": "Fiction", "parent_id": 10},
+        {"id": existing, "name": "Renamed", "parent_id": 11},
+        {"id": 12, "name": "Orphan", "parent_id": 99},
+        {"name": "No id", "parent_id": 11},
+    ])
+    assert summary == (3, 1, 1)
+    assert [record[0] for record in journal.records] == ["batch"]
+    assert tree.label(existing) == "Books / Fiction / Renamed"
+    assert names(tree.children(11)) == ["Renamed", "No id"]
+
+    replayed = IndexedStore(indexed=("parent_id",))
+    for record in journal.records:
+        replayed.replay(record)
+    assert {entry["id"]: entry["path"] for entry in replayed} == {entry["id"]: entry["path"] for entry in tree.store}
+
+
+def test_delete_moves_children_and_notifies():
+    tree, _ = make_tree()
+    root = tree.add("Root")
+    middle = tree.add("Middle", root)
+    leaf = tree.add("Leaf", middle)
+    deleted = []
+    tree.on_delete(lambda category_id, parent_id: deleted.append((category_id, parent_id)))
+    tree.delete(middle)
+    assert tree.get(leaf)["parent_id"] == root
+    assert names(tree.subtree(root)) == ["Root", "Leaf"]
+    assert deleted == [(middle, root)]
+
+
+def test_deleted_category_entries_move_to_the_parent(monkeypatch):
+    tree, _ = make_tree()
+    root = tree.add("Music")
+    jazz = tree.add("Jazz", root)
+    entries = IndexedStore(indexed=("type", "category_id"))
+    entries.journal = RecordingJournal()
+    first = entries.add({"name": "Take Five", "type": "audio", "category_id": jazz})
+    second = entries.add({"name": "Loose", "type": "audio", "category_id": None})
+    monkeypatch.setattr(av_db_api, "av_db", entries)
+    tree.on_delete(av_db_api.repoint_entries)
+    tree.delete(jazz)
+    assert entries.get(first)["category_id"] == root
+    assert entries.get(second)["category_id"] is None
+    tree.delete(root)
+    assert entries.get(first)["category_id"] is None
+    assert entries.filter(category_id=[root]) == []
+
+
+def test_labels_resolve_back_to_nested_categories():
+    tree, _ = make_tree()
+    media = tree.add("Media")
+    music = tree.add("Music", media)
+    jazz = tree.add("Jazz", music)
+    # A root with the same name as a nested category
+    other_jazz = tree.add("Jazz")
+    assert tree.resolve(tree.label(jazz)) == jazz
+    assert tree.resolve("media / MUSIC / jazz") == jazz
+    assert tree.resolve("Jazz") == jazz
+    assert tree.resolve("Music / Jazz") is None
+    assert len(tree) == 4
+
+    # Only the missing tail of a path is created, under the deepest match
+    blues = tree.resolve("Media / Music / Blues", create=True)
+    assert tree.get(blues)["parent_id"] == music
+    assert tree.label(tree.resolve("Video / Clips", create=True)) == "Video / Clips"
+    assert tree.resolve("Jazz", create=True) == jazz
+    assert other_jazz != jazz
+
+
+def test_av_import_creates_categories_only_for_written_rows(monkeypatch):
+    tree, _ = make_tree()
+    entries = IndexedStore(indexed=("type", "category_id"))
+    entries.journal = RecordingJournal()
+    existing = entries.add({"name": "Old", "type": "audio", "path": "/media/old.mp3"})
+    monkeypatch.setattr(av_db_api, "av_db", entries)
+    monkeypatch.setattr(av_db_api, "category_tree", tree)
+    csv_file = io.BytesIO((
+        "id,name,type,path,category_id,category\n"
+        ",Take Five,audio,/media/take5.mp3,,Media / Jazz\n"
+        f"{existing},Conflict,audio,/media/old.mp3,,Skipped\n"
+        ",No path,audio,,,Invalid\n"
+        "7,Twice,audio,/media/a.mp3,,First\n"
+        "7,Twice again,audio,/media/b.mp3,,Second\n"
+    ).encode())
+    summary = import_csv(av_db_api.CsvImportTarget(), csv_file, AV_SCHEMA, SKIP,
+                         prepare=lambda entry: av_db_api.with_category_id(entry, create=False))
+    assert (summary["inserted"], summary["skipped"], summary["invalid"]) == (2, 2, 1)
+    assert sorted(tree.label(category["id"]) for category in tree.entries()) == ["First", "Media", "Media / Jazz"]
+    take_five = next(entry for entry in entries if entry["name"] == "Take Five")
+    assert tree.label(take_five["category_id"]) == "Media / Jazz"
+    assert "category" not in take_five
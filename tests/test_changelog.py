@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from changelog import DELETE, UPSERT, ChangeLog, collapse
+from tests.fake_mongo import FakeDatabase
+
+
+def test_read_returns_changes_after_the_cursor():
+    async def run():
+        log = ChangeLog(FakeDatabase())
+        for entity_id in ("a", "b", "c"):
+            await log.record("students", entity_id)
+        entries, cursor, resync, more = await log.read(1)
+        assert [entry["entity_id"] for entry in entries] == ["b", "c"]
+        assert (cursor, resync, more) == (3, False, False)
+        assert await log.read(3) == ([], 3, False, False)
+
+    asyncio.run(run())
+
+
+def test_recent_gap_stops_the_read_until_it_settles():
+    async def run():
+        db = FakeDatabase()
+        log = ChangeLog(db, settle=timedelta(seconds=2))
+        await log.record("students", "a")
+        # Seq 2 is allocated but its insert has not landed yet
+        await log._next_seq()
+        await log.record("students", "c")
+        entries, cursor, _, _ = await log.read(0)
+        assert [entry["seq"] for entry in entries] == [1]
+        assert cursor == 1
+
+        # Once the gap is older than `settle` the write is taken as lost
+        await db.changes.update_many({}, {"$set": {"ts": datetime.now(timezone.utc) - timedelta(seconds=5)}})
+        entries, cursor, _, _ = await log.read(1)
+        assert [entry["seq"] for entry in entries] == [3]
+        assert cursor == 3
+
+    asyncio.run(run())
+
+
+def test_expired_or_foreign_cursor_requires_resync():
+    async def run():
+        db = FakeDatabase()
+        log = ChangeLog(db)
+        for entity_id in ("a", "b", "c"):
+            await log.record("students", entity_id)
+        # The TTL index removed the oldest entries; the survivors are near the bound
+        await db.changes.update_many({}, {"$set": {"ts": datetime.now(timezone.utc) - timedelta(days=7)}})
+        await db.changes.delete_many({"seq": {"$lte": 2}})
+        assert (await log.read(0))[2] is True
+        assert (await log.read(2))[2] is False
+        assert (await log.read(10))[2] is True
+
+    asyncio.run(run())
+
+
+def test_lost_seq_after_the_cursor_does_not_require_resync():
+    async def run():
+        db = FakeDatabase()
+        log = ChangeLog(db, settle=timedelta(seconds=2))
+        await log.record("students", "a")
+        # Seq 2's insert was aborted and the entry at the cursor has expired
+        await log._next_seq()
+        await log.record("students", "c")
+        await db.changes.delete_one({"seq": 1})
+        entries, cursor, resync, _ = await log.read(1)
+        # Still within the settle window, so the gap may yet be filled
+        assert (entries, cursor, resync) == ([], 1, False)
+
+        await db.changes.update_many({}, {"$set": {"ts": datetime.now(timezone.utc) - timedelta(seconds=5)}})
+        entries, cursor, resync, _ = await log.read(1)
+        assert ([entry["seq"] for entry in entries], cursor, resync) == ([3], 3, False)
+
+    asyncio.run(run())
+
+
+def test_limit_reports_more():
+    async def run():
+        log = ChangeLog(FakeDatabase())
+        for number in range(5):
+            await log.record("students", str(number))
+        entries, cursor, _, more = await log.read(0, limit=2)
+        assert (len(entries), cursor, more) == (2, 2, True)
+
+    asyncio.run(run())
+
+
+def test_collapse_keeps_the_last_operation_per_entity():
+    entries = [
+        {"collection": "students", "entity_id": "a", "op": UPSERT},
+        {"collection": "students", "entity_id": "a", "op": DELETE},
+        {"collection": "students", "entity_id": "b", "op": UPSERT},
+        {"collection": "drives", "entity_id": "d", "op": UPSERT},
+    ]
+    assert collapse(entries) == {
+        "students": {"upserted": ["b"], "deleted": ["a"]},
+        "drives": {"upserted": ["d"], "deleted": []},
+    }
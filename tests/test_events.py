@@ -0,0 +1,46 @@
+import asyncio
+
+from events import APPLICATION_STATUS, StatusEventBus, stream_events
+
+
+class ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+
+async def collect(bus, subscription, last_event_id, count):
+    stream = stream_events(ConnectedRequest(), bus, subscription, last_event_id, heartbeat=0.05)
+    chunks = []
+    async for chunk in stream:
+        if chunk.startswith("id: "):
+            chunks.append(chunk.split("\n", 1)[0][4:])
+            if len(chunks) == count:
+                break
+    await stream.aclose()
+    return chunks
+
+
+def test_replay_does_not_repeat_events_published_during_it():
+    async def run():
+        bus = StatusEventBus()
+        first = bus.publish(APPLICATION_STATUS, {"status": "applied"}, "a")
+        subscription = bus.subscribe(scope="a")
+        # Published after subscribing and before the backlog is read: in both places
+        second = bus.publish(APPLICATION_STATUS, {"status": "shortlisted"}, "a")
+        collecting = asyncio.ensure_future(collect(bus, subscription, first["id"], 2))
+        await asyncio.sleep(0.01)
+        third = bus.publish(APPLICATION_STATUS, {"status": "selected"}, "a")
+        return await collecting, [second["id"], third["id"]]
+
+    received, expected = asyncio.run(run())
+    assert received == expected
+
+
+def test_change_stream_state_is_per_scope():
+    bus = StatusEventBus()
+    bus.set_streamed("a", True)
+    bus.set_streamed("b", True)
+    bus.set_streamed("b", False)
+    bus.publish_local(APPLICATION_STATUS, {}, "a")
+    bus.publish_local(APPLICATION_STATUS, {}, "b")
+    assert [event["scope"] for event in bus.since(f"{bus.epoch}-0")] == ["b"]
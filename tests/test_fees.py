@@ -0,0 +1,124 @@
+import asyncio
+
+import fees
+from fees import (
+    EXEMPTED, PAID, PARTIAL, PENDING, apply_student_change, derive_status, fee_report, list_defaulters,
+    outstanding_balance, rebuild_fee_totals, update_student_fees,
+)
+from tests.fake_mongo import FakeDatabase
+
+
+def student(student_id, paid=0.0, amount=1000.0, status=None, branch="CSE", section="A", batch=2026):
+    status = status or derive_status(amount, paid)
+    return {"id": student_id, "name": student_id, "roll_no": student_id.upper(), "year_of_passing": batch,
+            "branch": branch, "section": section, "crt_fee_amount": amount, "crt_fee_paid": paid,
+            "crt_fee_status": status, "crt_fee_balance": outstanding_balance(amount, paid, status)}
+
+
+async def totals(db):
+    cells = {}
+    async for cell in db.crt_fee_totals.find({}):
+        if cell.get("students"):
+            # Incremental cells never hold fields whose deltas were all zero
+            cells[cell["_id"]] = {key: (round(value, 2) if isinstance(value, float) else value)
+                                  for key, value in cell.items() if key not in ("_id", "version") and value != 0}
+            cells[cell["_id"]]["status"] = {k: v for k, v in cell.get("status", {}).items() if v}
+    return cells
+
+
+def test_derive_status():
+    assert derive_status(1000, 0) == PENDING
+    assert derive_status(1000, 400) == PARTIAL
+    assert derive_status(1000, 999.996) == PAID
+    assert derive_status(1000, 0, exempted=True) == EXEMPTED
+
+
+def test_incremental_totals_match_a_rebuild():
+    async def run():
+        incremental = FakeDatabase()
+        students = [student("a"), student("b", paid=400), student("c", paid=1000),
+                    student("d", status=EXEMPTED), student("e", branch="ECE", section="B")]
+        for entry in students:
+            await incremental.students.insert_one(dict(entry))
+            await apply_student_change(incremental, None, entry)
+        # A partial payment, a move to another section and a deletion
+        moved = {**students[1], "crt_fee_paid": 700.0, "crt_fee_status": PARTIAL, "section": "B"}
+        await incremental.students.update_one({"id": "b"}, {"$set": moved})
+        await apply_student_change(incremental, students[1], moved)
+        await incremental.students.delete_one({"id": "a"})
+        await apply_student_change(incremental, students[0], None)
+
+        rebuilt = FakeDatabase()
+        for entry in await incremental.students.find({}).to_list(None):
+            await rebuilt.students.insert_one(entry)
+        await rebuild_fee_totals(rebuilt)
+        assert await totals(incremental) == await totals(rebuilt)
+
+        report = await fee_report(incremental, group_by="section")
+        assert report["students"] == 4
+        assert report["fee_due"] == 3000.0 and report["collected"] == 1700.0
+        assert report["outstanding"] == 1300.0 and report["defaulters"] == 2
+        assert set(report["groups"]) == {"CSE-A", "CSE-B", "ECE-B"}
+
+    asyncio.run(run())
+
+
+def test_rebuild_rescans_a_cell_that_changed_during_the_scan(monkeypatch):
+    async def run():
+        db = FakeDatabase()
+        entries = [student("a"), student("b", branch="ECE")]
+        for entry in entries:
+            await db.students.insert_one(dict(entry))
+            await apply_student_change(db, None, entry)
+        scan = fees._scan_cells
+        calls = []
+
+        async def scan_then_pay(db, query):
+            cells = await scan(db, query)
+            if not calls:
+                # A payment lands after its student was read by the rebuild
+                paid = {**entries[0], "crt_fee_paid": 1000.0, "crt_fee_status": PAID, "crt_fee_balance": 0.0}
+                await db.students.update_one({"id": "a"}, {"$set": paid})
+                await apply_student_change(db, entries[0], paid)
+            calls.append(query)
+            return cells
+
+        monkeypatch.setattr(fees, "_scan_cells", scan_then_pay)
+        assert await rebuild_fee_totals(db) == 2
+        assert len(calls) == 2
+        report = await fee_report(db)
+        assert report["collected"] == 1000.0 and report["outstanding"] == 1000.0
+        assert report["status"][PAID] == 1 and report["status"][PENDING] == 1
+
+    asyncio.run(run())
+
+
+def test_update_student_fees_moves_the_share_and_keeps_paid_amounts():
+    async def run():
+        db = FakeDatabase()
+        entry = student("a", paid=400)
+        await db.students.insert_one(dict(entry))
+        await apply_student_change(db, None, entry)
+        before, after = await update_student_fees(db, "a", {"crt_fee_amount": 400.0, "crt_fee_status": PENDING})
+        assert after["crt_fee_status"] == PAID and after["crt_fee_balance"] == 0
+        assert (await db.students.find_one({"id": "a"}))["crt_fee_balance"] == 0
+        report = await fee_report(db)
+        assert report["outstanding"] == 0 and report["status"][PAID] == 1 and report["status"][PARTIAL] == 0
+        assert await update_student_fees(db, "missing", {"crt_fee_amount": 1.0, "crt_fee_status": PENDING}) is None
+
+    asyncio.run(run())
+
+
+def test_defaulters_are_listed_by_amount_owed():
+    async def run():
+        db = FakeDatabase()
+        await db.students.insert_many([
+            student("a"), student("b", paid=900), student("c", paid=1000), student("d", status=EXEMPTED),
+            student("e", amount=2000, paid=500, branch="ECE"),
+        ])
+        defaulters = await list_defaulters(db)
+        assert [(entry["id"], entry["balance"]) for entry in defaulters] == [("e", 1500.0), ("a", 1000.0),
+                                                                            ("b", 100.0)]
+        assert [entry["id"] for entry in await list_defaulters(db, branch="CSE", limit=1)] == ["a"]
+
+    asyncio.run(run())
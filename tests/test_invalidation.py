@@ -0,0 +1,42 @@
+import time
+
+from invalidation import InvalidationBus, LocalCache
+
+
+def test_set_is_dropped_when_an_invalidation_lands_during_the_read():
+    bus = InvalidationBus()
+    cache = bus.register(LocalCache("entities"))
+    generation = cache.generation
+    # A write and its invalidation arrive while the stale document is being read
+    bus.receive({"o": "peer", "s": 1, "c": "t:students", "i": "s1"})
+    assert not cache.set("t:students", "s1", {"id": "s1", "name": "old"}, generation=generation)
+    assert cache.get("t:students", "s1") is None
+
+    generation = cache.generation
+    assert cache.set("t:students", "s1", {"id": "s1", "name": "new"}, generation=generation)
+    assert cache.get("t:students", "s1")["name"] == "new"
+
+
+def test_entries_expire_with_ttl():
+    cache = LocalCache("entities", ttl=0.01)
+    cache.set("t:students", "s1", {"id": "s1"})
+    assert cache.get("t:students", "s1") == {"id": "s1"}
+    time.sleep(0.02)
+    assert cache.get("t:students", "s1") is None
+
+
+def test_dependents_are_invalidated_with_their_collections():
+    cache = LocalCache("stats")
+    cache.set("t:dashboard", False, {"total": 1}, depends_on=["t:students"])
+    cache.invalidate("t:students", "s1")
+    assert cache.get("t:dashboard", False) is None
+
+
+def test_gap_in_sequence_flushes_caches():
+    bus = InvalidationBus()
+    cache = bus.register(LocalCache("entities"))
+    cache.set("t:students", "s1", {"id": "s1"})
+    bus.receive({"o": "peer", "s": 1, "c": "t:drives", "i": "d1"})
+    assert cache.get("t:students", "s1") is not None
+    bus.receive({"o": "peer", "s": 3, "c": "t:drives", "i": "d2"})
+    assert cache.get("t:students", "s1") is None
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobWorkerPool, enqueue
+from tests.fake_mongo import FakeDatabase
+
+
+async def expire_lease(db, job_id):
+    await db.jobs.update_one({"id": job_id}, {"$set": {
+        "lease_expires": datetime.now(timezone.utc) - timedelta(seconds=1),
+    }})
+
+
+def test_job_runs_and_succeeds():
+    async def run():
+        db = FakeDatabase()
+
+        async def double(ctx):
+            await ctx.progress(1, 1)
+            return ctx.payload["n"] * 2
+
+        pool = JobWorkerPool(db, {"double": double})
+        job = await enqueue(db, "double", {"n": 21})
+        claimed = await pool.claim()
+        assert claimed["id"] == job["id"] and claimed["status"] == RUNNING and claimed["attempts"] == 1
+        assert await pool.claim() is None
+        await pool.run_job(claimed)
+        stored = await db.jobs.find_one({"id": job["id"]})
+        assert stored["status"] == SUCCEEDED and stored["result"] == 42
+        assert "lease_owner" not in stored
+
+    asyncio.run(run())
+
+
+def test_failure_is_retried_then_fails_permanently():
+    async def run():
+        db = FakeDatabase()
+
+        async def broken(ctx):
+            raise ValueError("boom")
+
+        pool = JobWorkerPool(db, {"broken": broken}, retry_base=0)
+        job = await enqueue(db, "broken", max_attempts=2)
+        await pool.run_job(await pool.claim())
+        stored = await db.jobs.find_one({"id": job["id"]})
+        assert stored["status"] == QUEUED and stored["error"] == "boom"
+        await pool.run_job(await pool.claim())
+        stored = await db.jobs.find_one({"id": job["id"]})
+        assert stored["status"] == FAILED and stored["attempts"] == 2
+
+    asyncio.run(run())
+
+
+def test_expired_lease_is_reclaimed_while_attempts_remain():
+    async def run():
+        db = FakeDatabase()
+        dead = JobWorkerPool(db, {"work": None})
+        alive = JobWorkerPool(db, {"work": None})
+        job = await enqueue(db, "work", max_attempts=2)
+        await dead.claim()
+        assert await alive.claim() is None
+        await expire_lease(db, job["id"])
+        reclaimed = await alive.claim()
+        assert reclaimed["lease_owner"] == alive.owner and reclaimed["attempts"] == 2
+
+    asyncio.run(run())
+
+
+def test_job_abandoned_on_its_last_attempt_fails():
+    async def run():
+        db = FakeDatabase()
+        dead = JobWorkerPool(db, {"work": None})
+        alive = JobWorkerPool(db, {"work": None})
+        job = await enqueue(db, "work", max_attempts=1)
+        await dead.claim()
+        await expire_lease(db, job["id"])
+        assert await alive.claim() is None
+        stored = await db.jobs.find_one({"id": job["id"]})
+        assert stored["status"] == FAILED and "lease_owner" not in stored
+
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import os
+import threading
+
+from media_probe import UNSUPPORTED, ProbeCache, probe_cached
+
+
+def test_probe_cached_persists_results_and_drops_older_versions(tmp_path):
+    media = tmp_path / "notes.txt"
+    media.write_bytes(b"not a media file")
+    cache = ProbeCache(tmp_path / "probe-cache.json")
+    assert probe_cached(str(media), cache)["error"] == UNSUPPORTED
+    first = cache.key(str(media), os.stat(media))
+    assert first in ProbeCache(tmp_path / "probe-cache.json").entries
+
+    media.write_bytes(b"still not a media file")
+    probe_cached(str(media), cache)
+    reloaded = ProbeCache(tmp_path / "probe-cache.json").entries
+    assert list(reloaded) == [cache.key(str(media), os.stat(media))]
+
+
+def test_puts_and_saves_from_several_threads(tmp_path):
+    cache = ProbeCache(tmp_path / "probe-cache.json")
+
+    def put(start):
+        for index in range(start, start + 200):
+            cache.put(f"/media/{index}\x001\x001", {"size": 1})
+            if index % 50 == 0:
+                cache.save()
+
+    threads = [threading.Thread(target=put, args=(start,)) for start in range(0, 800, 200)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.save()
+    assert len(ProbeCache(tmp_path / "probe-cache.json").entries) == 800
@@ -0,0 +1,48 @@
+import asyncio
+
+from av_db_api import MediaResponse
+from response_encoding import CompressionMiddleware
+
+
+def serve(app, extensions, headers=()):
+    sent = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            # What the server would do with the descriptor
+            message["file"].seek(message["offset"])
+            message = {**message, "data": message["file"].read(message["count"])}
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": list(headers), "extensions": extensions}
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+def media_response(path, released):
+    return MediaResponse(str(path), 2, 5, lambda: released.append(True), status_code=206,
+                         media_type="video/mp4", headers={"Content-Length": "4"})
+
+
+def test_zero_copy_send_is_used_when_offered(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b"0123456789")
+    released = []
+    app = CompressionMiddleware(media_response(path, released), minimum_size=1)
+    sent = serve(app, {"http.response.zerocopysend": {}}, [(b"accept-encoding", b"gzip")])
+    assert [message["type"] for message in sent] == ["http.response.start", "http.response.zerocopysend"]
+    assert sent[0]["status"] == 206
+    assert (sent[1]["offset"], sent[1]["count"], sent[1]["data"]) == (2, 4, b"2345")
+    assert released
+
+
+def test_chunks_are_read_without_the_extension(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b"0123456789")
+    released = []
+    sent = serve(media_response(path, released), {})
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"2345"
+    assert released
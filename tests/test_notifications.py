@@ -0,0 +1,66 @@
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+from notifications import MessageTemplate, SendFailure, announce_drive, eligibility_query
+from tests.fake_mongo import FakeDatabase
+
+TEMPLATE = MessageTemplate("{company_name}", "Dear {name}")
+DRIVE = {"id": "d1", "company_name": "Acme", "eligibility_criteria": "CSE students with 7.0 CGPA, no backlogs",
+         "drive_date": datetime(2026, 5, 1, tzinfo=timezone.utc)}
+
+
+class RecordingTransport:
+    def __init__(self, fail=(), permanent=()):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.fail = set(fail)
+        self.permanent = set(permanent)
+
+    def send(self, messages):
+        failures = []
+        with self.lock:
+            for message in messages:
+                if message.student_id in self.permanent:
+                    failures.append(SendFailure(message, "550 no such user", permanent=True))
+                elif message.student_id in self.fail:
+                    failures.append(SendFailure(message, "421 try later"))
+                else:
+                    self.sent.append(message.student_id)
+        return failures
+
+
+def student(student_id, **fields):
+    return {"id": student_id, "name": student_id, "email": f"{student_id}@example.edu", "branch": "CSE",
+            "cgpa": 8.0, "backlogs_count": 0, **fields}
+
+
+def test_eligibility_query():
+    assert eligibility_query(DRIVE["eligibility_criteria"], ["CSE", "ECE"]) == {
+        "cgpa": {"$gte": 7.0}, "backlogs_count": 0, "branch": {"$in": ["CSE"]},
+    }
+
+
+def test_reannounce_reaches_only_students_not_notified_yet():
+    async def run():
+        db = FakeDatabase()
+        await db.students.insert_many([student(f"s{number:02d}") for number in range(0, 20, 2)]
+                                      + [student("ece", branch="ECE"), student("low", cgpa=6.0)])
+        transport = RecordingTransport(fail={"s04"}, permanent={"s06"})
+        result = await announce_drive(db, DRIVE, transport, template=TEMPLATE, batch_size=3, concurrency=2,
+                                      retries=1, retry_base=0)
+        assert result["eligible"] == 10 and result["failed"] == 2
+        assert sorted(transport.sent) == [f"s{number:02d}" for number in range(0, 20, 2) if number not in (4, 6)]
+
+        # New students sort between existing ones and shift every batch boundary
+        await db.students.insert_many([student(f"s{number:02d}") for number in range(1, 20, 4)])
+        transport = RecordingTransport()
+        await announce_drive(db, DRIVE, transport, template=TEMPLATE, batch_size=3, concurrency=2, retry_base=0)
+        # The transient failure is retried, the permanent one is not, nobody gets a second message
+        assert sorted(transport.sent) == ["s01", "s04", "s05", "s09", "s13", "s17"]
+
+        transport = RecordingTransport()
+        await announce_drive(db, DRIVE, transport, template=TEMPLATE, batch_size=3, retry_base=0)
+        assert transport.sent == []
+
+    asyncio.run(run())
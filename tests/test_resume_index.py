@@ -0,0 +1,55 @@
+import asyncio
+
+from resume_index import ResumeIndex, normalize_tokens
+from tests.fake_mongo import FakeDatabase
+
+
+async def postings(db):
+    return {posting["_id"]: sorted(posting["ids"]) async for posting in db.resume_postings.find({}) if posting["ids"]}
+
+
+def test_normalize_tokens_keeps_technology_names():
+    assert normalize_tokens("Python, C++ and Node.js; .NET developer.") == {"python", "c++", "node.js", ".net",
+                                                                            "developer"}
+
+
+def test_update_moves_postings_and_search_intersects():
+    async def run():
+        db = FakeDatabase()
+        index = ResumeIndex(db)
+        await index.update("s1", {"python", "sql"})
+        await index.update("s2", {"python", "java"})
+        assert await index.search("Python SQL") == {"s1"}
+        assert await index.update("s1", {"python", "go"}) == (1, 1)
+        assert await postings(db) == {"python": ["s1", "s2"], "go": ["s1"], "java": ["s2"]}
+        assert await index.search("sql") == set()
+        assert await index.search("") is None
+        await index.remove("s2")
+        assert await postings(db) == {"python": ["s1"], "go": ["s1"]}
+
+    asyncio.run(run())
+
+
+def test_concurrent_updates_leave_postings_matching_the_last_commit():
+    async def run():
+        db = FakeDatabase()
+        index = ResumeIndex(db)
+        await index.update("s1", {"x"})
+        original = db.resume_terms.replace_one
+        raced = False
+
+        async def replace_after_another_update(query, replacement, upsert=False):
+            nonlocal raced
+            if not raced:
+                # A second update of the same student commits between our read and write
+                raced = True
+                await index.update("s1", {"z"})
+            return await original(query, replacement, upsert=upsert)
+
+        db.resume_terms.replace_one = replace_after_another_update
+        await index.update("s1", {"y"})
+        terms = await db.resume_terms.find_one({"_id": "s1"})
+        assert terms["terms"] == ["y"]
+        assert await postings(db) == {"y": ["s1"]}
+
+    asyncio.run(run())
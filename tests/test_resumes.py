@@ -0,0 +1,103 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+from bson import ObjectId
+from gridfs.errors import NoFile
+
+import resumes
+from resumes import iter_grid_out, parse_range, _ZipSink
+from tests.fake_mongo import FakeDatabase
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=-", None),
+    # Multiple or non-byte ranges fall back to the whole file
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header, length", [
+    ("bytes=1000-", 1000),
+    ("bytes=5-4", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=0-", 0),
+    ("bytes=-10", 0),
+])
+def test_unsatisfiable_range(header, length):
+    with pytest.raises(ValueError):
+        parse_range(header, length)
+
+
+class FakeGridOut:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.length = len(data)
+
+    def seek(self, position):
+        self.stream.seek(position)
+
+    async def read(self, size):
+        return self.stream.read(size)
+
+
+async def collect(generator):
+    return b"".join([chunk async for chunk in generator])
+
+
+def test_iter_grid_out_yields_the_requested_slice():
+    data = bytes(range(256)) * 4096
+    assert asyncio.run(collect(iter_grid_out(FakeGridOut(data)))) == data
+    assert asyncio.run(collect(iter_grid_out(FakeGridOut(data), 1000, 300000))) == data[1000:300001]
+
+
+def test_zip_sink_produces_a_readable_archive():
+    sink = _ZipSink()
+    output = bytearray()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        with archive.open("a.pdf", "w", force_zip64=True) as member:
+            member.write(b"%PDF-1.4 resume")
+            output += sink.drain()
+    output += sink.drain()
+    with zipfile.ZipFile(io.BytesIO(bytes(output))) as archive:
+        assert archive.read("a.pdf") == b"%PDF-1.4 resume"
+
+
+def test_release_resume_keeps_shared_files(monkeypatch):
+    deleted = []
+
+    class Bucket:
+        async def delete(self, file_id):
+            if file_id in deleted:
+                raise NoFile(file_id)
+            deleted.append(file_id)
+
+    monkeypatch.setattr(resumes, "resume_bucket", lambda database: Bucket())
+    file_id = str(ObjectId())
+
+    async def run():
+        db = FakeDatabase()
+        await db.students.insert_one({"id": "a", "resume_file_id": file_id})
+        await db.students_archive.insert_one({"id": "b", "resume_file_id": file_id})
+        assert not await resumes.release_resume(db, file_id)
+        await db.students.delete_one({"id": "a"})
+        # Still used by an archived student
+        assert not await resumes.release_resume(db, file_id)
+        await db.students_archive.delete_one({"id": "b"})
+        assert await resumes.release_resume(db, file_id)
+        # A second release of the same file finds it gone
+        assert not await resumes.release_resume(db, file_id)
+        assert deleted == [ObjectId(file_id)]
+
+    asyncio.run(run())
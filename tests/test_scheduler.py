@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from tests.fake_mongo import FakeDatabase
+from scheduler import DriveLifecycleScheduler
+
+NOW = datetime(2026, 3, 2, 10, 0, tzinfo=timezone.utc)
+
+
+def make_scheduler(db, transitions):
+    async def on_transition(drive_ids, status):
+        transitions.append((sorted(drive_ids), status))
+    return DriveLifecycleScheduler(db, on_transition, drive_duration=timedelta(hours=24), horizon=timedelta(hours=6))
+
+
+async def statuses(db):
+    return {drive["id"]: drive["status"] async for drive in db.drives.find({})}
+
+
+def test_due_drives_move_upcoming_to_ongoing_to_completed():
+    async def run():
+        db = FakeDatabase()
+        await db.drives.insert_many([
+            {"id": "starting", "status": "upcoming", "drive_date": NOW - timedelta(minutes=1)},
+            {"id": "ending", "status": "ongoing", "drive_date": NOW - timedelta(hours=25)},
+            {"id": "later", "status": "upcoming", "drive_date": NOW + timedelta(hours=2)},
+            {"id": "outside", "status": "upcoming", "drive_date": NOW + timedelta(days=3)},
+            {"id": "cancelled", "status": "cancelled", "drive_date": NOW - timedelta(hours=1)},
+        ])
+        transitions = []
+        scheduler = make_scheduler(db, transitions)
+        await scheduler._load_window(NOW)
+        # Only transitions due within the horizon are held
+        assert len(scheduler) == 3
+        await scheduler._apply_due(NOW)
+        assert sorted(transitions) == [(["ending"], "completed"), (["starting"], "ongoing")]
+        assert await statuses(db) == {"starting": "ongoing", "ending": "completed", "later": "upcoming",
+                                      "outside": "upcoming", "cancelled": "cancelled"}
+
+        await scheduler._apply_due(NOW + timedelta(hours=3))
+        assert (["later"], "ongoing") in transitions
+        return scheduler
+
+    asyncio.run(run())
+
+
+def test_manual_change_since_loading_is_respected():
+    async def run():
+        db = FakeDatabase()
+        await db.drives.insert_one({"id": "d1", "status": "upcoming", "drive_date": NOW - timedelta(minutes=5)})
+        transitions = []
+        scheduler = make_scheduler(db, transitions)
+        await scheduler._load_window(NOW)
+        await db.drives.update_one({"id": "d1"}, {"$set": {"status": "cancelled"}})
+        await scheduler._apply_due(NOW)
+        assert transitions == []
+        assert (await db.drives.find_one({"id": "d1"}))["status"] == "cancelled"
+
+    asyncio.run(run())
+
+
+def test_invalidated_drive_is_rescheduled():
+    async def run():
+        db = FakeDatabase()
+        transitions = []
+        scheduler = make_scheduler(db, transitions)
+        await scheduler._load_window(NOW)
+        await db.drives.insert_one({"id": "new", "status": "upcoming", "drive_date": NOW + timedelta(hours=1)})
+        scheduler.invalidate("drives", "new")
+        scheduler.invalidate("students", "ignored")
+        assert scheduler._pending_ids == {"new"}
+        await scheduler._load_pending()
+        await scheduler._apply_due(NOW + timedelta(hours=1))
+        assert transitions == [(["new"], "ongoing")]
+
+    asyncio.run(run())
+
+
+def test_only_one_worker_holds_the_lease():
+    async def run():
+        db = FakeDatabase()
+        first = make_scheduler(db, [])
+        second = make_scheduler(db, [])
+        assert await first.lease.acquire()
+        assert not await second.lease.acquire()
+        await first.lease.release()
+        assert await second.lease.acquire()
+
+    asyncio.run(run())
+
+
+def test_window_is_reloaded_on_the_refresh_interval_without_a_transport():
+    async def run():
+        db = FakeDatabase()
+        scheduler = DriveLifecycleScheduler(db, None, horizon=timedelta(hours=6), refresh_interval=30)
+        await scheduler._load_window(NOW)
+        assert not scheduler._window_stale(NOW + timedelta(seconds=29))
+        # A drive created on another worker falls due inside the loaded window
+        await db.drives.insert_one({"id": "remote", "status": "upcoming", "drive_date": NOW + timedelta(minutes=5)})
+        assert scheduler._window_stale(NOW + timedelta(seconds=30))
+        await scheduler._load_window(NOW + timedelta(seconds=30))
+        assert len(scheduler) == 1
+
+        # With invalidations, the window is only reloaded when it runs out
+        scheduler = make_scheduler(db, [])
+        await scheduler._load_window(NOW)
+        assert not scheduler._window_stale(NOW + timedelta(hours=5))
+        assert scheduler._window_stale(NOW + timedelta(hours=6))
+
+    asyncio.run(run())
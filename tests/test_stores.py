@@ -0,0 +1,117 @@
+import threading
+import time
+
+from stores import IndexedStore, RWLock
+
+
+def test_readers_share_the_lock():
+    lock = RWLock()
+    inside = threading.Barrier(3, timeout=2)
+
+    def reader():
+        with lock.read():
+            # All three only get past the barrier if they hold the read side together
+            inside.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+    assert not inside.broken
+
+
+def test_writer_excludes_readers_and_is_preferred():
+    lock = RWLock()
+    events = []
+    reader_in = threading.Event()
+
+    def first_reader():
+        with lock.read():
+            reader_in.set()
+            time.sleep(0.1)
+            events.append("reader 1 done")
+
+    def writer():
+        with lock:
+            events.append("writer")
+
+    def late_reader():
+        with lock.read():
+            events.append("reader 2")
+
+    threads = [threading.Thread(target=first_reader)]
+    threads[0].start()
+    reader_in.wait(2)
+    threads.append(threading.Thread(target=writer))
+    threads[1].start()
+    time.sleep(0.02)
+    # Arrives while the writer waits, so it must queue behind it
+    threads.append(threading.Thread(target=late_reader))
+    threads[2].start()
+    for thread in threads:
+        thread.join(2)
+    assert events == ["reader 1 done", "writer", "reader 2"]
+
+
+def test_lock_is_reentrant_for_the_writer_and_readers():
+    lock = RWLock()
+    with lock:
+        with lock:
+            with lock.read():
+                with lock.read():
+                    pass
+        assert lock._writer == threading.get_ident()
+    assert lock._writer is None
+    with lock.read():
+        with lock.read():
+            pass
+    assert lock._readers == 0
+
+
+def test_concurrent_writes_and_filters_stay_consistent():
+    store = IndexedStore(indexed=("type",))
+    stop = threading.Event()
+    errors = []
+
+    def writer(offset):
+        for number in range(300):
+            entry_id = store.add({"name": f"clip {offset}-{number}", "type": "video" if number % 2 else "audio"})
+            if number % 3 == 0:
+                store.update(entry_id, {"type": "image"})
+            if number % 5 == 0:
+                store.delete(entry_id)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                for entry in store.filter(type="video"):
+                    assert entry["type"] == "video"
+                store.suggest("clip 1", 5)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=reader) for _ in range(3)]
+    writers = [threading.Thread(target=writer, args=(offset,)) for offset in range(4)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join(30)
+    stop.set()
+    for thread in readers:
+        thread.join(5)
+    assert errors == []
+    assert len(store) == 4 * 300 - 4 * 60
+    indexed = set().union(*store.indexes["type"].values())
+    assert indexed == set(store.entries)
+    store.prefix_index.fold()
+    assert {entry_id for _, entry_id in store.prefix_index.keys} == set(store.entries)
+
+
+def test_filter_returns_id_order_with_and_without_filters():
+    store = IndexedStore(indexed=("type",))
+    for entry_id in (5, 2, 9):
+        store.put({"id": entry_id, "name": f"clip {entry_id}", "type": "audio"})
+    assert [entry["id"] for entry in store.filter()] == [2, 5, 9]
+    assert [entry["id"] for entry in store.filter(type="audio")] == [2, 5, 9]